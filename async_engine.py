@@ -0,0 +1,414 @@
+"""
+This module is the asyncio engine of the import and the time range search. Instead of a few worker threads each waiting
+for its own request, a single event loop keeps hundreds of BatchWriteItem, BatchGetItem and Query requests in flight,
+which is what a latency bound import, eg: into a table in another region, needs. The number of requests in flight is
+bounded by a semaphore sized to the write capacity of the table, and the requests still go through the shared rate
+limiter and its backoff.
+The engine uses the aiobotocore client, which has to be installed separately (pip install aiobotocore). The
+local_dynamodb.LocalAsyncClient test double can be passed instead to run it offline.
+"""
+
+import asyncio
+import math
+import time
+from contextlib import asynccontextmanager
+from boto3.dynamodb.types import TypeDeserializer
+from botocore.config import Config
+from botocore.exceptions import ClientError
+import aws_clients
+import export_csv
+import item_schema
+import journal
+import metrics
+import rate_limiter
+import sharded_import
+import time_buckets
+import timestamps
+import input_output as io
+
+try:
+    from aiobotocore.session import get_session
+except ImportError:
+    get_session = None
+
+MAX_IN_FLIGHT = 256
+MIN_IN_FLIGHT = 8
+
+def in_flight_limit(units_per_second, units_per_item=1):
+    """
+    Returns the number of requests kept in flight. With provisioned capacity, one batch in flight per batch worth of
+    write units per second keeps the capacity used as long as a request takes less than a second, and more would only
+    wait on the rate limiter. Tables using on-demand billing get MAX_IN_FLIGHT.
+
+    Args:
+        units_per_second: The write capacity of the table, None for on-demand billing
+        units_per_item: The write units an item takes
+    """
+    if not units_per_second:
+        return MAX_IN_FLIGHT
+    return max(MIN_IN_FLIGHT, min(MAX_IN_FLIGHT, math.ceil(units_per_second / (export_csv.BATCH_SIZE * units_per_item))))
+
+@asynccontextmanager
+async def async_client(region_name=None, max_in_flight=MAX_IN_FLIGHT, retries=True):
+    """
+    Opens an aiobotocore DynamoDB client with a connection for every request in flight
+
+    Args:
+        region_name: The AWS region, the default region when not given
+        max_in_flight: The maximum number of requests in flight
+        retries: Whether botocore retries the failed requests, False when the caller retries them with the rate limiter
+    """
+    if get_session is None:
+        raise RuntimeError("The asyncio engine needs aiobotocore, please install it with: pip install aiobotocore")
+    config = Config(max_pool_connections=max_in_flight, tcp_keepalive=True)
+    if not retries:
+        config = config.merge(Config(retries=aws_clients.SINGLE_ATTEMPT))
+    async with get_session().create_client('dynamodb', region_name=region_name, config=config) as client:
+        yield client
+
+def run(coroutine):
+    """
+    Runs a coroutine of the engine on a new event loop and returns its result
+
+    Args:
+        coroutine: The coroutine, eg: import_file(...)
+    """
+    return asyncio.run(coroutine)
+
+async def import_file(table_name, csv_file_name, column_names, output_column_names, partition_key_col_name,
+                      sort_key_col_name, validation=True, time_bucket=None, timestamp_columns=timestamps.DEFAULT_TIMESTAMP_COLUMNS,
+                      status_file_name="write_status.csv", resume=False, schema=None, max_in_flight=None, client=None):
+    """
+    Imports the CSV file with the asyncio engine. The progress is recorded in the same journal as the threaded import,
+    so an interrupted import can be resumed by either.
+    It returns the number of rows processed and the number of rows that failed.
+
+    Args:
+        table_name: name of the table in DynamoDB
+        csv_file_name: The name of the CSV file
+        column_names: This is the list of the headers in the csv
+        output_column_names: This is the list of the headers in the status csv
+        partition_key_col_name: This is the name of the primary key (hash key)
+        sort_key_col_name: This is the name of the sort key (range key)
+        validation: Whether the items are read back from DynamoDB to validate the import
+        time_bucket: The granularity of the time bucket index of the table, hour or day
+        timestamp_columns: The names of the columns converted to ISO formatted timestamps
+        status_file_name: The name of the csv file receiving the status of every row
+        resume: Whether an interrupted import recorded in the journal is resumed
+        schema: The column types returned by item_schema.infer_schema, the values are stored as strings when not given
+        max_in_flight: The maximum number of requests in flight, sized from the capacity of the table when not given
+        client: The async DynamoDB client, an aiobotocore client is opened when not given
+    """
+    if client is None:
+        # The writes and the validation retry the throttled requests with the rate limiter, not within botocore
+        async with async_client(max_in_flight=max_in_flight or MAX_IN_FLIGHT, retries=False) as client:
+            return await import_file(table_name, csv_file_name, column_names, output_column_names, partition_key_col_name,
+                                     sort_key_col_name, validation, time_bucket, timestamp_columns, status_file_name,
+                                     resume, schema, max_in_flight, client)
+    # A journal written by a multi-process import is resumed shard by shard, with the status part files it started
+    journal_file_name, plan, part_file_names = sharded_import.prepare_journal(table_name, csv_file_name, status_file_name,
+                                                                              resume, 1)
+    summary = {'rows': 0, 'failed': 0, 'status_file': status_file_name}
+    for shard, part_file_name in zip(plan, part_file_names):
+        if shard['offset'] >= shard['end']:
+            continue
+        item_chunks = export_csv.read_item_chunks(csv_file_name, column_names, export_csv.CHUNK_SIZE, timestamp_columns,
+                                                  shard['offset'], shard['end'])
+        if time_bucket:
+            item_chunks = time_buckets.add_time_bucket(item_chunks, sort_key_col_name, time_bucket)
+        with journal.ImportJournal(journal_file_name) as import_journal:
+            shard_summary = await import_items(client, table_name, item_chunks, output_column_names,
+                                               partition_key_col_name, sort_key_col_name, validation, part_file_name,
+                                               item_schema.ItemSerializer(schema or {}), max_in_flight, import_journal,
+                                               shard['start'])
+        summary['rows'] += shard_summary['rows']
+        summary['failed'] += shard_summary['failed']
+    if len(plan) > 1:
+        sharded_import.merge_status_files(part_file_names, status_file_name)
+    journal.remove_journal(journal_file_name)
+    return summary
+
+async def import_items(client, table_name, item_chunks, output_column_names, partition_key_col_name, sort_key_col_name,
+                       validation=True, status_file_name="write_status.csv", serializer=None, max_in_flight=None,
+                       journal=None, shard_start=None):
+    """
+    Streams the CSV rows into DynamoDB chunk by chunk like export_csv.import_items, with every batch of a chunk written
+    by its own coroutine. The chunks are read ahead on a background thread so reading never blocks the event loop.
+    When a journal is given, the end offset of every finished chunk is committed to it and the status rows are appended
+    to an existing status file.
+    It returns the number of rows processed and the number of rows that failed.
+
+    Args:
+        client: The async DynamoDB client
+        table_name: name of the table in DynamoDB
+        item_chunks: The generator of CSV row chunks
+        output_column_names: This is the list of the headers in the status csv
+        partition_key_col_name: This is the name of the primary key (hash key)
+        sort_key_col_name: This is the name of the sort key (range key)
+        validation: Whether the items are read back from DynamoDB to validate the import
+        status_file_name: The name of the csv file receiving the status of every row
+        serializer: The item_schema.ItemSerializer turning the rows into low-level items, all strings when not given
+        max_in_flight: The maximum number of requests in flight, sized from the capacity of the table when not given
+        journal: The journal.ImportJournal recording the progress of the import
+        shard_start: The byte offset the rows started at, the key of the commits in the journal
+    """
+    io.console_output('Beginning csv to dynamoDB import with the asyncio engine\n')
+    if serializer is None:
+        serializer = item_schema.ItemSerializer({})
+    table_description = (await client.describe_table(TableName=table_name))['Table']
+    write_capacity = table_description.get('ProvisionedThroughput', {}).get('WriteCapacityUnits')
+    if table_description.get('BillingModeSummary', {}).get('BillingMode') == 'PAY_PER_REQUEST':
+        write_capacity = None
+    limiter = rate_limiter.RateLimiter(write_capacity or None)
+    semaphore = asyncio.Semaphore(max_in_flight or in_flight_limit(write_capacity))
+    loop = asyncio.get_running_loop()
+    chunks = export_csv.prefetch(item_chunks)
+    summary = {'rows': 0, 'failed': 0, 'status_file': status_file_name}
+    with io.StreamingCsvWriter(output_column_names, status_file_name, append=journal is not None) as status_writer, metrics.profiled():
+        while True:
+            item_collection = await loop.run_in_executor(None, next, chunks, None)
+            if item_collection is None:
+                break
+            stats = await write_items(client, table_name, item_collection, partition_key_col_name, sort_key_col_name,
+                                      serializer, limiter, semaphore)
+            if validation:
+                status_rows = await validate(client, table_name, item_collection, partition_key_col_name,
+                                             sort_key_col_name, export_csv.write_summary([stats]), serializer, limiter,
+                                             semaphore)
+            else:
+                status_rows = export_csv.acknowledged_status(item_collection, partition_key_col_name, sort_key_col_name,
+                                                             [stats])
+            status_writer.writerows(export_csv.count_failures(status_rows, summary))
+            if journal is not None and item_collection.end_offset is not None:
+                journal.commit(shard_start, item_collection.end_offset, status_writer)
+    summary['rows'] = status_writer.row_count
+    io.console_output('Finished import, ' + str(status_writer.row_count) + ' rows written to ' + status_writer.filename)
+    return summary
+
+async def write_items(client, table_name, item_collection, partition_key_col_name, sort_key_col_name, serializer, limiter,
+                      semaphore):
+    """
+    Writes the items in batches of 25, all the batches being sent concurrently within the limit of the semaphore.
+    It returns the statistics of the write in the format of export_csv.batch_write.
+
+    Args:
+        client: The async DynamoDB client
+        table_name: name of the table in DynamoDB
+        item_collection: This is the chunk of rows read from the CSV file
+        partition_key_col_name: This is the name of the primary key (hash key)
+        sort_key_col_name: This is the name of the sort key (range key)
+        serializer: The item_schema.ItemSerializer turning the rows into low-level items
+        limiter: The rate_limiter.RateLimiter of the table
+        semaphore: The semaphore bounding the requests in flight
+    """
+    stats = export_csv.write_stats('asyncio')
+    start_time = time.perf_counter()
+    with metrics.registry.stage('write') as counts:
+        await asyncio.gather(*[write_batch(client, table_name, batch_items, partition_key_col_name, sort_key_col_name,
+                                           serializer, limiter, semaphore, stats)
+                               for batch_items in export_csv.iter_batches(item_collection, export_csv.BATCH_SIZE,
+                                                                          [partition_key_col_name, sort_key_col_name])])
+        counts['rows'] = stats['items']
+    stats['seconds'] = time.perf_counter() - start_time
+    io.console_output('Inserted ' + str(stats['items']) + ' items using: asyncio')
+    return stats
+
+async def write_batch(client, table_name, batch_items, partition_key_col_name, sort_key_col_name, serializer, limiter,
+                      semaphore, stats):
+    """
+    Writes one batch of up to 25 items, retrying throttled requests and unprocessed items with the limiter's backoff
+    through the same helpers as export_csv.batch_write. A batch that still fails after MAX_RETRIES attempts is recorded in the statistics.
+
+    Args:
+        client: The async DynamoDB client
+        table_name: name of the table in DynamoDB
+        batch_items: The items of the batch
+        partition_key_col_name: This is the name of the primary key (hash key)
+        sort_key_col_name: This is the name of the sort key (range key)
+        serializer: The item_schema.ItemSerializer turning the rows into low-level items
+        limiter: The rate_limiter.RateLimiter of the table
+        semaphore: The semaphore bounding the requests in flight
+        stats: The statistics of the write, shared by the batches of the chunk
+    """
+    requests = export_csv.put_requests(batch_items, serializer)
+    attempt = 0
+    try:
+        while requests:
+            wait_start = time.perf_counter()
+            units_taken = await limiter.acquire_async(len(requests))
+            async with semaphore:
+                request_start = time.perf_counter()
+                metrics.registry.increment('rate_limit_wait_seconds', request_start - wait_start)
+                try:
+                    # The indexes are reported apart, the limiter only keeps to the capacity of the table
+                    response = await client.batch_write_item(RequestItems={table_name: requests},
+                                                             ReturnConsumedCapacity='INDEXES')
+                except ClientError as e:
+                    export_csv.write_throttled(e, attempt, limiter, stats)
+                    attempt += 1
+                    continue
+                finally:
+                    metrics.registry.observe('batch_write_seconds', time.perf_counter() - request_start)
+            requests = export_csv.record_write(response, table_name, requests, units_taken, attempt, limiter, stats)
+            attempt += 1
+    except Exception as e:
+        export_csv.write_failed(e, requests, partition_key_col_name, sort_key_col_name, serializer, stats)
+    stats['batches'] += 1
+
+async def validate(client, table_name, item_collection, partition_key_col_name, sort_key_col_name, result, serializer,
+                   limiter, semaphore):
+    """
+    Validates the items like export_csv.validate, with every batch of 100 keys looked up by its own coroutine. Rows
+    that are not found are written again and reported as failures.
+    It returns the status rows of the chunk.
+
+    Args:
+        client: The async DynamoDB client
+        table_name: name of the table in DynamoDB
+        item_collection: This is the chunk of rows read from the CSV file
+        partition_key_col_name: This is the name of the primary key (hash key)
+        sort_key_col_name: This is the name of the sort key (range key)
+        result: The result text of the write returned by export_csv.write_summary, reported with the rows that could not be found
+        serializer: The item_schema.ItemSerializer the items were written with
+        limiter: The rate_limiter.RateLimiter used when re-inserting missing rows
+        semaphore: The semaphore bounding the requests in flight
+    """
+    row_key = export_csv.row_key_function(partition_key_col_name, sort_key_col_name, serializer)
+    keys = list(dict.fromkeys((row[partition_key_col_name], row[sort_key_col_name]) for row in item_collection))
+    read_limiter = rate_limiter.RateLimiter(None)
+    found_keys = set()
+    errors = []
+    with metrics.registry.stage('validate', len(keys)):
+        await asyncio.gather(*[get_batch(client, table_name, key_batch, partition_key_col_name, sort_key_col_name,
+                                         serializer, read_limiter, semaphore, found_keys, errors)
+                               for key_batch in export_csv.iter_batches(keys, export_csv.VALIDATE_BATCH_SIZE)])
+    missing_rows = [row for row in item_collection if row_key(row) not in found_keys]
+    if missing_rows:
+        io.console_output('Failed to validate ' + str(len(missing_rows)) + ' items. Re-inserting the items')
+        metrics.registry.increment('items_reinserted', len(missing_rows))
+        await write_items(client, table_name, missing_rows, partition_key_col_name, sort_key_col_name, serializer,
+                          limiter, semaphore)
+    return list(export_csv.validated_status(item_collection, row_key, found_keys,
+                                            ",".join([result] + errors + ["Item not found"])))
+
+async def get_batch(client, table_name, key_batch, partition_key_col_name, sort_key_col_name, serializer, limiter,
+                    semaphore, found_keys, errors):
+    """
+    Looks up a batch of up to 100 keys with BatchGetItem, fetching only the key attributes, and adds the keys found
+    to found_keys. Unprocessed keys are retried with the limiter's backoff.
+
+    Args:
+        client: The async DynamoDB client
+        table_name: name of the table in DynamoDB
+        key_batch: The (partition key, sort key) values read from the CSV file
+        partition_key_col_name: This is the name of the primary key (hash key)
+        sort_key_col_name: This is the name of the sort key (range key)
+        serializer: The item_schema.ItemSerializer the items were written with
+        limiter: The rate_limiter.RateLimiter used to coordinate the backoff between the coroutines
+        semaphore: The semaphore bounding the requests in flight
+        found_keys: The set receiving the keys found
+        errors: The list receiving the errors that occurred
+    """
+    key_serializer = serializer.serialize
+    request = {
+        'Keys': [key_serializer({partition_key_col_name: each[0], sort_key_col_name: each[1]}) for each in key_batch],
+        'ProjectionExpression': '#pk, #sk',
+        'ExpressionAttributeNames': {'#pk': partition_key_col_name, '#sk': sort_key_col_name},
+    }
+    attempt = 0
+    try:
+        while request:
+            await limiter.acquire_async(0)
+            async with semaphore:
+                request_start = time.perf_counter()
+                try:
+                    response = await client.batch_get_item(RequestItems={table_name: request}, ReturnConsumedCapacity='TOTAL')
+                except ClientError as e:
+                    export_csv.read_throttled(e, attempt, limiter)
+                    attempt += 1
+                    continue
+                finally:
+                    metrics.registry.observe('batch_get_seconds', time.perf_counter() - request_start)
+            for item in response['Responses'].get(table_name, []):
+                found_keys.add((serializer.python_value(partition_key_col_name, serializer.raw_value(item[partition_key_col_name])),
+                                serializer.python_value(sort_key_col_name, serializer.raw_value(item[sort_key_col_name]))))
+            request = export_csv.record_read(response, table_name, attempt, limiter)
+            attempt += 1
+    except Exception as e:
+        io.console_output("Error: "+ str(e))
+        errors.append(str(e))
+
+async def query_time_range(table_name, sort_key_col_name, low_value, high_value, granularity, max_in_flight=MAX_IN_FLIGHT,
+                           client=None, output_file_name="data_from_db.csv"):
+    """
+    Searches a time range using the time bucket index like import_csv.query_time_range, with the query of every bucket
+    run by its own coroutine, and streams the items to the output file.
+    It returns the number of items exported.
+
+    Args:
+        table_name: name of the table in DynamoDB
+        sort_key_col_name: This is the name of the sort key (range key) holding the ISO formatted time
+        low_value: This is the low range of the filter
+        high_value: This is the high range of the filter
+        granularity: The granularity of the time bucket index of the table, hour or day
+        max_in_flight: The maximum number of queries in flight
+        client: The async DynamoDB client, an aiobotocore client is opened when not given
+        output_file_name: The name of the CSV file receiving the items, compressed according to its extension and
+            rotated to part files of io.MAX_PART_BYTES
+    """
+    if client is None:
+        async with async_client(max_in_flight=max_in_flight) as client:
+            return await query_time_range(table_name, sort_key_col_name, low_value, high_value, granularity,
+                                          max_in_flight, client, output_file_name)
+    buckets = time_buckets.buckets_between(low_value, high_value, granularity)
+    semaphore = asyncio.Semaphore(max_in_flight)
+    errors = []
+    with io.SpillCsvWriter(output_file_name, io.MAX_PART_BYTES) as spill_writer, metrics.registry.stage('query') as counts:
+        await asyncio.gather(*[query_bucket(client, table_name, sort_key_col_name, low_value, high_value, granularity,
+                                            bucket, semaphore, spill_writer, errors) for bucket in buckets])
+        counts['rows'] = spill_writer.row_count
+        if errors:
+            raise Exception(",".join(errors))
+    io.console_output("Exported " + str(spill_writer.row_count) + " items from " + str(len(buckets)) + " time buckets to " + ", ".join(spill_writer.filenames))
+    return spill_writer.row_count
+
+async def query_bucket(client, table_name, sort_key_col_name, low_value, high_value, granularity, bucket, semaphore,
+                       spill_writer, errors):
+    """
+    Queries the time bucket index for one bucket page by page and writes the items to the spill writer
+
+    Args:
+        client: The async DynamoDB client
+        table_name: name of the table in DynamoDB
+        sort_key_col_name: This is the name of the sort key (range key) holding the ISO formatted time
+        low_value: This is the low range of the filter
+        high_value: This is the high range of the filter
+        granularity: The granularity of the time bucket index of the table, hour or day
+        bucket: The time bucket to query
+        semaphore: The semaphore bounding the requests in flight
+        spill_writer: The input_output.SpillCsvWriter receiving the items
+        errors: The list receiving the errors that occurred
+    """
+    deserializer = TypeDeserializer()
+    request = {
+        'TableName': table_name,
+        'IndexName': time_buckets.index_name(granularity),
+        'KeyConditionExpression': '#bucket = :bucket AND #sk BETWEEN :low AND :high',
+        'ExpressionAttributeNames': {'#bucket': time_buckets.TIME_BUCKET_ATTRIBUTE, '#sk': sort_key_col_name},
+        'ExpressionAttributeValues': {':bucket': {'S': bucket}, ':low': {'S': low_value}, ':high': {'S': high_value}},
+        'ReturnConsumedCapacity': 'TOTAL',
+    }
+    try:
+        while True:
+            async with semaphore:
+                request_start = time.perf_counter()
+                response = await client.query(**request)
+                metrics.registry.observe('query_page_seconds', time.perf_counter() - request_start)
+            metrics.registry.increment('consumed_read_capacity', rate_limiter.consumed_units(response) or 0)
+            spill_writer.writerows([{name: deserializer.deserialize(value) for name, value in item.items()}
+                                    for item in response['Items']])
+            if 'LastEvaluatedKey' not in response:
+                break
+            request['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    except Exception as e:
+        errors.append("bucket " + bucket + ": " + str(e))
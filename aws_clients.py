@@ -0,0 +1,171 @@
+"""
+This module hands out the boto3 sessions, clients and resources used by the program, so they are created once per
+process and shared by every module and worker thread instead of being built again for every call. The connection pool
+of a client is sized to the number of worker threads using it, and TCP keep-alive keeps the pooled connections open
+between the batches. The description of a table is cached for a short time, since the key schema, billing mode and
+capacity are read by several steps of an import. The write and validation loops get clients that send every request
+once, so the throttled requests reach the shared rate limiter instead of being retried by botocore.
+"""
+
+import boto3
+import threading
+import time
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+# botocore's own default pool size, kept as the minimum
+MIN_POOL_CONNECTIONS = 10
+# Connections used next to the worker threads, by the prefetch thread and the main thread
+POOL_HEADROOM = 2
+DESCRIBE_TTL = 30
+# The retries of the clients whose callers retry throttled requests with the rate limiter
+SINGLE_ATTEMPT = {'total_max_attempts': 1}
+
+_lock = threading.Lock()
+_sessions = {}
+_clients = {}
+_resources = {}
+_descriptions = {}
+_handlers = []
+
+def pool_size(worker_count=None):
+    """
+    Returns the number of pooled connections of a client used by worker_count threads
+
+    Args:
+        worker_count: The number of threads sharing the client
+    """
+    return max(MIN_POOL_CONNECTIONS, (worker_count or 0) + POOL_HEADROOM)
+
+def session(region_name=None):
+    """
+    Returns the boto3 session of the region, the default region when not given
+
+    Args:
+        region_name: The AWS region
+    """
+    with _lock:
+        if region_name not in _sessions:
+            _sessions[region_name] = boto3.Session(region_name=region_name)
+            for event_name, handler in _handlers:
+                _sessions[region_name].events.register(event_name, handler)
+        return _sessions[region_name]
+
+def register_handler(event_name, handler):
+    """
+    Registers a botocore event handler on every session, eg: the request handler of local_dynamodb. Only the clients
+    created afterwards call the handler.
+
+    Args:
+        event_name: The botocore event, eg: before-send.dynamodb
+        handler: The function called with the event
+    """
+    with _lock:
+        _handlers.append((event_name, handler))
+        for dynamodb_session in _sessions.values():
+            dynamodb_session.events.register(event_name, handler)
+
+def client(worker_count=None, region_name=None, retries=True):
+    """
+    Returns the shared low-level DynamoDB client with a connection pool large enough for worker_count threads
+
+    Args:
+        worker_count: The number of threads using the client
+        region_name: The AWS region
+        retries: Whether botocore retries the failed requests, False when the caller retries them with the rate limiter
+    """
+    dynamodb_session = session(region_name)
+    # Clients are shared by region, so asking for the default region by name gives the same client
+    key = (dynamodb_session.region_name, pool_size(worker_count), retries)
+    with _lock:
+        if key not in _clients:
+            # Sessions are not thread safe, so clients are only created under the lock
+            _clients[key] = dynamodb_session.client('dynamodb', config=client_config(worker_count, retries))
+        return _clients[key]
+
+def resource(worker_count=None, region_name=None, retries=True):
+    """
+    Returns the shared DynamoDB resource with a connection pool large enough for worker_count threads
+
+    Args:
+        worker_count: The number of threads using the resource
+        region_name: The AWS region
+        retries: Whether botocore retries the failed requests, False when the caller retries them with the rate limiter
+    """
+    dynamodb_session = session(region_name)
+    key = (dynamodb_session.region_name, pool_size(worker_count), retries)
+    with _lock:
+        if key not in _resources:
+            _resources[key] = dynamodb_session.resource('dynamodb', config=client_config(worker_count, retries))
+        return _resources[key]
+
+def table(table_name, worker_count=None, region_name=None, retries=True):
+    """
+    Returns the boto3 DynamoDB resource which refers to the table, using the shared resource
+
+    Args:
+        table_name: name of the table in DynamoDB
+        worker_count: The number of threads using the table
+        region_name: The AWS region
+        retries: Whether botocore retries the failed requests, False when the caller retries them with the rate limiter
+    """
+    return resource(worker_count, region_name, retries).Table(table_name)
+
+def client_config(worker_count=None, retries=True):
+    """
+    Returns the botocore configuration of the clients
+
+    Args:
+        worker_count: The number of threads using the client
+        retries: Whether botocore retries the failed requests, otherwise every request is sent once
+    """
+    if retries:
+        return Config(max_pool_connections=pool_size(worker_count), tcp_keepalive=True)
+    return Config(max_pool_connections=pool_size(worker_count), tcp_keepalive=True, retries=SINGLE_ATTEMPT)
+
+def describe_table(table_name, refresh=False, region_name=None):
+    """
+    Returns the Table element of the describe_table response, cached for DESCRIBE_TTL seconds
+
+    Args:
+        table_name: name of the table in DynamoDB
+        refresh: Whether the description is read again even if it is cached, eg: before changing the capacity
+        region_name: The AWS region
+    """
+    key = (session(region_name).region_name, table_name)
+    with _lock:
+        cached = _descriptions.get(key)
+    if not refresh and cached is not None and cached[0] > time.monotonic():
+        return cached[1]
+    description = client(region_name=region_name).describe_table(TableName=table_name)['Table']
+    with _lock:
+        _descriptions[key] = (time.monotonic() + DESCRIBE_TTL, description)
+    return description
+
+def forget_table(table_name, region_name=None):
+    """
+    Removes the cached description of the table, after the table was created or updated
+
+    Args:
+        table_name: name of the table in DynamoDB
+        region_name: The AWS region
+    """
+    key = (session(region_name).region_name, table_name)
+    with _lock:
+        _descriptions.pop(key, None)
+
+def table_exists(table_name, region_name=None):
+    """
+    Checks whether the table exists with a single describe_table call
+
+    Args:
+        table_name: name of the table in DynamoDB
+        region_name: The AWS region
+    """
+    try:
+        describe_table(table_name, refresh=True, region_name=region_name)
+        return True
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ResourceNotFoundException':
+            return False
+        raise
@@ -0,0 +1,243 @@
+"""
+This module is the non-interactive batch mode of the program. It reads a manifest listing CSV files, the tables they
+are imported into and their key columns, and runs the imports concurrently. The worker threads and the write capacity
+are budgets shared by all the imports: every import running at the same time gets an equal share of the workers, and
+the tables being written to get an equal share of the write capacity, which is shared again between the tables left
+when the imports of a table finish. The outcome of every import is written to a single summary file.
+
+The manifest is a CSV file with the columns csv_file, table, partition_key and sort_key, and optionally validation,
+typed (y/n), column_types (eg: Count:N,Active:BOOL, the other types of a typed import are inferred), time_bucket
+(hour/day), timestamp_columns (comma separated, Time when blank, none) and status_file.
+Relative paths are relative to the manifest. The status file is named after the CSV file and the table by default, so
+a file imported into several tables gets one status file per table.
+"""
+
+import csv
+import os
+import threading
+import time
+import aws_clients
+import create_table
+import export_csv
+import item_schema
+import metrics
+import rate_limiter
+import sharded_import
+import time_buckets
+import timestamps
+import input_output as io
+from worker_pool import run_workers, iter_queue
+
+MANIFEST_COLUMNS = ('csv_file', 'table', 'partition_key', 'sort_key')
+SUMMARY_COLUMNS = ['CSV File', 'Table', 'Success/Failure', 'Rows', 'Failed Rows', 'Seconds', 'Status File', 'Error Description']
+SUMMARY_FILE_NAME = 'batch_summary.csv'
+DEFAULT_JOB_COUNT = 4
+TRUE_VALUES = ('y', 'yes', 'true', '1')
+
+def read_manifest(manifest_file_name):
+    """
+    Reads the jobs listed in the manifest. It raises a ValueError naming the line of the first incomplete job.
+
+    Args:
+        manifest_file_name: The name of the manifest CSV file
+    """
+    manifest_directory = os.path.dirname(os.path.abspath(manifest_file_name))
+    jobs = []
+    with open(manifest_file_name, newline='', encoding=export_csv.ENCODING) as manifest_file:
+        for line_number, row in enumerate(csv.DictReader(manifest_file), start=2):
+            row = {name.strip().lower(): (value or '').strip() for name, value in row.items() if name}
+            missing = [column for column in MANIFEST_COLUMNS if not row.get(column)]
+            if missing:
+                raise ValueError("Line " + str(line_number) + " of " + manifest_file_name + " has no " + ", ".join(missing))
+            csv_file_name = os.path.join(manifest_directory, row['csv_file'])
+            time_bucket = row.get('time_bucket', '').lower()
+            if time_bucket in time_buckets.GRANULARITIES and row['sort_key'] not in \
+                    timestamps.parse_timestamp_columns(row.get('timestamp_columns', '')):
+                raise ValueError("Line " + str(line_number) + " of " + manifest_file_name + " asks for a time bucket index of "
+                                 + row['sort_key'] + ", which is not a timestamp column")
+            jobs.append({
+                'number': len(jobs),
+                'csv_file_name': csv_file_name,
+                'table_name': row['table'],
+                'partition_key_col_name': row['partition_key'],
+                'sort_key_col_name': row['sort_key'],
+                'validation': row.get('validation', 'y').lower() in TRUE_VALUES,
+                'typed': row.get('typed', '').lower() in TRUE_VALUES or bool(row.get('column_types')),
+                'column_types': row.get('column_types', ''),
+                'time_bucket': time_bucket if time_bucket in time_buckets.GRANULARITIES else None,
+                'timestamp_columns': row.get('timestamp_columns', ''),
+                'status_file_name': os.path.join(manifest_directory, row['status_file']) if row.get('status_file')
+                                    else csv_file_name + "." + row['table'] + ".write_status.csv",
+            })
+    return jobs
+
+class CapacityBudget:
+    """
+    Shares a write capacity budget between the tables being imported. Every table has one rate limiter shared by all
+    its imports, kept to an equal share of the budget, or to the provisioned capacity of the table when that is lower.
+    The shares are rebalanced whenever a table starts or stops being written to.
+
+    Args:
+        units_per_second: The write capacity budget, None to keep every table to its own provisioned capacity
+    """
+    def __init__(self, units_per_second):
+        self.units_per_second = units_per_second
+        self.limiters = {}
+        self.capacities = {}
+        self.running = {}
+        self._lock = threading.Lock()
+
+    def start(self, table_name):
+        """
+        Registers an import into the table and returns the rate limiter of the table
+
+        Args:
+            table_name: name of the table in DynamoDB
+        """
+        with self._lock:
+            if table_name not in self.limiters:
+                self.limiters[table_name] = rate_limiter.from_table(aws_clients.table(table_name))
+                self.capacities[table_name] = self.limiters[table_name].max_rate
+            self.running[table_name] = self.running.get(table_name, 0) + 1
+            self._rebalance()
+            return self.limiters[table_name]
+
+    def finish(self, table_name):
+        """
+        Registers the end of an import into the table
+
+        Args:
+            table_name: name of the table in DynamoDB
+        """
+        with self._lock:
+            self.running[table_name] -= 1
+            if not self.running[table_name]:
+                del self.running[table_name]
+            self._rebalance()
+
+    def _rebalance(self):
+        if not self.units_per_second or not self.running:
+            return
+        share = self.units_per_second / len(self.running)
+        for table_name in self.running:
+            capacity = self.capacities[table_name]
+            self.limiters[table_name].set_capacity(min(capacity, share) if capacity else share)
+
+def run_batch(manifest_file_name, job_count=DEFAULT_JOB_COUNT, worker_count=None, write_capacity=None, resume=False,
+              summary_file_name=SUMMARY_FILE_NAME):
+    """
+    Imports every CSV file listed in the manifest, running job_count imports at the same time. The tables that do not
+    exist are created with on-demand billing first.
+    It returns the summary rows of the jobs, in the order of the manifest.
+
+    Args:
+        manifest_file_name: The name of the manifest CSV file
+        job_count: The number of imports running at the same time
+        worker_count: The number of writer threads shared by the imports running at the same time
+        write_capacity: The write capacity units per second shared by the tables, the provisioned capacity of every
+            table when not given
+        resume: Whether the interrupted imports recorded in the journals are resumed
+        summary_file_name: The name of the csv file receiving the outcome of every import
+    """
+    jobs = read_manifest(manifest_file_name)
+    if not jobs:
+        io.console_output("The manifest " + manifest_file_name + " lists no files")
+        return []
+    job_count = max(1, min(job_count, len(jobs)))
+    job_worker_count = max(1, (worker_count or job_count * export_csv.DEFAULT_WORKER_COUNT) // job_count)
+    created = set()
+    for job in jobs:
+        if job['table_name'] not in created:
+            created.add(job['table_name'])
+            if not create_table.create_dynamoDB_table(job['table_name'], job['partition_key_col_name'],
+                                                      job['sort_key_col_name'], job['time_bucket'],
+                                                      billing_mode='PAY_PER_REQUEST'):
+                io.console_output("Created table: " + job['table_name'])
+    io.console_output("Importing " + str(len(jobs)) + " files with " + str(job_count) + " concurrent imports of "
+                      + str(job_worker_count) + " threads")
+    metrics.registry.reset()
+    budget = CapacityBudget(write_capacity)
+    summary_rows = []
+    for job_rows in run_workers(run_jobs, jobs, job_count, args=(budget, job_worker_count, resume)):
+        summary_rows.extend(job_rows)
+    summary_rows.sort(key=lambda summary_row: summary_row['number'])
+    with io.StreamingCsvWriter(SUMMARY_COLUMNS, summary_file_name) as summary_writer:
+        summary_writer.writerows(summary_rows)
+    failed_jobs = sum(1 for summary_row in summary_rows if summary_row['Success/Failure'] != "Success")
+    io.console_output("Imported " + str(sum(summary_row['Rows'] for summary_row in summary_rows)) + " rows from "
+                      + str(len(summary_rows)) + " files, " + str(failed_jobs) + " of them with failures. Summary written to "
+                      + summary_file_name)
+    return summary_rows
+
+def run_jobs(budget, worker_count, resume, work_queue, thread_name):
+    """
+    Runs the imports taken off the work queue one after the other and returns their summary rows
+
+    Args:
+        budget: The CapacityBudget shared by the imports
+        worker_count: The number of writer threads of every import
+        resume: Whether the interrupted imports recorded in the journals are resumed
+        work_queue: The queue of jobs shared by the threads
+        thread_name: The name of the thread
+    """
+    return [run_job(job, budget, worker_count, resume) for job in iter_queue(work_queue)]
+
+def run_job(job, budget, worker_count, resume):
+    """
+    Imports one CSV file of the manifest in this process and returns its summary row. An import that fails is
+    reported in the summary row without stopping the other imports.
+
+    Args:
+        job: The dictionary describing the import, read from the manifest
+        budget: The CapacityBudget shared by the imports
+        worker_count: The number of writer threads
+        resume: Whether an interrupted import recorded in the journal is resumed
+    """
+    summary_row = {
+        'number': job['number'],
+        'CSV File': job['csv_file_name'],
+        'Table': job['table_name'],
+        'Success/Failure': "Failure",
+        'Rows': 0,
+        'Failed Rows': 0,
+        'Status File': job['status_file_name'],
+        'Error Description': "",
+    }
+    start_time = time.perf_counter()
+    started = False
+    try:
+        limiter = budget.start(job['table_name'])
+        started = True
+        return_values = export_csv.read_csv(job['csv_file_name'])
+        if return_values is None:
+            raise ValueError("The CSV file could not be read")
+        column_names, item_chunks, output_column_names = return_values
+        item_chunks.close()
+        timestamp_columns = timestamps.parse_timestamp_columns(job['timestamp_columns'], column_names)
+        table_description = aws_clients.describe_table(job['table_name'])
+        schema = None
+        if job['typed']:
+            schema = item_schema.infer_schema(job['csv_file_name'], column_names,
+                                              item_schema.key_types_from_table(table_description), timestamp_columns,
+                                              item_schema.parse_column_types(job['column_types'], column_names))
+        # An existing table keeps the time bucket index it was created with
+        time_bucket = time_buckets.granularity_from_table(table_description)
+        if time_bucket:
+            time_buckets.check_sort_key(job['sort_key_col_name'], timestamp_columns)
+        summary = sharded_import.import_sharded(job['table_name'], job['csv_file_name'], column_names, output_column_names,
+                                                job['partition_key_col_name'], job['sort_key_col_name'], 1, worker_count,
+                                                job['validation'], time_bucket, timestamp_columns,
+                                                status_file_name=job['status_file_name'], resume=resume, schema=schema,
+                                                limiter=limiter)
+        summary_row['Rows'] = summary['rows']
+        summary_row['Failed Rows'] = summary['failed']
+        summary_row['Success/Failure'] = "Success" if not summary['failed'] else "Failure"
+    # The import functions exit on fatal errors, which only ends this import when it runs in a worker thread
+    except (Exception, SystemExit) as e:
+        io.console_output("The import of " + job['csv_file_name'] + " failed because of the following error: " + str(e))
+        summary_row['Error Description'] = str(e) if isinstance(e, Exception) else "The import was stopped, see the console output"
+    finally:
+        if started:
+            budget.finish(job['table_name'])
+    summary_row['Seconds'] = round(time.perf_counter() - start_time, 1)
+    return summary_row
@@ -0,0 +1,260 @@
+"""
+This module is the benchmark harness of the program. It generates a synthetic device log CSV shaped like sample.csv,
+imports it with validation and reads it back with a scan, a query and a time range query, all against the in-memory stand-in of
+local_dynamodb, so the runs are reproducible and never touch AWS. Every phase reports its rows per second, its own
+peak memory and the number of requests by operation, and the run can be saved as the baseline of its scenario. Later runs of the same scenario are compared with the baseline, and a slowdown or memory growth beyond the
+tolerance is reported as a regression with exit code 1.
+
+Usage: python benchmark.py --rows 100000 [--workers 3] [--latency 0.005] [--throttle-rate 0.01] [--save-baseline]
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+import aws_clients
+import create_table
+import export_csv
+import import_csv
+import local_dynamodb
+import metrics
+import sharded_import
+
+DEFAULT_ROWS = 10000
+TABLE_NAME = 'benchmark'
+PARTITION_KEY = 'Mac ID'
+SORT_KEY = 'Time'
+ROWS_PER_DEVICE = 50
+TIME_BUCKET = 'hour'
+# The time range phase reads the records of the first minutes of every device
+TIME_RANGE_MINUTES = ROWS_PER_DEVICE // 2
+BASELINE_FILE_NAME = 'benchmark_baselines.json'
+# A phase is a regression when it is this much slower, or allocates this much more memory, than the baseline
+SPEED_TOLERANCE = 0.15
+MEMORY_TOLERANCE = 0.25
+FIRST_TIME = datetime(2019, 4, 16)
+CUSTOMERS = ['ChoiceMMed', 'Nonin', 'Masimo', 'Contec']
+MODELS = ['C228', 'C229', '3230', 'MD300']
+FIRMWARES = ['1.1.2', '1.1.3', '2.0.0']
+OPERATORS = ['zhou', 'smith', 'garcia', 'kumar']
+
+def generate_csv(csv_file_name, rows, seed=0):
+    """
+    Writes a CSV file of rows device log records with the columns of sample.csv. Every device logs ROWS_PER_DEVICE
+    records a minute apart, so the Mac ID and Time make a unique key.
+
+    Args:
+        csv_file_name: The name of the CSV file to write
+        rows: The number of rows
+        seed: The seed of the random generator, the same seed always gives the same file
+    """
+    generator = random.Random(seed)
+    device_count = max(1, rows // ROWS_PER_DEVICE)
+    devices = []
+    for device in range(device_count):
+        devices.append(','.join([
+            '%012x' % generator.getrandbits(48),
+            generator.choice(CUSTOMERS),
+            'iFeelC',
+            generator.choice(MODELS),
+            generator.choice(FIRMWARES),
+            generator.choice(['yes', 'no']),
+            generator.choice(['yes', 'no']),
+            'choicemmed',
+            generator.choice(OPERATORS),
+        ]))
+    with open(csv_file_name, 'w', newline='') as csv_file:
+        csv_file.write('Mac ID,Customer,DeviceName,Model,Firmware,SPO2,BVP,LoggedUser,OperatorName,Time\n')
+        for row in range(rows):
+            logged = FIRST_TIME + timedelta(minutes=row // device_count)
+            # The same d/m/yy h:mm layout as sample.csv, without leading zeros
+            csv_file.write(devices[row % device_count] + ',' + str(logged.day) + '/' + str(logged.month) + '/'
+                           + logged.strftime('%y') + ' ' + str(logged.hour) + ':' + logged.strftime('%M') + '\n')
+
+def reset_peak_memory():
+    """
+    Resets the peak resident memory the kernel keeps for the process, which Linux allows through /proc. It returns
+    False where the peak cannot be reset, the allocations of a phase are then traced with tracemalloc, which makes the
+    phases several times slower.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+        return True
+    except OSError:
+        return False
+
+def peak_resident_mb():
+    """
+    Returns the peak resident memory of the process since reset_peak_memory in MB
+    """
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith('VmHWM:'):
+                return round(int(line.split()[1]) / 1024, 1)
+
+def run_phase(name, rows, function, local, results):
+    """
+    Runs one phase of the benchmark and records its measurements in results. The peak memory is measured from the
+    start of the phase, so it is not hidden by an earlier phase that used more.
+
+    Args:
+        name: The name of the phase
+        rows: The number of rows the phase processes
+        function: The function running the phase
+        local: The local_dynamodb.LocalDynamoDB answering the requests
+        results: The dictionary receiving the measurements of every phase
+    """
+    metrics.registry.reset()
+    requests_before = dict(local.request_counts)
+    traced = not reset_peak_memory()
+    if traced:
+        tracemalloc.start()
+    try:
+        start_time = time.perf_counter()
+        function()
+        seconds = time.perf_counter() - start_time
+        peak_memory_mb = round(tracemalloc.get_traced_memory()[1] / (1024 * 1024), 1) if traced else peak_resident_mb()
+    finally:
+        if traced:
+            tracemalloc.stop()
+    results[name] = {
+        'rows': rows,
+        'seconds': round(seconds, 3),
+        'rows_per_second': round(rows / seconds, 1) if seconds else 0,
+        'peak_memory_mb': peak_memory_mb,
+        'requests': {operation: count - requests_before.get(operation, 0) for operation, count in local.request_counts.items()
+                     if count != requests_before.get(operation, 0)},
+        'stages': {stage_name: stage['seconds'] for stage_name, stage in metrics.registry.snapshot()['stages'].items()},
+    }
+
+def run_benchmark(rows, worker_count, validation=True, latency=0, throttle_rate=0, unprocessed_rate=0, seed=0):
+    """
+    Generates the CSV file and runs the write, scan, query and time range phases against a new local stand-in. The
+    table has a time bucket index, so the writes also pay for the index like a real import would. The files of the run
+    are written to a temporary directory which is removed afterwards.
+    It returns the measurements of every phase.
+
+    Args:
+        rows: The number of rows of the generated CSV file
+        worker_count: The number of threads writing and reading
+        validation: Whether the import reads the items back to validate them
+        latency: The seconds added to every request
+        throttle_rate: The share of the requests throttled
+        unprocessed_rate: The share of the items of a batch request left unprocessed
+        seed: The seed of the generated file and of the stand-in
+    """
+    # The requests never leave the process, but botocore still signs them
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'benchmark')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'benchmark')
+    local = local_dynamodb.LocalDynamoDB(latency=latency, throttle_rate=throttle_rate, unprocessed_rate=unprocessed_rate,
+                                         seed=seed)
+    # aws_clients creates its clients when they are first needed, so they all go to the stand-in
+    local.install()
+    results = {}
+    working_directory = os.getcwd()
+    run_directory = tempfile.mkdtemp(prefix='csvtodynamodb-benchmark-')
+    try:
+        os.chdir(run_directory)
+        csv_file_name = os.path.join(run_directory, 'benchmark.csv')
+        generate_csv(csv_file_name, rows, seed)
+        create_table.create_dynamoDB_table(TABLE_NAME, PARTITION_KEY, SORT_KEY, TIME_BUCKET, billing_mode='PAY_PER_REQUEST')
+        column_names, item_chunks, output_column_names = export_csv.read_csv(csv_file_name)
+        item_chunks.close()
+        run_phase('write', rows, lambda: sharded_import.import_sharded(
+            TABLE_NAME, csv_file_name, column_names, output_column_names, PARTITION_KEY, SORT_KEY, 1,
+            worker_count, validation, TIME_BUCKET), local, results)
+        table = aws_clients.table(TABLE_NAME, worker_count)
+        run_phase('scan', rows, lambda: import_csv.scan_table(TABLE_NAME, table, None, None, None,
+                                                              worker_count=worker_count), local, results)
+        with open(csv_file_name) as csv_file:
+            csv_file.readline()
+            device = csv_file.readline().split(',')[0]
+        run_phase('query', min(rows, ROWS_PER_DEVICE), lambda: import_csv.query_table(TABLE_NAME, table, PARTITION_KEY, device),
+                  local, results)
+        device_count = max(1, rows // ROWS_PER_DEVICE)
+        last_time = FIRST_TIME + timedelta(minutes=TIME_RANGE_MINUTES - 1)
+        run_phase('time_range', min(rows, TIME_RANGE_MINUTES * device_count), lambda: import_csv.query_time_range(
+            TABLE_NAME, table, SORT_KEY, FIRST_TIME.isoformat(), last_time.isoformat(), TIME_BUCKET,
+            worker_count=worker_count), local, results)
+    finally:
+        os.chdir(working_directory)
+        shutil.rmtree(run_directory, ignore_errors=True)
+    results['throttled_requests'] = dict(local.throttled_counts)
+    return results
+
+def scenario_name(arguments):
+    return ("rows=" + str(arguments.rows) + ",workers=" + str(arguments.workers) + ",validation="
+            + str(not arguments.no_validation) + ",latency=" + str(arguments.latency) + ",throttle="
+            + str(arguments.throttle_rate) + ",unprocessed=" + str(arguments.unprocessed_rate))
+
+def compare(results, baseline):
+    """
+    Compares the results of a run with the baseline of its scenario and returns the description of every regression
+
+    Args:
+        results: The measurements returned by run_benchmark
+        baseline: The measurements saved as the baseline
+    """
+    regressions = []
+    for phase, measured in results.items():
+        if phase not in baseline or 'rows_per_second' not in measured:
+            continue
+        expected = baseline[phase]
+        if measured['rows_per_second'] < expected['rows_per_second'] * (1 - SPEED_TOLERANCE):
+            regressions.append(phase + ": " + str(measured['rows_per_second']) + " rows/s, baseline "
+                               + str(expected['rows_per_second']) + " rows/s")
+        if measured['peak_memory_mb'] > expected['peak_memory_mb'] * (1 + MEMORY_TOLERANCE):
+            regressions.append(phase + ": peak memory " + str(measured['peak_memory_mb']) + " MB, baseline "
+                               + str(expected['peak_memory_mb']) + " MB")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks the import and export against an in-memory DynamoDB stand-in")
+    parser.add_argument('--rows', type=int, default=DEFAULT_ROWS, help="number of rows of the generated CSV file")
+    parser.add_argument('--workers', type=int, default=3, help="number of writer and reader threads")
+    parser.add_argument('--no-validation', action='store_true', help="import without reading the items back")
+    parser.add_argument('--latency', type=float, default=0, help="seconds added to every request")
+    parser.add_argument('--throttle-rate', type=float, default=0, help="share of the requests throttled")
+    parser.add_argument('--unprocessed-rate', type=float, default=0, help="share of batch items left unprocessed")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--baselines', default=BASELINE_FILE_NAME, help="file holding the baselines of every scenario")
+    parser.add_argument('--save-baseline', action='store_true', help="save this run as the baseline of its scenario")
+    arguments = parser.parse_args(argv)
+    results = run_benchmark(arguments.rows, arguments.workers, not arguments.no_validation, arguments.latency,
+                            arguments.throttle_rate, arguments.unprocessed_rate, arguments.seed)
+    scenario = scenario_name(arguments)
+    print("\nScenario " + scenario)
+    for phase, measured in results.items():
+        if 'rows_per_second' in measured:
+            print(phase + ": " + str(measured['rows_per_second']) + " rows/s, " + str(measured['seconds']) + "s, peak memory "
+                  + str(measured['peak_memory_mb']) + " MB, requests " + json.dumps(measured['requests']))
+    baselines = {}
+    if os.path.exists(arguments.baselines):
+        with open(arguments.baselines) as baseline_file:
+            baselines = json.load(baseline_file)
+    if arguments.save_baseline:
+        baselines[scenario] = results
+        with open(arguments.baselines, 'w') as baseline_file:
+            json.dump(baselines, baseline_file, indent=2, sort_keys=True)
+        print("Saved the baseline of the scenario to " + arguments.baselines)
+        return 0
+    if scenario not in baselines:
+        print("No baseline for this scenario, run with --save-baseline to save one")
+        return 0
+    regressions = compare(results, baselines[scenario])
+    for regression in regressions:
+        print("Regression " + regression)
+    if not regressions:
+        print("No regression against the baseline")
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
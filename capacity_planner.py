@@ -0,0 +1,133 @@
+"""
+This module works out how much capacity an import needs before it starts. A sample of the CSV file is used to estimate
+the number of rows and the size of an item in DynamoDB's 1 KB write units, which gives the write capacity needed to
+finish the import in the requested time and what it will cost, either with provisioned capacity or on-demand billing.
+The prices are the us-east-1 list prices and should be adjusted for other regions.
+"""
+
+import csv
+import math
+import os
+from itertools import islice
+import export_csv
+import input_output as io
+
+SAMPLE_POINTS = 10
+SAMPLE_ROWS_PER_POINT = 100
+# DynamoDB adds about 100 bytes of overhead per item
+ITEM_OVERHEAD_BYTES = 100
+WRITE_UNIT_BYTES = 1024
+READ_UNIT_BYTES = 4096
+MIN_CAPACITY = 5
+DEFAULT_TARGET_MINUTES = 60
+MAX_PROVISIONED_WRITE_CAPACITY = 40000
+PROVISIONED_WCU_HOUR_PRICE = 0.00065
+PROVISIONED_RCU_HOUR_PRICE = 0.00013
+ON_DEMAND_WRITE_MILLION_PRICE = 0.625
+ON_DEMAND_READ_MILLION_PRICE = 0.125
+
+def sample_csv(csv_file_name):
+    """
+    Reads a sample of rows from SAMPLE_POINTS places spread over the CSV file and estimates the number of rows and the
+    average size of an item. Compressed files and rotated exports can not be read from random places, so the rows are
+    sampled from their beginning and the lines of the rest of the file are counted.
+    It returns the estimates as a dictionary.
+
+    Args:
+        csv_file_name: The name of the CSV file
+    """
+    seekable = not io.compression_of(csv_file_name) and len(io.part_file_names(csv_file_name)) == 1
+    file_size = os.path.getsize(csv_file_name)
+    with io.open_binary(csv_file_name) as csv_file:
+        header = csv_file.readline()
+        data_start = csv_file.tell()
+        column_names = [each for each in next(csv.reader([header.decode(export_csv.ENCODING)])) if each]
+        name_bytes = sum(len(each.encode(export_csv.ENCODING)) for each in column_names)
+        line_bytes = 0
+        value_bytes = 0
+        write_units = 0
+        read_units = 0
+        row_count = 0
+        remaining_rows = 0
+        for point in range(SAMPLE_POINTS):
+            if seekable:
+                csv_file.seek(data_start + (file_size - data_start) * point // SAMPLE_POINTS)
+                if point:
+                    # Skip the rest of the line the seek landed in
+                    csv_file.readline()
+                lines = csv_file.readlines(SAMPLE_ROWS_PER_POINT * 256)[:SAMPLE_ROWS_PER_POINT]
+            else:
+                lines = list(islice(csv_file, SAMPLE_ROWS_PER_POINT))
+            for line in lines:
+                item_bytes = name_bytes + len(line.rstrip(b'\r\n')) - line.count(b',') + ITEM_OVERHEAD_BYTES
+                line_bytes += len(line)
+                value_bytes += item_bytes
+                # Every item is rounded up to whole units, so the units are counted per item rather than from the average size
+                write_units += math.ceil(item_bytes / WRITE_UNIT_BYTES)
+                read_units += math.ceil(item_bytes / READ_UNIT_BYTES)
+                row_count += 1
+        if not seekable:
+            remaining_rows = sum(block.count(b'\n') for block in iter(lambda: csv_file.read(io.BUFFER_BYTES), b''))
+    if not row_count:
+        return {'rows': 0, 'item_bytes': 0, 'write_units_per_item': 0, 'read_units_per_item': 0}
+    return {
+        'rows': int((file_size - data_start) / (line_bytes / row_count)) if seekable
+                else row_count + remaining_rows,
+        'item_bytes': int(value_bytes / row_count),
+        'write_units_per_item': write_units / row_count,
+        # Validation reads are eventually consistent, which costs half a read unit
+        'read_units_per_item': read_units / row_count / 2,
+    }
+
+def plan_capacity(csv_file_name, target_minutes, validation=True, index_count=0):
+    """
+    Estimates the capacity needed to import the CSV file in target_minutes and picks the cheaper of provisioned capacity
+    and on-demand billing. On-demand billing is used when the write capacity needed is above the table limit.
+    It returns the plan as a dictionary.
+
+    Args:
+        csv_file_name: The name of the CSV file
+        target_minutes: The number of minutes the import should take
+        validation: Whether the items are read back to validate the import
+        index_count: The number of global secondary indexes every item is also written to
+    """
+    estimate = sample_csv(csv_file_name)
+    seconds = max(1, float(target_minutes) * 60)
+    write_units = math.ceil(estimate['rows'] * estimate['write_units_per_item'] * (1 + index_count))
+    read_units = estimate['rows'] * estimate['read_units_per_item'] if validation else 0
+    write_capacity = max(MIN_CAPACITY, math.ceil(write_units / (1 + index_count) / seconds))
+    read_capacity = max(MIN_CAPACITY, math.ceil(read_units / seconds))
+    # Provisioned capacity is billed by the hour
+    hours = math.ceil(seconds / 3600)
+    provisioned_cost = hours * (write_capacity * (1 + index_count) * PROVISIONED_WCU_HOUR_PRICE
+                                + read_capacity * (1 + index_count) * PROVISIONED_RCU_HOUR_PRICE)
+    on_demand_cost = write_units / 1000000 * ON_DEMAND_WRITE_MILLION_PRICE + read_units / 1000000 * ON_DEMAND_READ_MILLION_PRICE
+    if write_capacity > MAX_PROVISIONED_WRITE_CAPACITY or on_demand_cost < provisioned_cost:
+        billing_mode = 'PAY_PER_REQUEST'
+    else:
+        billing_mode = 'PROVISIONED'
+    return dict(estimate, **{
+        'write_units': write_units,
+        'write_capacity': write_capacity,
+        'read_capacity': read_capacity,
+        'billing_mode': billing_mode,
+        'provisioned_cost': round(provisioned_cost, 4),
+        'on_demand_cost': round(on_demand_cost, 4),
+        'estimated_cost': round(on_demand_cost if billing_mode == 'PAY_PER_REQUEST' else provisioned_cost, 4),
+    })
+
+def describe_plan(plan):
+    """
+    Returns a description of the plan to show to the user
+
+    Args:
+        plan: The plan returned by plan_capacity
+    """
+    description = ("Estimated " + str(plan['rows']) + " rows of about " + str(plan['item_bytes']) + " bytes, "
+                   + str(plan['write_units']) + " write units in total.\n")
+    if plan['billing_mode'] == 'PAY_PER_REQUEST':
+        description += "Using on-demand billing, estimated cost $" + str(plan['estimated_cost'])
+    else:
+        description += ("Provisioning " + str(plan['write_capacity']) + " write and " + str(plan['read_capacity'])
+                        + " read units, estimated cost $" + str(plan['estimated_cost']))
+    return description + " (on-demand $" + str(plan['on_demand_cost']) + ", provisioned $" + str(plan['provisioned_cost']) + ")"
@@ -2,23 +2,72 @@
 This module is responsible for creating the DynamoDB table
 """
 
-import boto3
+import aws_clients
+import time_buckets
 
 
-def create_dynamoDB_table(table_name, partition_key_col_name, sort_key_col_name):
+def create_dynamoDB_table(table_name, partition_key_col_name, sort_key_col_name, time_bucket=None, read_capacity=100,
+                          write_capacity=300, billing_mode='PROVISIONED'):
     """
     This function checks if a table already exists with the same name. If yes, it exits the program. If not, it makes a new table.
+    When time_bucket is given, the table also gets a global secondary index on the TimeBucket attribute and the sort key,
+    which is used to search time ranges with queries instead of a scan.
+    The capacity is usually taken from the plan made by capacity_planner.plan_capacity.
 
     Args:
         table_name: name of the table in DynamoDB
         partition_key_col_name: This is the name of the primary key (hash key)
         sort_key_col_name: This is the name of the sort key (range key)
+        time_bucket: The granularity of the time bucket index, hour or day. No index is created when not given
+        read_capacity: The provisioned read capacity units of the table and its index
+        write_capacity: The provisioned write capacity units of the table and its index
+        billing_mode: PROVISIONED, or PAY_PER_REQUEST for on-demand billing in which case no capacity is provisioned
     """
-    dynamodb_client = boto3.client('dynamodb')
-    response = dynamodb_client.list_tables()
-    if table_name in response['TableNames']:
+    dynamodb_client = aws_clients.client()
+    if aws_clients.table_exists(table_name):
         return 1
     else:
+        extra_args = {}
+        if time_bucket:
+            extra_args['GlobalSecondaryIndexes'] = [{
+                'IndexName': time_buckets.index_name(time_bucket),
+                'KeySchema': [
+                    {
+                        'AttributeName': time_buckets.TIME_BUCKET_ATTRIBUTE,
+                        'KeyType': 'HASH'
+                    },
+                    {
+                        'AttributeName': sort_key_col_name,
+                        'KeyType': 'RANGE'
+                    },
+                ],
+                'Projection': {
+                    'ProjectionType': 'ALL'
+                },
+            }]
+            if billing_mode == 'PROVISIONED':
+                extra_args['GlobalSecondaryIndexes'][0]['ProvisionedThroughput'] = {
+                    'ReadCapacityUnits': read_capacity,
+                    'WriteCapacityUnits': write_capacity,
+                }
+        if billing_mode == 'PROVISIONED':
+            extra_args['ProvisionedThroughput'] = {
+                'ReadCapacityUnits': read_capacity,
+                'WriteCapacityUnits': write_capacity,
+            }
+        attribute_definitions = [{
+            'AttributeName': partition_key_col_name,
+            'AttributeType': 'S',
+        },
+        {
+            'AttributeName': sort_key_col_name,
+            'AttributeType': 'S',
+        }]
+        if time_bucket:
+            attribute_definitions.append({
+                'AttributeName': time_buckets.TIME_BUCKET_ATTRIBUTE,
+                'AttributeType': 'S',
+            })
         dynamodb_client.create_table(
         TableName=table_name,
         KeySchema=[
@@ -31,19 +80,11 @@ def create_dynamoDB_table(table_name, partition_key_col_name, sort_key_col_name)
                 'KeyType': 'RANGE'  #Sort key
             },
         ],
-        AttributeDefinitions=[{
-            'AttributeName': partition_key_col_name,
-            'AttributeType': 'S',
-        },
-        {
-            'AttributeName': sort_key_col_name,
-            'AttributeType': 'S',
-        }],
-        ProvisionedThroughput={
-            'ReadCapacityUnits': 100,
-            'WriteCapacityUnits': 300,
-            }
+        AttributeDefinitions=attribute_definitions,
+        BillingMode=billing_mode,
+        **extra_args
         )
         waiter = dynamodb_client.get_waiter('table_exists')
         waiter.wait(TableName=table_name)
+        aws_clients.forget_table(table_name)
         return 0
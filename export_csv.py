@@ -6,40 +6,39 @@ during the insert, it updates the error description of that particular row.
 
 import boto3
 import csv
-import json
 from pprint import pprint
-from datetime import datetime
 import input_output as io
 from threading import Thread
-import math
 from copy import copy
+import queue
+import time
+from worker_pool import run_workers, iter_queue, WorkerPool
+import metrics
+import rate_limiter
+import timestamps
+from botocore.exceptions import ClientError
 
-class ThreadWithReturnValue(Thread):
-    def __init__(self, group=None, target=None, name=None,
-                 args=(), kwargs={}, Verbose=None):
-        Thread.__init__(self, group, target, name, args, kwargs)
-        self._return = None
-    def run(self):
-        if self._target is not None:
-            self._return = self._target(*self._args,
-                                                **self._kwargs)
-    def join(self, *args):
-        Thread.join(self, *args)
-        return self._return
+CHUNK_SIZE = 5000
+ENCODING = 'utf-8'
+PREFETCH_DEPTH = 2
+BATCH_SIZE = 25
+DEFAULT_WORKER_COUNT = 3
+MAX_RETRIES = 8
+VALIDATE_BATCH_SIZE = 100
 
-def read_csv(csv_file_name):
+def read_csv(csv_file_name, chunk_size=CHUNK_SIZE, timestamp_columns=timestamps.DEFAULT_TIMESTAMP_COLUMNS):
     """
-    This function reads the CSV file
+    This function reads the header of the CSV file and returns a generator that streams the rows in chunks, so the
+    whole file never has to be held in memory. Compressed files and rotated exports are read with io.open_binary.
 
     Args:
         csv_file_name: The name of the CSV file
+        chunk_size: The number of rows in each chunk yielded by the generator
+        timestamp_columns: The names of the columns converted to ISO formatted timestamps
     """
     try:
-        with open(csv_file_name, newline='') as csv_file:
-            reader = csv.reader(csv_file)
-            for row in reader:
-                temp_column_names = row
-                break
+        with io.open_binary(csv_file_name) as csv_file:
+            temp_column_names = next(csv.reader([csv_file.readline().decode(ENCODING)]))
             column_names = []
             for each in temp_column_names:
                 if not each:
@@ -53,116 +52,593 @@ def read_csv(csv_file_name):
             output_column_names.append('Success/Failure')
             output_column_names.append('Error Code')
             output_column_names.append('Error Description')
-            item_collection = []
             
-            for row in reader:
-                
-                item = {}
-                for column in range (0, len(column_names)):
-                    if column_names[column] == 'Time' or column_names[column] == 'time':
-                        try:
-                            date_time_value = datetime.strptime(row[column], "%d-%m-%y %H:%M").strftime("%d/%m/%y %H:%M")
-                            item[column_names[column]] = datetime.strptime(date_time_value, "%d/%m/%y %H:%M").isoformat()
-                        except ValueError:
-                            item[column_names[column]] = datetime.strptime(row[column], "%d/%m/%y %H:%M").isoformat()
-                        except Exception as e:
-                            io.console_output("The program had to terminate because of the following error in read_csv: "+str(e))
-                            exit(1)
-                    else:
-                        item[column_names[column]] = row[column]
-                item_collection.append(item)
-            csv_file.close()
-            
-            return_values = [column_names,item_collection,output_column_names]
+            item_chunks = read_item_chunks(csv_file_name, column_names, chunk_size, timestamp_columns)
+            return_values = [column_names,item_chunks,output_column_names]
             return return_values
     except Exception as e:
         io.console_output("The program had to terminate because of the following error in read_csv: "+str(e))
 
-def prep_write(table, item_collection, partition_key_col_name,sort_key_col_name):
+class ItemChunk(list):
+    """
+    A chunk of items read from the CSV file. end_offset is the byte offset right after the last row of the chunk,
+    which is recorded in the import journal once the chunk has been written.
+    """
+    end_offset = None
+
+def read_item_chunks(csv_file_name, column_names, chunk_size=CHUNK_SIZE, timestamp_columns=timestamps.DEFAULT_TIMESTAMP_COLUMNS,
+                     start=None, end=None):
+    """
+    Generator that reads the rows of the CSV file (skipping the header) and yields them as ItemChunk lists of at most
+    chunk_size items. The file is only opened once the generator is iterated.
+    When start and end are given, only the rows between those byte offsets are read. Both offsets must be at the
+    beginning of a line, see sharded_import.plan_shards. The offsets of a compressed file are counted in its
+    decompressed content.
+
+    Args:
+        csv_file_name: The name of the CSV file
+        column_names: This is the list of the headers in the csv
+        chunk_size: The number of rows in each chunk
+        timestamp_columns: The names of the columns converted to ISO formatted timestamps
+        start: The byte offset of the first row to read, the row after the header when not given
+        end: The byte offset where reading stops, the end of the file when not given
+    """
+    normalisers = timestamps.normalisers_for(column_names, timestamp_columns)
+    with io.open_binary(csv_file_name) as csv_file:
+        if start is None:
+            csv_file.readline()
+        else:
+            io.skip_to(csv_file, start)
+        position = [csv_file.tell()]
+        reader = csv.reader(read_lines(csv_file, end, position))
+        item_collection = ItemChunk()
+        # The time the consumer holds a chunk is not counted as reading
+        start_time = time.perf_counter()
+        for row in reader:
+            item_collection.append(parse_row(column_names, row, normalisers))
+            if len(item_collection) >= chunk_size:
+                item_collection.end_offset = position[0]
+                metrics.registry.add_stage('read', time.perf_counter() - start_time, len(item_collection))
+                yield item_collection
+                item_collection = ItemChunk()
+                start_time = time.perf_counter()
+        if item_collection:
+            item_collection.end_offset = position[0]
+            metrics.registry.add_stage('read', time.perf_counter() - start_time, len(item_collection))
+            yield item_collection
+
+def read_lines(csv_file, end=None, position=None):
+    """
+    Generator that decodes the lines of a file opened in binary mode, stopping at the byte offset end
+
+    Args:
+        csv_file: The file opened in binary mode and positioned at the first line to read
+        end: The byte offset where reading stops, the end of the file when not given
+        position: A one element list updated with the byte offset after the last line read
+    """
+    if position is None:
+        position = [csv_file.tell()]
+    for line in csv_file:
+        if end is not None and position[0] >= end:
+            return
+        position[0] += len(line)
+        yield line.decode(ENCODING)
+
+def parse_row(column_names, row, normalisers):
+    """
+    Converts a CSV row into a DynamoDB item. The timestamp columns are converted to ISO format.
+
+    Args:
+        column_names: This is the list of the headers in the csv
+        row: The list of values read from the CSV file
+        normalisers: The timestamps.TimestampNormaliser of every timestamp column, by position
+    """
+    item = {}
+    for column in range (0, len(column_names)):
+        if column in normalisers:
+            try:
+                item[column_names[column]] = normalisers[column].normalise(row[column])
+            except Exception as e:
+                io.console_output("The program had to terminate because of the following error in read_csv: "+str(e))
+                exit(1)
+        else:
+            item[column_names[column]] = row[column]
+    return item
+
+def prefetch(item_chunks, depth=PREFETCH_DEPTH):
+    """
+    Reads chunks ahead on a background thread so that parsing the CSV file overlaps with the writes to DynamoDB.
+    At most depth chunks are buffered, which keeps the memory usage flat regardless of the file size.
+
+    Args:
+        item_chunks: The generator returned by read_csv
+        depth: The number of chunks that may be read ahead
+    """
+    chunk_queue = queue.Queue(maxsize=depth)
+    def produce():
+        try:
+            with metrics.thread_profiled():
+                for item_collection in item_chunks:
+                    chunk_queue.put(item_collection)
+            chunk_queue.put(None)
+        except BaseException as e:
+            chunk_queue.put(e)
+    reader_thread = Thread(target=produce, daemon=True)
+    reader_thread.start()
+    while True:
+        item_collection = chunk_queue.get()
+        if item_collection is None:
+            break
+        if isinstance(item_collection, BaseException):
+            raise item_collection
+        yield item_collection
+    reader_thread.join()
+
+def import_items(table, table_name, item_chunks, output_column_names, partition_key_col_name, sort_key_col_name,
+                 worker_count=DEFAULT_WORKER_COUNT, validation=True, status_file_name="write_status.csv", limiter=None,
+                 journal=None, shard_start=None, serializer=None, client=None):
+    """
+    Streams the CSV rows into DynamoDB chunk by chunk. Each chunk is written, validated and its status rows are appended
+    to the status file before the next one is processed, while the following chunks are read ahead in the background.
+    Without validation the status rows come from the acknowledgements of the write engine, so no items are read back.
+    When a journal is given, the end offset of every finished chunk is committed to it and the status rows are appended
+    to an existing status file, so an interrupted import can be resumed. The writer threads are kept alive from one
+    chunk to the next. The loop is profiled when metrics.profiled is switched on.
+    It returns the number of rows processed and the number of rows that failed.
+
+    Args:
+        table: This is the boto3 DynamoDB resource which refers to the table
+        table_name: name of the table in DynamoDB
+        item_chunks: The generator of CSV row chunks returned by read_csv
+        output_column_names: This is the list of the headers in the status csv
+        partition_key_col_name: This is the name of the primary key (hash key)
+        sort_key_col_name: This is the name of the sort key (range key)
+        worker_count: The number of threads writing to DynamoDB
+        validation: Whether the items are read back from DynamoDB to validate the import
+        status_file_name: The name of the csv file receiving the status of every row
+        limiter: The rate_limiter.RateLimiter shared by the threads, sized from the table when not given
+        journal: The journal.ImportJournal recording the progress of the import
+        shard_start: The byte offset the shard being imported started at, the key of its commits in the journal
+        serializer: The item_schema.ItemSerializer of the fast write path, items are written through the resource layer when not given
+        client: The low-level boto3 DynamoDB client used with the serializer
+    """
+    io.console_output('Beginning csv to dynamoDB import\n')
+    if limiter is None:
+        limiter = rate_limiter.from_table(table)
+    summary = {'rows': 0, 'failed': 0, 'status_file': status_file_name}
+    with io.StreamingCsvWriter(output_column_names, status_file_name, append=journal is not None) as status_writer, \
+            metrics.profiled(), WorkerPool(batch_write, worker_count, args=(table, limiter, serializer, client,
+                                                                         partition_key_col_name, sort_key_col_name)) as pool:
+        for item_collection in prefetch(item_chunks):
+            stats = prep_write(table, item_collection, partition_key_col_name, sort_key_col_name, worker_count, limiter,
+                               serializer, client, pool)
+            if validation:
+                result = write_summary(stats)
+                status_rows = validate(table, table_name, item_collection, partition_key_col_name, sort_key_col_name,
+                                       result, worker_count, limiter, serializer, client)
+            else:
+                status_rows = acknowledged_status(item_collection, partition_key_col_name, sort_key_col_name, stats)
+            status_writer.writerows(count_failures(status_rows, summary))
+            if journal is not None and item_collection.end_offset is not None:
+                journal.commit(shard_start, item_collection.end_offset, status_writer)
+    summary['rows'] = status_writer.row_count
+    io.console_output('Finished import, ' + str(status_writer.row_count) + ' rows written to ' + status_writer.filename)
+    return summary
+
+def count_failures(status_rows, summary):
     """
-    This functions splits the given collection of csv rows into 3 sets and spins up 3 threads to write to
-    DynamoDB parallely.
+    Generator that passes the status rows through, counting the failed rows in summary
+
+    Args:
+        status_rows: The status rows returned by validate or acknowledged_status
+        summary: The dictionary holding the failed count
+    """
+    for out_row in status_rows:
+        if out_row['Error Code'] != "0":
+            summary['failed'] += 1
+        yield out_row
+
+def prep_write(table, item_collection, partition_key_col_name, sort_key_col_name, worker_count=DEFAULT_WORKER_COUNT,
+               limiter=None, serializer=None, client=None, pool=None):
+    """
+    This function splits the given collection of csv rows into batches of 25 items and puts them on a bounded queue
+    shared by worker_count threads, which write to DynamoDB in parallel. Each thread pulls the next batch as soon as it
+    is free, so one slow thread does not hold up the others.
+    With a serializer, the items are converted to typed low-level AttributeValues and sent with the low-level client,
+    bypassing the boto3 resource layer. Given a worker_pool.WorkerPool running batch_write, the batches are written by
+    its threads, which are kept alive for the next chunk, instead of starting and joining worker_count new threads.
+    It returns a list with the statistics of every worker thread.
 
     Args:
         table: This is the boto3 DynamoDB resource which refers to the table
-        item_collecti
+        item_collection: This is the chunk of rows read from the CSV file
+        partition_key_col_name: This is the name of the primary key (hash key)
+        sort_key_col_name: This is the name of the sort key (range key)
+        worker_count: The number of threads writing to DynamoDB
+        limiter: The rate_limiter.RateLimiter shared by the threads, sized from the table when not given
+        serializer: The item_schema.ItemSerializer of the fast write path
+        client: The low-level boto3 DynamoDB client used with the serializer
+        pool: The worker_pool.WorkerPool writing the batches, created with the same table, limiter, serializer and client
     """
     try:
-        items_length = len(item_collection)
-        item_set_1 = math.ceil(items_length/3)
-        item_set_2 = item_set_1
-        item_set_3 = items_length - (item_set_1 + item_set_2)
-        item_collection_1 = item_collection[:item_set_1]
-        item_collection_2 = item_collection[item_set_1:item_set_3]
-        item_collection_3 = item_collection[item_set_3:]
-        thread_1 = ThreadWithReturnValue(target=batch_write, args=(table,item_collection_1, partition_key_col_name,sort_key_col_name,"thread-1"))
-        thread_2 = ThreadWithReturnValue(target=batch_write, args=(table,item_collection_2, partition_key_col_name,sort_key_col_name,"thread-2"))
-        thread_3 = ThreadWithReturnValue(target=batch_write, args=(table,item_collection_3, partition_key_col_name,sort_key_col_name,"thread-3"))
-        io.console_output('Beginning csv to dynamoDB import\n')
-        thread_1.start()
-        thread_2.start()
-        thread_3.start()
-        result_thread_1 = thread_1.join()
-        result_thread_2 = thread_2.join()
-        result_thread_3 = thread_3.join()
-        return(result_thread_1+","+result_thread_2+","+result_thread_3)
+        if limiter is None:
+            limiter = rate_limiter.from_table(table)
+        batches = iter_batches(item_collection, BATCH_SIZE, [partition_key_col_name, sort_key_col_name])
+        with metrics.registry.stage('write') as counts:
+            if pool is not None:
+                stats = pool.run(batches)
+            else:
+                stats = run_workers(batch_write, batches, worker_count,
+                                    args=(table, limiter, serializer, client, partition_key_col_name, sort_key_col_name))
+            counts['rows'] = sum(worker_stats['items'] for worker_stats in stats)
+        return stats
     except Exception as e:
         io.console_output("The program had to terminate because of the following error in prep_write: "+str(e))
         exit(1)
 
-def batch_write(table, item_collection, partition_key_col_name,sort_key_col_name,thread_name):
+def iter_batches(item_collection, batch_size=BATCH_SIZE, key_col_names=None):
     """
-    Performs a batch write operation on DynamoDB. Please note that the maximum number of Items that can be pushed through is 25
+    Generator that groups the items into lists of at most batch_size items. When key_col_names is given, an item
+    replaces an earlier item with the same key in the batch, since DynamoDB rejects a batch containing duplicate keys.
+
+    Args:
+        item_collection: This is the chunk of rows read from the CSV file
+        batch_size: The maximum number of items in a batch
+        key_col_names: The names of the key columns used to remove duplicates
+    """
+    batch_items = {}
+    for number, item in enumerate(item_collection):
+        if key_col_names:
+            batch_items[tuple(item[each] for each in key_col_names)] = item
+        else:
+            batch_items[number] = item
+        if len(batch_items) >= batch_size:
+            yield list(batch_items.values())
+            batch_items = {}
+    if batch_items:
+        yield list(batch_items.values())
+
+def batch_write(table, limiter, serializer, client, partition_key_col_name, sort_key_col_name, work_queue, thread_name):
+    """
+    Performs batch write operations on DynamoDB for every batch taken off the work queue. Please note that the maximum
+    number of Items that can be pushed through is 25. Every request waits for capacity from the shared rate limiter,
+    and throttled requests and unprocessed items are retried with the limiter's backoff. A batch that still fails after
+    MAX_RETRIES attempts is recorded in the statistics and the thread carries on with the next one.
 
     Args:
         table: This is the boto3 DynamoDB resource which refers to the table
-        item_collection: This is the dictionary of all the rows read from the CSV file
+        limiter: The rate_limiter.RateLimiter shared by the threads
+        serializer: The item_schema.ItemSerializer of the fast write path, None to write through the resource layer
+        client: The low-level boto3 DynamoDB client used with the serializer
+        partition_key_col_name: This is the name of the primary key (hash key)
+        sort_key_col_name: This is the name of the sort key (range key)
+        work_queue: The queue of 25 item batches shared by the worker threads
+        thread_name: The name of the worker thread
     """
-    count = 0
-    try:
-        with table.batch_writer(overwrite_by_pkeys=[partition_key_col_name, sort_key_col_name]) as batch:
-            for item in item_collection:
-                batch.put_item(Item=item)
-                count += 1
-    except Exception as e:
-        io.console_output("Error: "+ str(e))
-        exception = str(e)
-        return exception
-    io.console_output('Inserted ' + str(count) + ' items using: '+thread_name)
-    return ("No Error in : "+thread_name)
+    stats = write_stats(thread_name)
+    if serializer is None:
+        client = table.meta.client
+    start_time = time.perf_counter()
+    for batch_items in iter_queue(work_queue):
+        requests = put_requests(batch_items, serializer)
+        attempt = 0
+        try:
+            while requests:
+                wait_start = time.perf_counter()
+                units_taken = limiter.acquire(len(requests))
+                request_start = time.perf_counter()
+                metrics.registry.increment('rate_limit_wait_seconds', request_start - wait_start)
+                try:
+                    # The indexes are reported apart, the limiter only keeps to the capacity of the table
+                    response = client.batch_write_item(RequestItems={table.name: requests}, ReturnConsumedCapacity='INDEXES')
+                except ClientError as e:
+                    write_throttled(e, attempt, limiter, stats)
+                    attempt += 1
+                    continue
+                finally:
+                    metrics.registry.observe('batch_write_seconds', time.perf_counter() - request_start)
+                requests = record_write(response, table.name, requests, units_taken, attempt, limiter, stats)
+                attempt += 1
+        except Exception as e:
+            write_failed(e, requests, partition_key_col_name, sort_key_col_name, serializer, stats)
+        stats['batches'] += 1
+    stats['seconds'] = time.perf_counter() - start_time
+    io.console_output('Inserted ' + str(stats['items']) + ' items using: '+thread_name)
+    return stats
 
-def validate(table, table_name, item_collection, partition_key_col_name, sort_key_col_name, result):
+def write_stats(worker):
     """
-    Validates the Items inserted into the DynamoDB. It iterates over each CSV row and queries the DynamoDB to get the matching Item.
-    If it does not get any response, it re-inserts the record and updates the error code and description accordingly.
+    Returns the empty statistics of a writer, which both engines fill in the same format
+
+    Args:
+        worker: The name of the worker thread, or of the engine
+    """
+    return {'worker': worker, 'batches': 0, 'items': 0, 'failed_items': 0, 'failed_keys': [], 'errors': [],
+            'retries': 0, 'throttles': 0, 'consumed_capacity': 0.0, 'seconds': 0.0}
+
+def put_requests(batch_items, serializer):
+    """
+    Returns the BatchWriteItem requests of a batch of rows, typed by the serializer when one is given
+
+    Args:
+        batch_items: The rows of the batch
+        serializer: The item_schema.ItemSerializer of the fast write path, None to write through the resource layer
+    """
+    with metrics.registry.stage('serialize', len(batch_items)):
+        if serializer is None:
+            return [{'PutRequest': {'Item': item}} for item in batch_items]
+        return [{'PutRequest': {'Item': serializer.serialize(item)}} for item in batch_items]
+
+def write_throttled(error, attempt, limiter, stats):
+    """
+    Counts a throttled BatchWriteItem and slows the limiter down before it is retried, raising the error when it is not
+    a throttle or the batch has already been retried MAX_RETRIES times
+
+    Args:
+        error: The botocore ClientError of the request
+        attempt: The number of retries of the batch so far
+        limiter: The rate_limiter.RateLimiter of the table
+        stats: The statistics of the writer
+    """
+    if error.response['Error']['Code'] not in rate_limiter.THROTTLE_ERRORS or attempt >= MAX_RETRIES:
+        raise error
+    stats['throttles'] += 1
+    stats['retries'] += 1
+    metrics.registry.increment('write_throttles')
+    metrics.registry.increment('write_retries')
+    limiter.throttled(attempt)
+
+def record_write(response, table_name, requests, units_taken, attempt, limiter, stats):
+    """
+    Records the items written by a BatchWriteItem and the capacity they consumed. It returns the unprocessed requests,
+    to be retried after the limiter's backoff, and raises when the batch has already been retried MAX_RETRIES times.
+
+    Args:
+        response: The response of the BatchWriteItem
+        table_name: name of the table in DynamoDB
+        requests: The requests that were sent
+        units_taken: The units taken from the limiter for the request
+        attempt: The number of retries of the batch so far
+        limiter: The rate_limiter.RateLimiter of the table
+        stats: The statistics of the writer
+    """
+    consumed = rate_limiter.consumed_units(response)
+    unprocessed = response.get('UnprocessedItems', {}).get(table_name, [])
+    written = len(requests) - len(unprocessed)
+    limiter.record(units_taken, consumed, written)
+    stats['items'] += written
+    stats['consumed_capacity'] += consumed or 0
+    metrics.registry.increment('items_written', written)
+    metrics.registry.increment('consumed_write_capacity', consumed or 0)
+    if unprocessed:
+        if attempt >= MAX_RETRIES:
+            raise RuntimeError(str(len(unprocessed)) + " items still unprocessed after " + str(MAX_RETRIES) + " retries")
+        stats['retries'] += 1
+        metrics.registry.increment('write_retries')
+        limiter.throttled(attempt)
+    return unprocessed
+
+def write_failed(error, requests, partition_key_col_name, sort_key_col_name, serializer, stats):
+    """
+    Records the keys of the requests of a batch that could not be written, so their rows are reported as failures
+
+    Args:
+        error: The error that stopped the batch
+        requests: The requests left unwritten
+        partition_key_col_name: This is the name of the primary key (hash key)
+        sort_key_col_name: This is the name of the sort key (range key)
+        serializer: The item_schema.ItemSerializer the requests were typed with, None for the resource layer
+        stats: The statistics of the writer
+    """
+    io.console_output("Error: "+ str(error))
+    stats['failed_items'] += len(requests)
+    metrics.registry.increment('items_failed', len(requests))
+    for each in requests:
+        key = (each['PutRequest']['Item'][partition_key_col_name], each['PutRequest']['Item'][sort_key_col_name])
+        if serializer is not None:
+            key = (serializer.raw_value(key[0]), serializer.raw_value(key[1]))
+        stats['failed_keys'].append(key)
+    stats['errors'].append(str(error))
+
+def write_summary(stats):
+    """
+    Converts the worker statistics returned by prep_write into the result text recorded in write_status.csv
+
+    Args:
+        stats: The list of worker statistics returned by prep_write
+    """
+    summary = []
+    for worker_stats in stats:
+        if worker_stats['errors']:
+            summary.extend(worker_stats['errors'])
+        else:
+            summary.append("No Error in : " + worker_stats['worker'])
+    return ",".join(summary)
+
+def validate(table, table_name, item_collection, partition_key_col_name, sort_key_col_name, result,
+             worker_count=DEFAULT_WORKER_COUNT, limiter=None, serializer=None, client=None):
+    """
+    Validates the Items inserted into the DynamoDB. The keys of the CSV rows are looked up in batches of 100 with
+    BatchGetItem, spread over worker_count threads. Rows that are not found are re-inserted in batches through
+    prep_write and their error code and description are updated accordingly.
+    The status rows are yielded one at a time so they can be streamed to the output file.
 
     Args:
         table: This is the boto3 DynamoDB resource which refers to the table
         table_name: name of the table in DynamoDB
-        item_collection: This is the dictionary of all the rows read from the CSV file
+        item_collection: This is the chunk of rows read from the CSV file
+        partition_key_col_name: This is the name of the primary key (hash key)
+        sort_key_col_name: This is the name of the sort key (range key)
+        result: The result text of the write returned by write_summary, reported with the rows that could not be found
+        worker_count: The number of threads reading from DynamoDB
+        limiter: The rate_limiter.RateLimiter used when re-inserting missing rows
+        serializer: The item_schema.ItemSerializer of the fast write path, used to compare typed keys and re-insert rows
+        client: The low-level boto3 DynamoDB client used with the serializer
+    """
+    row_key = row_key_function(partition_key_col_name, sort_key_col_name, serializer)
+    keys = list(dict.fromkeys(row_key(row) for row in item_collection))
+    key_batches = iter_batches(keys, VALIDATE_BATCH_SIZE)
+    read_limiter = rate_limiter.RateLimiter(None)
+    found_keys = set()
+    errors = []
+    with metrics.registry.stage('validate', len(keys)):
+        for worker_result in run_workers(batch_get, key_batches, worker_count,
+                                         args=(table, read_limiter, partition_key_col_name, sort_key_col_name)):
+            found_keys.update(worker_result['found_keys'])
+            errors.extend(worker_result['errors'])
+    missing_rows = [row for row in item_collection if row_key(row) not in found_keys]
+    if missing_rows:
+        io.console_output('Failed to validate ' + str(len(missing_rows)) + ' items. Re-inserting the items')
+        metrics.registry.increment('items_reinserted', len(missing_rows))
+        prep_write(table, missing_rows, partition_key_col_name, sort_key_col_name, worker_count, limiter, serializer, client)
+    yield from validated_status(item_collection, row_key, found_keys, ",".join([result] + errors + ["Item not found"]))
+
+def row_key_function(partition_key_col_name, sort_key_col_name, serializer):
+    """
+    Returns the function giving the key of a CSV row the way it is read back from DynamoDB, typed by the serializer
+    when one is given
+
+    Args:
         partition_key_col_name: This is the name of the primary key (hash key)
         sort_key_col_name: This is the name of the sort key (range key)
-        
+        serializer: The item_schema.ItemSerializer the items were written with, None for the resource layer
+    """
+    def row_key(row):
+        if serializer is None:
+            return (row[partition_key_col_name], row[sort_key_col_name])
+        return (serializer.python_value(partition_key_col_name, row[partition_key_col_name]),
+                serializer.python_value(sort_key_col_name, row[sort_key_col_name]))
+    return row_key
+
+def validated_status(item_collection, row_key, found_keys, error_description):
+    """
+    Generator of the status rows of a validated chunk, the rows whose key was not found being reported as failures
+
+    Args:
+        item_collection: This is the chunk of rows read from the CSV file
+        row_key: The function returned by row_key_function
+        found_keys: The set of the keys found in DynamoDB
+        error_description: The description reported with the rows that were not found
     """
-    io.console_output('Beginning data validation...')
-    out_rows = []
     for row in item_collection:
-        key = {partition_key_col_name: row[partition_key_col_name], sort_key_col_name: row[sort_key_col_name]}
         out_row = copy(row)
-        try:
-            response = table.get_item(Key=key)
-            assert('Item' in response)
-            out_row['Success/Failure'] = result
+        if row_key(row) in found_keys:
+            out_row['Success/Failure'] = "Success"
             out_row['Error Code'] = "0"
             out_row['Error Description'] = ""
+        else:
+            out_row['Success/Failure'] = "Failure"
+            out_row['Error Code'] = "1"
+            out_row['Error Description'] = error_description
+        yield out_row
+
+def batch_get(table, limiter, partition_key_col_name, sort_key_col_name, work_queue, thread_name):
+    """
+    Looks up every batch of up to 100 keys taken off the work queue with BatchGetItem. Only the key attributes are
+    fetched. Unprocessed keys are retried with the limiter's backoff.
+    It returns the set of keys that were found and the errors that occurred.
+
+    Args:
+        table: This is the boto3 DynamoDB resource which refers to the table
+        limiter: The rate_limiter.RateLimiter used to coordinate the backoff between threads
+        partition_key_col_name: This is the name of the primary key (hash key)
+        sort_key_col_name: This is the name of the sort key (range key)
+        work_queue: The queue of key batches shared by the worker threads
+        thread_name: The name of the worker thread
+    """
+    worker_result = {'worker': thread_name, 'found_keys': set(), 'errors': []}
+    client = table.meta.client
+    for key_batch in iter_queue(work_queue):
+        request = {
+            'Keys': [{partition_key_col_name: each[0], sort_key_col_name: each[1]} for each in key_batch],
+            'ProjectionExpression': '#pk, #sk',
+            'ExpressionAttributeNames': {'#pk': partition_key_col_name, '#sk': sort_key_col_name},
+        }
+        attempt = 0
+        try:
+            while request:
+                request_start = time.perf_counter()
+                try:
+                    response = client.batch_get_item(RequestItems={table.name: request}, ReturnConsumedCapacity='TOTAL')
+                except ClientError as e:
+                    read_throttled(e, attempt, limiter)
+                    limiter.acquire(0)
+                    attempt += 1
+                    continue
+                finally:
+                    metrics.registry.observe('batch_get_seconds', time.perf_counter() - request_start)
+                for item in response['Responses'].get(table.name, []):
+                    worker_result['found_keys'].add((item[partition_key_col_name], item[sort_key_col_name]))
+                request = record_read(response, table.name, attempt, limiter)
+                if request:
+                    limiter.acquire(0)
+                    attempt += 1
         except Exception as e:
-            io.console_output('Failed to validate data. Key ' + json.dumps(key) + ' does not exist. Re-inserting the item')
+            io.console_output("Error: "+ str(e))
+            worker_result['errors'].append(str(e))
+    return worker_result
+
+def read_throttled(error, attempt, limiter):
+    """
+    Counts a throttled BatchGetItem and backs the limiter off before it is retried, raising the error when it is not
+    a throttle or the batch has already been retried MAX_RETRIES times
+
+    Args:
+        error: The botocore ClientError of the request
+        attempt: The number of retries of the batch so far
+        limiter: The rate_limiter.RateLimiter coordinating the backoff of the readers
+    """
+    if error.response['Error']['Code'] not in rate_limiter.THROTTLE_ERRORS or attempt >= MAX_RETRIES:
+        raise error
+    metrics.registry.increment('read_throttles')
+    metrics.registry.increment('read_retries')
+    limiter.throttled(attempt)
+
+def record_read(response, table_name, attempt, limiter):
+    """
+    Records the capacity consumed by a BatchGetItem. It returns the request of the unprocessed keys, to be retried
+    after the limiter's backoff, and raises when the batch has already been retried MAX_RETRIES times.
+
+    Args:
+        response: The response of the BatchGetItem
+        table_name: name of the table in DynamoDB
+        attempt: The number of retries of the batch so far
+        limiter: The rate_limiter.RateLimiter coordinating the backoff of the readers
+    """
+    metrics.registry.increment('consumed_read_capacity', rate_limiter.consumed_units(response) or 0)
+    request = response.get('UnprocessedKeys', {}).get(table_name)
+    if request:
+        if attempt >= MAX_RETRIES:
+            raise RuntimeError(str(len(request['Keys'])) + " keys still unprocessed after " + str(MAX_RETRIES) + " retries")
+        metrics.registry.increment('read_retries')
+        limiter.throttled(attempt)
+    return request
+
+def acknowledged_status(item_collection, partition_key_col_name, sort_key_col_name, stats):
+    """
+    Builds the status rows from the acknowledgements of the write engine instead of reading the items back. A row is
+    reported as a failure when its batch failed or its item was still unprocessed after all the retries. The rows are
+    marked Success or Failure like the rows checked by validate, so the status files of both modes read the same.
+    The status rows are yielded one at a time so they can be streamed to the output file.
+
+    Args:
+        item_collection: This is the chunk of rows read from the CSV file
+        partition_key_col_name: This is the name of the primary key (hash key)
+        sort_key_col_name: This is the name of the sort key (range key)
+        stats: The list of worker statistics returned by prep_write
+    """
+    result = write_summary(stats)
+    failed_keys = set()
+    for worker_stats in stats:
+        failed_keys.update(worker_stats['failed_keys'])
+    for row in item_collection:
+        out_row = copy(row)
+        if (row[partition_key_col_name], row[sort_key_col_name]) in failed_keys:
             out_row['Success/Failure'] = "Failure"
             out_row['Error Code'] = "1"
-            out_row['Error Description'] = result + "," + str(e)
-            table.put_item(Item=row)
-        out_rows.append(out_row)
-    io.console_output('Finished data validation...')
-    return out_rows
-            
-    
\ No newline at end of file
+            out_row['Error Description'] = result
+        else:
+            out_row['Success/Failure'] = "Success"
+            out_row['Error Code'] = "0"
+            out_row['Error Description'] = ""
+        yield out_row
@@ -5,12 +5,22 @@ This module addresses the functionality of looking up items from DynamoDB and co
 import boto3
 import csv
 from boto3.dynamodb.conditions import Key
+import time
 import input_output as io
+import metrics
+import rate_limiter
+import time_buckets
+from worker_pool import run_workers, iter_queue
 
+DEFAULT_SEGMENTS = 4
 
-def scan_table(table_name,table,filter_key, filter_value,filter_value2):
+
+def scan_table(table_name,table,filter_key, filter_value,filter_value2, total_segments=DEFAULT_SEGMENTS, worker_count=None,
+               output_file_name="data_from_db.csv"):
     """
-    Perform a scan operation on table.
+    Perform a parallel scan operation on table and stream the items to the output file.
+    The table is split into total_segments segments that are scanned by a pool of worker_count threads. Every segment
+    follows LastEvaluatedKey until it is exhausted and its pages are written out as they arrive.
     Can specify filter_key (col name) and its value to be filtered.
 
     Args:
@@ -19,28 +29,65 @@ def scan_table(table_name,table,filter_key, filter_value,filter_value2):
         filter_key: This param takes the name of the key with which you are going to perform the scan
         filter_value: This is the low range of the filter
         filter_value2: This is the high range of the filter
-        column_names: This is the list of the headers in the csv
+        total_segments: The number of segments the scan is split into
+        worker_count: The number of threads scanning the segments, one per segment when not given
+        output_file_name: The name of the CSV file receiving the items, compressed according to its extension and
+            rotated to part files of io.MAX_PART_BYTES
     """
     try:
-        column_names = []
+        scan_kwargs = {'ReturnConsumedCapacity': 'TOTAL'}
         if filter_key and filter_value:
-            filtering_exp = Key(filter_key).between(filter_value,filter_value2)
-            response = table.scan(FilterExpression=filtering_exp)
-        else:
-            response = table.scan()
-        temp_dict = response['Items'][0]
-        for key,value in temp_dict.items():
-            column_names.append(key)
-        column_names.sort()
-        io.write_to_csv(column_names,response['Items'],"data_from_db.csv")
+            scan_kwargs['FilterExpression'] = Key(filter_key).between(filter_value,filter_value2)
+        with io.SpillCsvWriter(output_file_name, io.MAX_PART_BYTES) as spill_writer, metrics.registry.stage('scan') as counts:
+            stats = run_workers(scan_segments, range(total_segments), worker_count or total_segments,
+                                args=(table, scan_kwargs, total_segments, spill_writer))
+            counts['rows'] = sum(worker_stats['items'] for worker_stats in stats)
+            errors = [error for worker_stats in stats for error in worker_stats['errors']]
+            if errors:
+                raise Exception(",".join(errors))
+        io.console_output("Exported " + str(spill_writer.row_count) + " items to " + ", ".join(spill_writer.filenames))
     except Exception as e:
         io.console_output("The program had to terminate because of the following error in scan_table: "+str(e))
         exit(1)
 
+def scan_segments(table, scan_kwargs, total_segments, spill_writer, work_queue, thread_name):
+    """
+    Scans every segment taken off the work queue page by page and writes the items of each page to the spill writer
+
+    Args:
+        table: This is the boto3 DynamoDB resource which refers to the table
+        scan_kwargs: The extra parameters of the scan, such as the FilterExpression
+        total_segments: The number of segments the scan is split into
+        spill_writer: The input_output.SpillCsvWriter receiving the items
+        work_queue: The queue of segment numbers shared by the worker threads
+        thread_name: The name of the worker thread
+    """
+    stats = {'worker': thread_name, 'segments': 0, 'pages': 0, 'items': 0, 'errors': []}
+    for segment in iter_queue(work_queue):
+        request = dict(scan_kwargs, Segment=segment, TotalSegments=total_segments)
+        try:
+            while True:
+                request_start = time.perf_counter()
+                response = table.scan(**request)
+                metrics.registry.observe('scan_page_seconds', time.perf_counter() - request_start)
+                metrics.registry.increment('consumed_read_capacity', rate_limiter.consumed_units(response) or 0)
+                spill_writer.writerows(response['Items'])
+                stats['pages'] += 1
+                stats['items'] += len(response['Items'])
+                if 'LastEvaluatedKey' not in response:
+                    break
+                request['ExclusiveStartKey'] = response['LastEvaluatedKey']
+        except Exception as e:
+            stats['errors'].append("segment " + str(segment) + ": " + str(e))
+        stats['segments'] += 1
+    return stats
+
 
-def query_table(table_name,table,filter_key, filter_value):
+def query_table(table_name,table,filter_key, filter_value, page_size=None, output_file_name="data_from_db.csv"):
     """
-    Perform a query operation on table.
+    Perform a query operation on table and stream the items to the output file.
+    The query follows LastEvaluatedKey so every page of the partition is read, and each page is written out as it
+    arrives. The columns are collected across all the items and the header is written once the query is finished.
     Can specify filter_key (col name) and its value to be filtered.
 
     Args:
@@ -48,17 +95,100 @@ def query_table(table_name,table,filter_key, filter_value):
         table: This is the boto3 DynamoDB resource which refers to the table
         filter_key: This param takes the name of the primary key with which you are going to perform the scan
         filter_value: This is the primary key value
-        column_names: This is the list of the headers in the csv
+        page_size: The maximum number of items read per request, smaller pages return the first rows sooner at
+            the cost of more requests. DynamoDB returns up to 1 MB per request when not given
+        output_file_name: The name of the CSV file receiving the items, compressed according to its extension and
+            rotated to part files of io.MAX_PART_BYTES
     """
     try:
-        column_names = []
-        filtering_exp = Key(filter_key).eq(filter_value)
-        response = table.query(KeyConditionExpression=filtering_exp)
-        temp_dict = response['Items'][0]
-        for key,value in temp_dict.items():
-            column_names.append(key)
-        column_names.sort()
-        io.write_to_csv(column_names,response['Items'],"data_from_db.csv")
+        request = {'KeyConditionExpression': Key(filter_key).eq(filter_value)}
+        if page_size:
+            request['Limit'] = int(page_size)
+        with io.SpillCsvWriter(output_file_name, io.MAX_PART_BYTES) as spill_writer, metrics.registry.stage('query') as counts:
+            for items in query_pages(table, request):
+                spill_writer.writerows(items)
+                counts['rows'] += len(items)
+        io.console_output("Exported " + str(spill_writer.row_count) + " items to " + ", ".join(spill_writer.filenames))
     except Exception as e:
         io.console_output("The program had to terminate because of the following error in query_table: "+str(e))
         exit(1)
+
+def query_time_range(table_name, table, sort_key_col_name, low_value, high_value, granularity, worker_count=DEFAULT_SEGMENTS,
+                     output_file_name="data_from_db.csv"):
+    """
+    Searches a time range using the time bucket index and streams the items to the output file.
+    One query per bucket overlapping the range is run on a pool of worker_count threads, so only the items in the
+    range are read instead of the whole table.
+
+    Args:
+        table_name: name of the table in DynamoDB
+        table: This is the boto3 DynamoDB resource which refers to the table
+        sort_key_col_name: This is the name of the sort key (range key) holding the ISO formatted time
+        low_value: This is the low range of the filter
+        high_value: This is the high range of the filter
+        granularity: The granularity of the time bucket index of the table, hour or day
+        worker_count: The number of threads running the queries
+        output_file_name: The name of the CSV file receiving the items, compressed according to its extension and
+            rotated to part files of io.MAX_PART_BYTES
+    """
+    try:
+        buckets = time_buckets.buckets_between(low_value, high_value, granularity)
+        with io.SpillCsvWriter(output_file_name, io.MAX_PART_BYTES) as spill_writer, metrics.registry.stage('query') as counts:
+            stats = run_workers(query_buckets, buckets, worker_count,
+                                args=(table, sort_key_col_name, low_value, high_value, granularity, spill_writer))
+            counts['rows'] = sum(worker_stats['items'] for worker_stats in stats)
+            errors = [error for worker_stats in stats for error in worker_stats['errors']]
+            if errors:
+                raise Exception(",".join(errors))
+        io.console_output("Exported " + str(spill_writer.row_count) + " items from " + str(len(buckets)) + " time buckets to " + ", ".join(spill_writer.filenames))
+    except Exception as e:
+        io.console_output("The program had to terminate because of the following error in query_time_range: "+str(e))
+        exit(1)
+
+def query_buckets(table, sort_key_col_name, low_value, high_value, granularity, spill_writer, work_queue, thread_name):
+    """
+    Queries the time bucket index for every bucket taken off the work queue and writes the items to the spill writer
+
+    Args:
+        table: This is the boto3 DynamoDB resource which refers to the table
+        sort_key_col_name: This is the name of the sort key (range key) holding the ISO formatted time
+        low_value: This is the low range of the filter
+        high_value: This is the high range of the filter
+        granularity: The granularity of the time bucket index of the table, hour or day
+        spill_writer: The input_output.SpillCsvWriter receiving the items
+        work_queue: The queue of buckets shared by the worker threads
+        thread_name: The name of the worker thread
+    """
+    stats = {'worker': thread_name, 'buckets': 0, 'items': 0, 'errors': []}
+    for bucket in iter_queue(work_queue):
+        request = {
+            'IndexName': time_buckets.index_name(granularity),
+            'KeyConditionExpression': Key(time_buckets.TIME_BUCKET_ATTRIBUTE).eq(bucket) & Key(sort_key_col_name).between(low_value, high_value),
+        }
+        try:
+            for items in query_pages(table, request):
+                spill_writer.writerows(items)
+                stats['items'] += len(items)
+        except Exception as e:
+            stats['errors'].append("bucket " + bucket + ": " + str(e))
+        stats['buckets'] += 1
+    return stats
+
+def query_pages(table, request):
+    """
+    Generator that runs a query and yields the items of every page, following LastEvaluatedKey
+
+    Args:
+        table: This is the boto3 DynamoDB resource which refers to the table
+        request: The parameters of the query
+    """
+    request = dict(request, ReturnConsumedCapacity='TOTAL')
+    while True:
+        request_start = time.perf_counter()
+        response = table.query(**request)
+        metrics.registry.observe('query_page_seconds', time.perf_counter() - request_start)
+        metrics.registry.increment('consumed_read_capacity', rate_limiter.consumed_units(response) or 0)
+        yield response['Items']
+        if 'LastEvaluatedKey' not in response:
+            return
+        request['ExclusiveStartKey'] = response['LastEvaluatedKey']
@@ -1,8 +1,37 @@
 """
 This module handles the input output functionality of the program. It is considered best practise to let one function
 handle the interaction with the user/console.
+The files are compressed according to their extension, .gz with gzip and .zst with zstd, which needs the zstandard
+package (pip install zstandard). Large outputs can be rotated to part files at a size threshold: the first part keeps
+the name of the file and the next ones are named like data_from_db.part-0002.csv.gz. open_binary reads the parts back
+as a single file, so an export can be imported again as it is.
 """
 import csv
+import gzip
+import io
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+ENCODING = 'utf-8'
+COMPRESSION_SUFFIXES = {'.gz': 'gzip', '.zst': 'zstd'}
+GZIP_LEVEL = 5
+ZSTD_LEVEL = 3
+# The spill files are only read back once, so they favour speed over size
+SPILL_GZIP_LEVEL = 1
+BUFFER_BYTES = 1024 * 1024
+MAX_PART_BYTES = 1024 * 1024 * 1024
+# The size of a rotated part is checked every ROTATION_CHECK_ROWS rows
+ROTATION_CHECK_ROWS = 100
+EXPORT_FILE_PREFIX = 'data_from_db'
 
 def user_input(message):
     """
@@ -11,8 +40,8 @@ def user_input(message):
     Args:
         message: This is the question that is being asked to the user
     """
-    response = input(message)
     while(1):
+        response = input(message)
         if response != "":
             return response
 
@@ -35,13 +64,346 @@ def write_to_csv(column_names, response, filename):
     """
     csv_file = filename
     try:
-        with open(csv_file, 'w') as csvfile:
-            writer = csv.DictWriter(csvfile, fieldnames=column_names)
-            writer.writeheader()
-            for data in response:
-                writer.writerow(data)
+        with StreamingCsvWriter(column_names, csv_file) as writer:
+            writer.writerows(response)
             return csv_file
     except Exception as e:
         console_output("The program had to terminate because of the following error in write_to_csv: "+str(e))
         exit(1)
-    
\ No newline at end of file
+
+def export_file_name(table_name, compression=None):
+    """
+    Returns a file name for an export of the table that no other export uses, eg: data_from_db.devices.20190416-142200.csv.gz
+
+    Args:
+        table_name: name of the table in DynamoDB
+        compression: gzip, zstd or None
+    """
+    suffixes = {compression_name: suffix for suffix, compression_name in COMPRESSION_SUFFIXES.items()}
+    return (EXPORT_FILE_PREFIX + "." + table_name + "." + time.strftime("%Y%m%d-%H%M%S") + "-" + str(os.getpid()) + ".csv"
+            + suffixes.get(compression, ""))
+
+def compression_of(filename):
+    """
+    Returns the compression of a file from its extension, gzip, zstd or None
+
+    Args:
+        filename: The name of the file
+    """
+    return COMPRESSION_SUFFIXES.get(os.path.splitext(filename)[1].lower())
+
+def part_file_name(filename, number):
+    """
+    Returns the name of a part of a rotated file, the first part being the file itself
+
+    Args:
+        filename: The name of the file, eg: data_from_db.csv.gz
+        number: The number of the part, starting at 1
+    """
+    if number == 1:
+        return filename
+    match = re.match(r'(.*?)((\.csv)?(\.gz|\.zst)?)$', filename, re.IGNORECASE)
+    return match.group(1) + ".part-" + "%04d" % number + match.group(2)
+
+def part_file_names(filename):
+    """
+    Returns the names of the file and of the parts it was rotated to, in order
+
+    Args:
+        filename: The name of the first part
+    """
+    file_names = [filename]
+    while os.path.exists(part_file_name(filename, len(file_names) + 1)):
+        file_names.append(part_file_name(filename, len(file_names) + 1))
+    return file_names
+
+def zstandard_module():
+    if zstandard is None:
+        raise RuntimeError("Reading and writing .zst files needs zstandard, please install it with: pip install zstandard")
+    return zstandard
+
+def open_binary(filename):
+    """
+    Opens a file for reading in binary mode, decompressing it according to its extension. The parts of a rotated file
+    are read as one file, the header line of every part after the first being skipped. Compressed files can only be
+    moved forward, see skip_to.
+
+    Args:
+        filename: The name of the file, or of the first part of a rotated file
+    """
+    file_names = part_file_names(filename)
+    if len(file_names) > 1:
+        return io.BufferedReader(PartsReader(file_names), BUFFER_BYTES)
+    return open_part(filename)
+
+def open_part(filename):
+    """
+    Opens a single file for reading in binary mode, decompressing it according to its extension
+
+    Args:
+        filename: The name of the file
+    """
+    compression = compression_of(filename)
+    if compression == 'gzip':
+        return gzip.open(filename, 'rb')
+    if compression == 'zstd':
+        raw_file = open(filename, 'rb')
+        # A file appended to holds several frames
+        return io.BufferedReader(zstandard_module().ZstdDecompressor().stream_reader(raw_file, read_across_frames=True,
+                                                                                     closefd=True), BUFFER_BYTES)
+    return open(filename, 'rb', buffering=BUFFER_BYTES)
+
+def open_text(filename):
+    """
+    Opens a file for reading as text, such as with csv.DictReader, see open_binary
+
+    Args:
+        filename: The name of the file, or of the first part of a rotated file
+    """
+    return io.TextIOWrapper(open_binary(filename), encoding=ENCODING, newline='')
+
+def skip_to(binary_file, offset):
+    """
+    Moves a file opened with open_binary forward to the byte offset, counted in the decompressed content. Compressed
+    files are decompressed up to the offset.
+
+    Args:
+        binary_file: The file returned by open_binary
+        offset: The byte offset to move to
+    """
+    if binary_file.seekable():
+        binary_file.seek(offset)
+        return
+    remaining = offset - binary_file.tell()
+    while remaining > 0:
+        block = binary_file.read(min(remaining, BUFFER_BYTES))
+        if not block:
+            return
+        remaining -= len(block)
+
+class PartsReader(io.RawIOBase):
+    """
+    Reads the parts of a rotated file one after the other as a single stream, leaving out the header line of every
+    part after the first. The offsets are counted in the joined stream.
+
+    Args:
+        file_names: The names of the parts in order, returned by part_file_names
+    """
+    def __init__(self, file_names):
+        self.file_names = file_names
+        self._number = 0
+        self._position = 0
+        self._part = open_part(file_names[0])
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while self._part is not None:
+            data = self._part.read(len(buffer))
+            if data:
+                buffer[:len(data)] = data
+                self._position += len(data)
+                return len(data)
+            self._part.close()
+            self._part = None
+            self._number += 1
+            if self._number < len(self.file_names):
+                self._part = open_part(self.file_names[self._number])
+                self._part.readline()
+        return 0
+
+    def tell(self):
+        return self._position
+
+    def close(self):
+        if self._part is not None:
+            self._part.close()
+            self._part = None
+        super().close()
+
+class StreamingCsvWriter:
+    """
+    Writes rows to a CSV file as they are produced, so that large outputs never have to be held in memory.
+    The header is written when the file is opened, and attributes that are not in the header are left out.
+    The file is compressed according to its extension. With max_bytes, the output is rotated to a new part, with its
+    own header, once about max_bytes have been written to the current part. The next part is only started when a row
+    is written to it, so the output never ends with a part holding only a header.
+
+    Args:
+        column_names: This is the list of the headers in the csv
+        filename: The name of the output file
+        append: Whether rows are appended to an existing file, the header is then only written if the file is empty
+        max_bytes: The size of the parts on disk, the file is not rotated when not given
+    """
+    def __init__(self, column_names, filename, append=False, max_bytes=None):
+        self.column_names = column_names
+        self.filename = filename
+        self.filenames = part_file_names(filename) if append else [filename]
+        self.max_bytes = max_bytes
+        self.row_count = 0
+        self.closed = False
+        self._part_full = False
+        if not append:
+            # The parts of an earlier, larger output would otherwise be read back as part of this one
+            for stale_file_name in part_file_names(filename)[1:]:
+                os.remove(stale_file_name)
+        self._open(self.filenames[-1], append)
+
+    def _open(self, filename, append):
+        new_file = not append or not os.path.exists(filename) or os.path.getsize(filename) == 0
+        self._raw_file = open(filename, 'ab' if append else 'wb', buffering=BUFFER_BYTES)
+        self._start_stream(compression_of(filename))
+        if new_file:
+            self._writer.writeheader()
+
+    def _start_stream(self, compression):
+        if compression == 'gzip':
+            self._binary_file = gzip.GzipFile(fileobj=self._raw_file, mode='wb', compresslevel=GZIP_LEVEL)
+        elif compression == 'zstd':
+            self._binary_file = zstandard_module().ZstdCompressor(level=ZSTD_LEVEL).stream_writer(self._raw_file,
+                                                                                                   closefd=False)
+        else:
+            self._binary_file = self._raw_file
+        self._csv_file = io.TextIOWrapper(self._binary_file, encoding=ENCODING, newline='')
+        self._writer = csv.DictWriter(self._csv_file, fieldnames=self.column_names, extrasaction='ignore')
+
+    def writerows(self, rows):
+        for row in rows:
+            if self._part_full:
+                self._close_part()
+                self.filenames.append(part_file_name(self.filename, len(self.filenames) + 1))
+                self._open(self.filenames[-1], False)
+                self._part_full = False
+            self._writer.writerow(row)
+            self.row_count += 1
+            # The size on disk lags behind the rows still held by the buffers and the compressor
+            if self.max_bytes and self.row_count % ROTATION_CHECK_ROWS == 0:
+                self._part_full = self._raw_file.tell() >= self.max_bytes
+
+    def flush(self):
+        self._csv_file.flush()
+        self._raw_file.flush()
+
+    def commit(self):
+        """
+        Flushes the rows written so far to the file and returns the size of the file on disk. A compressed file gets
+        the end of its gzip member or zstd frame, so the file cut back to this size is complete and readable, and the
+        next rows start a new member or frame that readers concatenate to it.
+        """
+        self._csv_file.flush()
+        if self._binary_file is self._raw_file:
+            self._raw_file.flush()
+            return self._raw_file.tell()
+        # Detaching keeps the raw file open while the compressor is closed
+        self._csv_file.detach()
+        self._binary_file.close()
+        self._raw_file.flush()
+        size = self._raw_file.tell()
+        # The next member starts with its header, which is not part of the committed size
+        self._start_stream(compression_of(self.filenames[-1]))
+        return size
+
+    def sync(self):
+        """
+        Forces the rows flushed so far to the disk
+        """
+        os.fsync(self._raw_file.fileno())
+
+    def _close_part(self):
+        # Closing the compressor writes the end of the stream, the file is closed after it
+        self._csv_file.close()
+        self._raw_file.close()
+
+    def close(self):
+        self._close_part()
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+class SpillCsvWriter:
+    """
+    Streams rows whose columns are not known up front, such as the items returned by a scan or query, to a CSV file.
+    Every thread appends its rows to its own compressed spill file in the same directory as they arrive, so the threads
+    never wait for each other, and the union of their columns is collected. The CSV file with the final sorted header
+    is written from the spill files when the writer is closed, compressed and rotated like with StreamingCsvWriter.
+
+    Args:
+        filename: The name of the output file
+        max_bytes: The size of the parts on disk, the file is not rotated when not given
+    """
+    def __init__(self, filename, max_bytes=None):
+        self.filename = filename
+        self.filenames = [filename]
+        self.max_bytes = max_bytes
+        self._spills = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    @property
+    def row_count(self):
+        return sum(spill['rows'] for spill in self._spills)
+
+    @property
+    def column_names(self):
+        column_names = set()
+        for spill in self._spills:
+            column_names.update(spill['columns'])
+        return column_names
+
+    def _spill(self):
+        spill = getattr(self._local, 'spill', None)
+        if spill is None:
+            spill_file = tempfile.NamedTemporaryFile('wb', dir=os.path.dirname(os.path.abspath(self.filename)),
+                                                     prefix='.spill-', suffix='.jsonl.gz', delete=False)
+            spill = {
+                'file_name': spill_file.name,
+                'raw_file': spill_file,
+                'file': io.TextIOWrapper(gzip.GzipFile(fileobj=spill_file, mode='wb', compresslevel=SPILL_GZIP_LEVEL),
+                                         encoding=ENCODING),
+                'columns': set(),
+                'rows': 0,
+            }
+            # Only a thread writing its first rows takes the lock
+            with self._lock:
+                self._spills.append(spill)
+            self._local.spill = spill
+        return spill
+
+    def writerows(self, rows):
+        lines = []
+        columns = set()
+        for row in rows:
+            columns.update(row)
+            lines.append(json.dumps(row, default=str))
+        if not lines:
+            return
+        spill = self._spill()
+        spill['columns'].update(columns)
+        spill['file'].write("\n".join(lines) + "\n")
+        spill['rows'] += len(lines)
+
+    def close(self):
+        try:
+            for spill in self._spills:
+                spill['file'].close()
+                spill['raw_file'].close()
+            with StreamingCsvWriter(sorted(self.column_names), self.filename, max_bytes=self.max_bytes) as csv_writer:
+                for spill in self._spills:
+                    with gzip.open(spill['file_name'], 'rt', encoding=ENCODING) as spill_file:
+                        csv_writer.writerows(json.loads(line) for line in spill_file)
+            self.filenames = csv_writer.filenames
+        finally:
+            for spill in self._spills:
+                spill['raw_file'].close()
+                os.remove(spill['file_name'])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,168 @@
+"""
+This module builds the typed schema used by the fast write path. Instead of storing every value as a string and letting
+the boto3 resource layer inspect the type of every value of every item, the type of each column (S, N or BOOL) is worked
+out once per file and compiled into a serializer that turns a CSV row straight into the low-level AttributeValue format
+sent with client.batch_write_item. Numbers stored as N are also smaller on the wire and in storage.
+"""
+
+import re
+from decimal import Decimal
+import export_csv
+import timestamps
+
+SAMPLE_ROWS = 1000
+NUMBER_PATTERN = re.compile(r'-?(0|[1-9][0-9]*)(\.[0-9]+)?([eE][-+]?[0-9]+)?$')
+# The numbers DynamoDB stores: up to 38 significant digits, with magnitudes from 1E-130 to 9.99...E+125
+MAX_SIGNIFICANT_DIGITS = 38
+MIN_MAGNITUDE = Decimal('1E-130')
+MAX_MAGNITUDE = Decimal('1E+126')
+BOOLEAN_VALUES = {'true': True, 'false': False}
+
+def infer_schema(csv_file_name, column_names, key_types=None, timestamp_columns=timestamps.DEFAULT_TIMESTAMP_COLUMNS,
+                 column_types=None):
+    """
+    Infers the type of every column from the first SAMPLE_ROWS rows of the CSV file. A column is N when every sampled
+    value is a number without leading zeros (so ids like 087cbe92 or 0123 stay strings) that DynamoDB can store as is
+    (so long numeric ids keep all their digits), BOOL when every value is true or false, and S otherwise. Empty values
+    are ignored. The columns whose type is given are not inferred, and the key columns always keep the type declared by
+    the table.
+    It returns a dictionary mapping every column to its type.
+
+    Args:
+        csv_file_name: The name of the CSV file
+        column_names: This is the list of the headers in the csv
+        key_types: A dictionary mapping the key columns to the type declared in the table's AttributeDefinitions
+        timestamp_columns: The names of the columns converted to ISO formatted timestamps, which are always strings
+        column_types: A dictionary mapping columns to the type they are stored as, returned by parse_column_types
+    """
+    column_types = column_types or {}
+    candidates = {column_name: {'N', 'BOOL'} for column_name in column_names
+                  if column_name not in timestamp_columns and column_name not in column_types}
+    item_chunks = export_csv.read_item_chunks(csv_file_name, column_names, SAMPLE_ROWS, timestamp_columns)
+    for item in next(item_chunks, []):
+        for column_name, types in candidates.items():
+            value = item.get(column_name)
+            if not value:
+                continue
+            if 'N' in types and not is_number(value):
+                types.discard('N')
+            if 'BOOL' in types and value.lower() not in BOOLEAN_VALUES:
+                types.discard('BOOL')
+    item_chunks.close()
+    schema = {column_name: 'S' for column_name in column_names}
+    for column_name, types in candidates.items():
+        if 'N' in types:
+            schema[column_name] = 'N'
+        elif 'BOOL' in types:
+            schema[column_name] = 'BOOL'
+    schema.update(column_types)
+    schema.update(key_types or {})
+    return schema
+
+def parse_column_types(text, column_names):
+    """
+    Returns the column types listed in a comma separated text of column:type pairs, eg: Count:N,Active:BOOL. It raises
+    a ValueError naming the columns that are not in the file or the types that are not S, N or BOOL.
+
+    Args:
+        text: The comma separated column:type pairs, blank when every type is inferred
+        column_names: This is the list of the headers in the csv
+    """
+    column_types = {}
+    for pair in text.split(','):
+        if not pair.strip():
+            continue
+        column_name, separator, attribute_type = pair.rpartition(':')
+        column_name = column_name.strip()
+        attribute_type = attribute_type.strip().upper()
+        if not separator or attribute_type not in CONVERTERS:
+            raise ValueError("The type of " + pair.strip() + " is not one of S, N or BOOL")
+        if column_name not in column_names:
+            raise ValueError("The file has no column " + column_name)
+        column_types[column_name] = attribute_type
+    return column_types
+
+def key_types_from_table(table_description):
+    """
+    Returns the types of the key attributes declared by a table
+
+    Args:
+        table_description: The Table element of the describe_table response
+    """
+    key_names = [each['AttributeName'] for each in table_description['KeySchema']]
+    return {each['AttributeName']: each['AttributeType'] for each in table_description['AttributeDefinitions']
+            if each['AttributeName'] in key_names}
+
+class ItemSerializer:
+    """
+    Turns items read from the CSV file into the low-level AttributeValue format, using one converter per column compiled
+    from the schema. Attributes that are not in the schema, such as the TimeBucket, are stored as strings.
+
+    Args:
+        schema: The dictionary mapping every column to S, N or BOOL, returned by infer_schema
+    """
+    def __init__(self, schema):
+        self.schema = schema
+        self._converters = {column_name: CONVERTERS.get(attribute_type, to_string) for column_name, attribute_type in schema.items()}
+
+    def serialize(self, item):
+        converters = self._converters
+        return {name: converters.get(name, to_string)(value) for name, value in item.items()}
+
+    def python_value(self, column_name, value):
+        """
+        Returns the value the boto3 resource layer gives back for a value written by this serializer, used to compare
+        the keys read back during validation
+
+        Args:
+            column_name: The name of the column
+            value: The value read from the CSV file
+        """
+        if self.schema.get(column_name) == 'N' and is_number(value):
+            return Decimal(value)
+        return value
+
+    def raw_value(self, attribute_value):
+        """
+        Returns the text of a low-level AttributeValue, such as a key left unprocessed by batch_write_item
+
+        Args:
+            attribute_value: The AttributeValue, eg: {'S': '087cbe92dcbb'}
+        """
+        return next(iter(attribute_value.values()))
+
+def is_number(value):
+    """
+    Returns whether the text is a number DynamoDB stores without rounding or rejecting it
+
+    Args:
+        value: The value read from the CSV file
+    """
+    if not NUMBER_PATTERN.match(value):
+        return False
+    number = Decimal(value)
+    if not number:
+        return True
+    significant_digits = "".join(str(digit) for digit in number.as_tuple().digits).strip("0")
+    return len(significant_digits) <= MAX_SIGNIFICANT_DIGITS and MIN_MAGNITUDE <= abs(number) < MAX_MAGNITUDE
+
+def to_string(value):
+    return {'S': value}
+
+def to_number(value):
+    # A value that is not a number after all is kept as a string rather than failing the whole batch
+    if not value:
+        return {'NULL': True}
+    if is_number(value):
+        return {'N': value}
+    return {'S': value}
+
+def to_boolean(value):
+    if not value:
+        return {'NULL': True}
+    boolean = BOOLEAN_VALUES.get(value.lower())
+    if boolean is None:
+        return {'S': value}
+    return {'BOOL': boolean}
+
+CONVERTERS = {'S': to_string, 'N': to_number, 'BOOL': to_boolean}
@@ -0,0 +1,170 @@
+"""
+This module keeps a progress journal of an import, so that an interrupted import can be resumed instead of writing the
+whole file again. The journal records how the file was split into shards and, for every shard, the byte offset up to
+which the rows have been written to DynamoDB and their status recorded. The commits are flushed after every chunk but
+only synced to disk every few seconds, so keeping the journal costs next to nothing compared to the writes.
+A chunk that was written but not yet committed when the import stopped is written again on resume. Every commit also
+records the size of the status file, which is synced to disk before the journal, so on resume the status file is cut
+back to the last commit whose rows it holds and no row ends up in it twice or not at all.
+"""
+
+import os
+import threading
+import time
+import input_output as io
+
+FSYNC_INTERVAL = 5
+
+def journal_name(csv_file_name, table_name):
+    """
+    Returns the name of the journal of an import of the CSV file into the table
+
+    Args:
+        csv_file_name: The name of the CSV file
+        table_name: name of the table in DynamoDB
+    """
+    return csv_file_name + "." + table_name + ".journal"
+
+def fingerprint(csv_file_name):
+    """
+    Returns the size and modification time of the CSV file, and of the parts it was rotated to, so a journal is not
+    used once the file has changed
+
+    Args:
+        csv_file_name: The name of the CSV file
+    """
+    file_stats = [os.stat(file_name) for file_name in io.part_file_names(csv_file_name)]
+    return " ".join(str(file_stat.st_size) + " " + str(file_stat.st_mtime_ns) for file_stat in file_stats)
+
+def start_journal(journal_file_name, csv_file_name, shards):
+    """
+    Creates a new journal for the given shards, replacing any previous journal, and returns the shards as a plan with
+    the offset to start each shard from
+
+    Args:
+        journal_file_name: The name of the journal file
+        csv_file_name: The name of the CSV file
+        shards: The list of (start, end) byte ranges the file is split into
+    """
+    with open(journal_file_name, 'w') as journal_file:
+        journal_file.write("F " + fingerprint(csv_file_name) + "\n")
+        for start, end in shards:
+            journal_file.write("S " + str(start) + " " + str(end) + "\n")
+        journal_file.flush()
+        os.fsync(journal_file.fileno())
+    return [{'start': start, 'end': end, 'offset': start, 'commits': []} for start, end in shards]
+
+def read_journal(journal_file_name, csv_file_name):
+    """
+    Reads the journal of an interrupted import and returns its plan, with the offset every shard should resume from.
+    It returns None when there is no journal or the CSV file has changed since it was written.
+
+    Args:
+        journal_file_name: The name of the journal file
+        csv_file_name: The name of the CSV file
+    """
+    if not os.path.exists(journal_file_name):
+        return None
+    plan = {}
+    with open(journal_file_name) as journal_file:
+        lines = journal_file.read().split("\n")
+    if not lines or lines[0] != "F " + fingerprint(csv_file_name):
+        return None
+    for line in lines[1:]:
+        parts = line.split(" ")
+        # A line cut short by a crash is ignored
+        if len(parts) not in (3, 4) or not all(part.isdigit() for part in parts[1:]):
+            continue
+        if parts[0] == "S":
+            plan[int(parts[1])] = {'start': int(parts[1]), 'end': int(parts[2]), 'offset': int(parts[1]), 'commits': []}
+        elif parts[0] == "C" and int(parts[1]) in plan:
+            shard = plan[int(parts[1])]
+            shard['offset'] = max(shard['offset'], int(parts[2]))
+            shard['commits'].append((int(parts[2]), int(parts[3]) if len(parts) == 4 else None))
+    return list(plan.values())
+
+def restore_status(shard, status_file_name):
+    """
+    Moves a shard of a resumed import back to its last commit whose status rows are all in the status file, and cuts
+    the status file back to the size recorded with that commit. The rows written after that commit are imported again.
+
+    Args:
+        shard: The shard of the plan returned by read_journal
+        status_file_name: The name of the status file the shard's rows are appended to
+    """
+    commits = shard['commits']
+    # The journals written before the status sizes were recorded are resumed from their last commit
+    if any(status_size is None for offset, status_size in commits):
+        return
+    file_size = os.path.getsize(status_file_name) if os.path.exists(status_file_name) else 0
+    kept = [commit for commit in commits if commit[1] <= file_size]
+    if kept:
+        shard['offset'], status_size = max(kept)
+        os.truncate(status_file_name, status_size)
+    else:
+        shard['offset'] = shard['start']
+        if os.path.exists(status_file_name):
+            os.remove(status_file_name)
+
+def remove_journal(journal_file_name):
+    """
+    Deletes the journal once the import has finished
+
+    Args:
+        journal_file_name: The name of the journal file
+    """
+    if os.path.exists(journal_file_name):
+        os.remove(journal_file_name)
+
+class ImportJournal:
+    """
+    Appends the commits of an import to its journal. Several processes can append to the same journal, each line being
+    written in a single call.
+
+    Args:
+        journal_file_name: The name of the journal file created by start_journal
+    """
+    def __init__(self, journal_file_name):
+        self.journal_file_name = journal_file_name
+        self._journal_file = open(journal_file_name, 'a')
+        self._synced = time.monotonic()
+        self._status_writer = None
+        self._lock = threading.Lock()
+
+    def commit(self, shard_start, offset, status_writer=None):
+        """
+        Records that every row of the shard before offset has been written and its status recorded, with the size of
+        the status file. The status file is synced to disk before the journal, so the journal never gets ahead of it.
+
+        Args:
+            shard_start: The byte offset the shard started at in the plan
+            offset: The byte offset after the last row committed
+            status_writer: The input_output.StreamingCsvWriter of the status file of the shard
+        """
+        with self._lock:
+            line = "C " + str(shard_start) + " " + str(offset)
+            if status_writer is not None:
+                line += " " + str(status_writer.commit())
+                self._status_writer = status_writer
+            self._journal_file.write(line + "\n")
+            self._journal_file.flush()
+            if time.monotonic() - self._synced >= FSYNC_INTERVAL:
+                self._sync()
+
+    def _sync(self):
+        if self._status_writer is not None and not self._status_writer.closed:
+            self._status_writer.sync()
+        os.fsync(self._journal_file.fileno())
+        self._synced = time.monotonic()
+
+    def close(self):
+        with self._lock:
+            self._journal_file.flush()
+            self._sync()
+            self._journal_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,545 @@
+"""
+This module is an in-memory stand-in for DynamoDB, used to benchmark and try out the program without touching AWS.
+It answers the requests of the boto3 clients from inside botocore, right before they would be sent, so the resource
+layer, the serialization and the parsing of the responses all run as they do against the real service. The stand-in
+implements the operations used by the program: CreateTable, DescribeTable, UpdateTable, BatchWriteItem, PutItem,
+GetItem, BatchGetItem, Query and paginated Scan, with simple key conditions and filters.
+Latency can be added to every request, and a share of the requests can be throttled or have some of their items left
+unprocessed, to see how the program copes with a slow or overloaded table.
+"""
+
+import asyncio
+import json
+import math
+import random
+import re
+import threading
+import time
+from decimal import Decimal
+from botocore.awsrequest import AWSResponse
+from botocore.exceptions import ClientError
+import aws_clients
+
+# DynamoDB returns at most 1 MB per Query or Scan page
+PAGE_BYTES = 1024 * 1024
+WRITE_UNIT_BYTES = 1024
+READ_UNIT_BYTES = 4096
+ERROR_PREFIX = 'com.amazonaws.dynamodb.v20120810#'
+CONDITION_PATTERN = re.compile(r'\s*(begins_with\s*\(\s*(?P<prefix_name>[#\w.]+)\s*,\s*(?P<prefix>:\w+)\s*\)'
+                               r'|(?P<name>[#\w.]+)\s*(?:(?P<operator>=|<=|>=|<|>)\s*(?P<value>:\w+)'
+                               r'|BETWEEN\s+(?P<low>:\w+)\s+AND\s+(?P<high>:\w+)))\s*', re.IGNORECASE)
+OPENING_PATTERN = re.compile(r'\s*\(\s*')
+CLOSING_PATTERN = re.compile(r'\s*\)\s*')
+JOINER_PATTERN = re.compile(r'\s*AND\b\s*', re.IGNORECASE)
+
+class LocalDynamoDB:
+    """
+    The in-memory tables and the request handler that answers the boto3 requests. Requests are counted by operation.
+
+    Args:
+        latency: The seconds added to every request
+        jitter: The seconds of random latency added on top of latency
+        throttle_rate: The share of the requests rejected with ProvisionedThroughputExceededException
+        unprocessed_rate: The share of the items of a batch request returned as unprocessed
+        seed: The seed of the random generator, so a run can be repeated
+    """
+    def __init__(self, latency=0, jitter=0, throttle_rate=0, unprocessed_rate=0, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.throttle_rate = throttle_rate
+        self.unprocessed_rate = unprocessed_rate
+        self.tables = {}
+        self.request_counts = {}
+        self.throttled_counts = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def install(self):
+        """
+        Answers the DynamoDB requests of the clients handed out by aws_clients from now on. Clients created before
+        keep sending their requests to AWS, so the stand-in should be installed before anything else runs.
+        """
+        aws_clients.register_handler('before-send.dynamodb', self.handle)
+
+    def handle(self, request, event_name, **kwargs):
+        """
+        Answers a request prepared by botocore and returns the response in place of the one from the network
+        """
+        operation = event_name.rsplit('.', 1)[-1]
+        delay, throttled = self.begin(operation)
+        if delay:
+            time.sleep(delay)
+        try:
+            result = self.call(operation, json.loads(request.body or b'{}', parse_float=Decimal), throttled)
+        except LocalError as e:
+            return error_response(request.url, e.code, str(e))
+        return AWSResponse(request.url, 200, {'Content-Type': 'application/x-amz-json-1.0'},
+                           RawBody(json.dumps(result, default=str).encode('utf-8')))
+
+    async def handle_async(self, operation, request):
+        """
+        Answers a request of the LocalAsyncClient, raising the ClientError botocore would raise for an error response
+
+        Args:
+            operation: The name of the operation, eg: BatchWriteItem
+            request: The parameters of the request
+        """
+        delay, throttled = self.begin(operation)
+        if delay:
+            await asyncio.sleep(delay)
+        try:
+            result = self.call(operation, request, throttled)
+        except LocalError as e:
+            raise ClientError({'Error': {'Code': e.code, 'Message': str(e)}}, operation)
+        # The response goes through JSON like on the wire, so the caller never shares the stored items
+        return json.loads(json.dumps(result, default=str))
+
+    def begin(self, operation):
+        """
+        Counts a request and draws its latency and whether it is throttled
+        """
+        with self._lock:
+            self.request_counts[operation] = self.request_counts.get(operation, 0) + 1
+            delay = self.latency + self._random.random() * self.jitter
+            throttled = self.throttle_rate and self._random.random() < self.throttle_rate
+            if throttled:
+                self.throttled_counts[operation] = self.throttled_counts.get(operation, 0) + 1
+        return delay, throttled
+
+    def call(self, operation, request, throttled=False):
+        """
+        Runs an operation on the tables and returns its response, raising LocalError for an error response
+        """
+        if throttled and operation not in ('CreateTable', 'DescribeTable', 'UpdateTable'):
+            raise LocalError('ProvisionedThroughputExceededException', "The level of configured provisioned "
+                             "throughput for the table was exceeded")
+        handler = getattr(self, 'op_' + operation, None)
+        if handler is None:
+            raise LocalError('ValidationException', "The local stand-in does not support " + operation)
+        with self._lock:
+            return handler(request)
+
+    def table(self, table_name):
+        if table_name not in self.tables:
+            raise LocalError('ResourceNotFoundException', "Requested resource not found: Table: " + table_name + " not found")
+        return self.tables[table_name]
+
+    def unprocessed(self, requests):
+        """
+        Splits the requests of a batch into the processed and the unprocessed ones, following unprocessed_rate
+        """
+        if not self.unprocessed_rate:
+            return requests, []
+        processed = []
+        unprocessed = []
+        for each in requests:
+            (unprocessed if self._random.random() < self.unprocessed_rate else processed).append(each)
+        return processed, unprocessed
+
+    def op_CreateTable(self, body):
+        if body['TableName'] in self.tables:
+            raise LocalError('ResourceInUseException', "Table already exists: " + body['TableName'])
+        self.tables[body['TableName']] = LocalTable(body)
+        return {'TableDescription': self.tables[body['TableName']].description()}
+
+    def op_DescribeTable(self, body):
+        return {'Table': self.table(body['TableName']).description()}
+
+    def op_UpdateTable(self, body):
+        table = self.table(body['TableName'])
+        table.update(body)
+        return {'TableDescription': table.description()}
+
+    def op_BatchWriteItem(self, body):
+        unprocessed_items = {}
+        consumed_capacity = []
+        for table_name, requests in body['RequestItems'].items():
+            table = self.table(table_name)
+            processed, unprocessed = self.unprocessed(requests)
+            units = 0
+            index_units = {}
+            for each in processed:
+                if 'PutRequest' in each:
+                    item = each['PutRequest']['Item']
+                    table.add_index_units(index_units, item)
+                    units += table.put(item)
+                else:
+                    table.add_index_units(index_units, table.get(each['DeleteRequest']['Key']))
+                    units += table.delete(each['DeleteRequest']['Key'])
+            if unprocessed:
+                unprocessed_items[table_name] = unprocessed
+            consumed_capacity.append(capacity_entry(body, table_name, units, index_units))
+        response = {'UnprocessedItems': unprocessed_items}
+        if body.get('ReturnConsumedCapacity', 'NONE') != 'NONE':
+            response['ConsumedCapacity'] = consumed_capacity
+        return response
+
+    def op_PutItem(self, body):
+        units = self.table(body['TableName']).put(body['Item'])
+        return consumed(body, body['TableName'], units, {})
+
+    def op_GetItem(self, body):
+        table = self.table(body['TableName'])
+        item = table.get(body['Key'])
+        response = {'Item': project(item, body)} if item is not None else {}
+        return consumed(body, table.name, read_units(item, body), response)
+
+    def op_BatchGetItem(self, body):
+        responses = {}
+        unprocessed_keys = {}
+        consumed_capacity = []
+        for table_name, request in body['RequestItems'].items():
+            table = self.table(table_name)
+            processed, unprocessed = self.unprocessed(request['Keys'])
+            items = []
+            units = 0
+            for key in processed:
+                item = table.get(key)
+                units += read_units(item, request)
+                if item is not None:
+                    items.append(project(item, request))
+            responses[table_name] = items
+            if unprocessed:
+                unprocessed_keys[table_name] = dict(request, Keys=unprocessed)
+            consumed_capacity.append({'TableName': table_name, 'CapacityUnits': units})
+        response = {'Responses': responses, 'UnprocessedKeys': unprocessed_keys}
+        if body.get('ReturnConsumedCapacity', 'NONE') != 'NONE':
+            response['ConsumedCapacity'] = consumed_capacity
+        return response
+
+    def op_Query(self, body):
+        table = self.table(body['TableName'])
+        conditions = parse_conditions(body['KeyConditionExpression'], body)
+        key_names = table.key_names(body.get('IndexName'))
+        partition = conditions.pop(key_names[0])
+        items = table.query(partition[1][0], key_names, conditions.get(key_names[1]), body.get('IndexName'))
+        if not body.get('ScanIndexForward', True):
+            items.reverse()
+        return page(table, items, key_names, body)
+
+    def op_Scan(self, body):
+        table = self.table(body['TableName'])
+        items, positions = table.scan(body.get('Segment', 0), body.get('TotalSegments', 1))
+        return page(table, items, table.key_names(), body, positions)
+
+class LocalAsyncClient:
+    """
+    Test double of the aiobotocore DynamoDB client used by async_engine, answering from a LocalDynamoDB. The methods
+    take the same parameters as the client, eg: await client.batch_write_item(RequestItems=...).
+
+    Args:
+        local: The LocalDynamoDB holding the tables
+    """
+    def __init__(self, local):
+        self.local = local
+
+    def __getattr__(self, name):
+        operation = ''.join(part.capitalize() for part in name.split('_'))
+        async def call(**request):
+            return await self.local.handle_async(operation, request)
+        return call
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+class LocalTable:
+    """
+    An in-memory table. The items are kept by partition, each partition holding its items by sort key.
+
+    Args:
+        request: The CreateTable request
+    """
+    def __init__(self, request):
+        self.name = request['TableName']
+        self.request = request
+        self.key_schema = request['KeySchema']
+        self.billing_mode = request.get('BillingMode', 'PROVISIONED')
+        self.throughput = dict(request.get('ProvisionedThroughput', {'ReadCapacityUnits': 0, 'WriteCapacityUnits': 0}))
+        self.indexes = [dict(each) for each in request.get('GlobalSecondaryIndexes', [])]
+        self.created = time.time()
+        self.partitions = {}
+        self.item_count = 0
+        # The items of every scan segment and their positions, rebuilt after a write
+        self._segments = {}
+
+    def key_names(self, index_name=None):
+        key_schema = self.key_schema
+        for index in self.indexes:
+            if index['IndexName'] == index_name:
+                key_schema = index['KeySchema']
+        key_schema = sorted(key_schema, key=lambda each: each['KeyType'])
+        return [each['AttributeName'] for each in key_schema] + [None] * (2 - len(key_schema))
+
+    def split_key(self, key):
+        partition_key, sort_key = self.key_names()
+        return comparable(key[partition_key]), comparable(key[sort_key]) if sort_key else None
+
+    def put(self, item):
+        partition_value, sort_value = self.split_key(item)
+        partition = self.partitions.setdefault(partition_value, {})
+        if sort_value not in partition:
+            self.item_count += 1
+            self._segments = {}
+        partition[sort_value] = item
+        return write_units(item)
+
+    def delete(self, key):
+        partition_value, sort_value = self.split_key(key)
+        item = self.partitions.get(partition_value, {}).pop(sort_value, None)
+        if item is not None:
+            self.item_count -= 1
+            self._segments = {}
+        return write_units(item or key)
+
+    def add_index_units(self, index_units, item):
+        """
+        Adds the write units a global secondary index consumes for an item written or deleted to index_units, for the
+        indexes whose keys the item has. The indexes project every attribute.
+        """
+        for index in self.indexes:
+            if item is not None and all(each['AttributeName'] in item for each in index['KeySchema']):
+                index_units[index['IndexName']] = index_units.get(index['IndexName'], 0) + write_units(item)
+
+    def get(self, key):
+        partition_value, sort_value = self.split_key(key)
+        return self.partitions.get(partition_value, {}).get(sort_value)
+
+    def query(self, partition_value, key_names, sort_condition, index_name=None):
+        if index_name is None:
+            items = [item for sort_value, item in sorted(self.partitions.get(comparable(partition_value), {}).items())]
+        else:
+            # The index is not maintained, its partition is found by going through the items
+            items = [item for item in self.scan(0, 1)[0] if key_names[0] in item
+                     and comparable(item[key_names[0]]) == comparable(partition_value) and key_names[1] in item]
+            items.sort(key=lambda item: comparable(item[key_names[1]]))
+        if sort_condition:
+            items = [item for item in items if key_names[1] in item and matches(item[key_names[1]], sort_condition)]
+        return items
+
+    def scan(self, segment, total_segments):
+        """
+        Returns the items of a scan segment in a fixed order, with the position of every key in that order so a page
+        can start right after the ExclusiveStartKey
+        """
+        if (segment, total_segments) not in self._segments:
+            items = []
+            for number, partition_value in enumerate(sorted(self.partitions)):
+                if number % total_segments == segment:
+                    items.extend(item for sort_value, item in sorted(self.partitions[partition_value].items()))
+            positions = {self.split_key(item): number for number, item in enumerate(items)}
+            self._segments[(segment, total_segments)] = (items, positions)
+        return self._segments[(segment, total_segments)]
+
+    def update(self, request):
+        if 'BillingMode' in request:
+            self.billing_mode = request['BillingMode']
+        if 'ProvisionedThroughput' in request:
+            if (request['ProvisionedThroughput']['ReadCapacityUnits'] < self.throughput['ReadCapacityUnits']
+                    or request['ProvisionedThroughput']['WriteCapacityUnits'] < self.throughput['WriteCapacityUnits']):
+                self.throughput['NumberOfDecreasesToday'] = self.throughput.get('NumberOfDecreasesToday', 0) + 1
+                self.throughput['LastDecreaseDateTime'] = time.time()
+            self.throughput.update(request['ProvisionedThroughput'])
+        for each in request.get('GlobalSecondaryIndexUpdates', []):
+            for index in self.indexes:
+                if 'Update' in each and index['IndexName'] == each['Update']['IndexName']:
+                    index['ProvisionedThroughput'] = each['Update']['ProvisionedThroughput']
+
+    def description(self):
+        description = {
+            'TableName': self.name,
+            'TableStatus': 'ACTIVE',
+            'KeySchema': self.key_schema,
+            'AttributeDefinitions': self.request['AttributeDefinitions'],
+            'CreationDateTime': self.created,
+            'ItemCount': self.item_count,
+            'ProvisionedThroughput': dict({'NumberOfDecreasesToday': 0}, **self.throughput),
+            'BillingModeSummary': {'BillingMode': self.billing_mode},
+        }
+        if self.indexes:
+            description['GlobalSecondaryIndexes'] = [dict(index, IndexStatus='ACTIVE') for index in self.indexes]
+        return description
+
+class LocalError(Exception):
+    def __init__(self, code, message):
+        Exception.__init__(self, message)
+        self.code = code
+
+class RawBody:
+    """
+    The raw body of a response, read by botocore with stream
+    """
+    def __init__(self, content):
+        self.content = content
+
+    def stream(self, **kwargs):
+        yield self.content
+
+def error_response(url, code, message):
+    content = json.dumps({'__type': ERROR_PREFIX + code, 'message': message}).encode('utf-8')
+    return AWSResponse(url, 400, {'Content-Type': 'application/x-amz-json-1.0'}, RawBody(content))
+
+def comparable(attribute_value):
+    """
+    Returns a value of a low-level AttributeValue that compares like DynamoDB compares keys
+
+    Args:
+        attribute_value: The AttributeValue, eg: {'N': '3.5'}
+    """
+    attribute_type, value = next(iter(attribute_value.items()))
+    if attribute_type == 'N':
+        return Decimal(value)
+    return value
+
+def item_bytes(item):
+    return sum(len(name) + len(json.dumps(value, default=str)) for name, value in item.items())
+
+def write_units(item):
+    return math.ceil(item_bytes(item) / WRITE_UNIT_BYTES)
+
+def read_units(item, request):
+    units = math.ceil(item_bytes(item) / READ_UNIT_BYTES) if item else 1
+    return units if request.get('ConsistentRead') else units / 2
+
+def capacity_entry(request, table_name, units, index_units):
+    """
+    Returns the ConsumedCapacity of a table, whose CapacityUnits add up the units of the table and its indexes. With
+    INDEXES, the units of the table and of every index are also reported apart.
+    """
+    entry = {'TableName': table_name, 'CapacityUnits': units + sum(index_units.values())}
+    if request.get('ReturnConsumedCapacity') == 'INDEXES':
+        entry['Table'] = {'CapacityUnits': units}
+        if index_units:
+            entry['GlobalSecondaryIndexes'] = {index_name: {'CapacityUnits': index_unit_count}
+                                               for index_name, index_unit_count in index_units.items()}
+    return entry
+
+def consumed(request, table_name, units, response):
+    if request.get('ReturnConsumedCapacity', 'NONE') != 'NONE':
+        response['ConsumedCapacity'] = {'TableName': table_name, 'CapacityUnits': units}
+    return response
+
+def resolve_name(name, request):
+    return request.get('ExpressionAttributeNames', {}).get(name, name)
+
+def project(item, request):
+    """
+    Returns the attributes of the item named by the ProjectionExpression of the request
+
+    Args:
+        item: The stored item
+        request: The request, with or without a ProjectionExpression
+    """
+    if not request.get('ProjectionExpression'):
+        return item
+    names = [resolve_name(each.strip(), request) for each in request['ProjectionExpression'].split(',')]
+    return {name: item[name] for name in names if name in item}
+
+def parse_conditions(expression, request):
+    """
+    Parses a key condition or filter made of comparisons, BETWEEN and begins_with joined with AND, which may be grouped
+    in parentheses the way boto3 writes the conditions built with Key and Attr. It returns a dictionary mapping every
+    attribute to its operator and values.
+
+    Args:
+        expression: The KeyConditionExpression or FilterExpression
+        request: The request holding the names and values of the expression
+    """
+    conditions = {}
+    expression = expression.strip()
+    if parse_group(expression, 0, request, conditions) != len(expression):
+        raise LocalError('ValidationException', "The local stand-in can not parse the expression: " + expression)
+    return conditions
+
+def parse_group(expression, position, request, conditions):
+    """
+    Parses the conditions joined with AND from position up to the end of the expression or an unmatched closing
+    parenthesis, adding them to conditions. It returns the position where the parsing stopped.
+
+    Args:
+        expression: The KeyConditionExpression or FilterExpression
+        position: The position of the first condition in the expression
+        request: The request holding the names and values of the expression
+        conditions: The dictionary receiving the operator and values of every attribute
+    """
+    values = request.get('ExpressionAttributeValues', {})
+    while True:
+        opening = OPENING_PATTERN.match(expression, position)
+        if opening:
+            position = parse_group(expression, opening.end(), request, conditions)
+            closing = CLOSING_PATTERN.match(expression, position)
+            if closing is None:
+                raise LocalError('ValidationException', "The local stand-in can not parse the expression: " + expression)
+            position = closing.end()
+        else:
+            found = CONDITION_PATTERN.match(expression, position)
+            if found is None:
+                raise LocalError('ValidationException', "The local stand-in can not parse the expression: " + expression)
+            if found.group('prefix_name'):
+                conditions[resolve_name(found.group('prefix_name'), request)] = ('begins_with', [values[found.group('prefix')]])
+            elif found.group('operator'):
+                conditions[resolve_name(found.group('name'), request)] = (found.group('operator'), [values[found.group('value')]])
+            else:
+                conditions[resolve_name(found.group('name'), request)] = ('between', [values[found.group('low')], values[found.group('high')]])
+            position = found.end()
+        joiner = JOINER_PATTERN.match(expression, position)
+        if joiner is None:
+            return position
+        position = joiner.end()
+
+def matches(attribute_value, condition):
+    operator, operands = condition
+    value = comparable(attribute_value)
+    operands = [comparable(each) for each in operands]
+    if operator == 'between':
+        return operands[0] <= value <= operands[1]
+    if operator == 'begins_with':
+        return value.startswith(operands[0])
+    return {'=': value == operands[0], '<': value < operands[0], '<=': value <= operands[0],
+            '>': value > operands[0], '>=': value >= operands[0]}[operator]
+
+def page(table, items, key_names, request, positions=None):
+    """
+    Returns one page of the items of a Query or Scan, starting after the ExclusiveStartKey and ending at the Limit or
+    after about 1 MB, with the FilterExpression applied to the items of the page
+
+    Args:
+        table: The LocalTable
+        items: The items in the order they are returned
+        key_names: The names of the key attributes of the table or index read
+        request: The Query or Scan request
+        positions: The position of every table key in items, the items are searched for the start key when not given
+    """
+    start = 0
+    if request.get('ExclusiveStartKey') and positions is not None:
+        start = positions.get(table.split_key(request['ExclusiveStartKey']), -1) + 1
+    elif request.get('ExclusiveStartKey'):
+        start_key = [comparable(request['ExclusiveStartKey'][name]) for name in key_names if name]
+        for number, item in enumerate(items):
+            if [comparable(item[name]) for name in key_names if name] == start_key:
+                start = number + 1
+                break
+    limit = request.get('Limit')
+    page_items = []
+    page_bytes = 0
+    number = start
+    while number < len(items) and (limit is None or len(page_items) < limit) and page_bytes < PAGE_BYTES:
+        page_items.append(items[number])
+        page_bytes += item_bytes(items[number])
+        number += 1
+    scanned_count = len(page_items)
+    if request.get('FilterExpression'):
+        conditions = parse_conditions(request['FilterExpression'], request)
+        page_items = [item for item in page_items if all(name in item and matches(item[name], condition)
+                                                         for name, condition in conditions.items())]
+    response = {'Items': [project(item, request) for item in page_items], 'Count': len(page_items),
+                'ScannedCount': scanned_count}
+    if request.get('Select') == 'COUNT':
+        del response['Items']
+    if number < len(items):
+        last_item = items[number - 1]
+        key_attributes = [name for name in key_names if name] + [name for name in table.key_names() if name]
+        response['LastEvaluatedKey'] = {name: last_item[name] for name in key_attributes}
+    return consumed(request, table.name, max(1, page_bytes / READ_UNIT_BYTES / 2), response)
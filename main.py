@@ -2,20 +2,94 @@
 This module has the main function that calls all the functions defined in other files. This is the entry point
 to the program.
 """
-import boto3
+import argparse
+import aws_clients
 from datetime import datetime
 import export_csv
 import create_table
 import import_csv
 import update_table
+import time_buckets
+import timestamps
+import sharded_import
+import journal
+import capacity_planner
+import item_schema
+import sync_import
+import metrics
+import async_engine
+import batch_import
 import input_output as io
 
 
-def write(dynamodb_resource):
+def import_file(table_name, csv_file_name, column_names, output_column_names, partition_key_col_name, sort_key_col_name,
+                validation, time_bucket, process_count, resume, typed, sync=False, delete=False, use_asyncio=False,
+                timestamp_columns=timestamps.DEFAULT_TIMESTAMP_COLUMNS, column_types=None,
+                worker_count=export_csv.DEFAULT_WORKER_COUNT):
+    """
+    Imports the CSV file in this process, or splits it between process_count processes when more than one is asked for.
+    The progress is recorded in a journal, so an interrupted import can be resumed. With typed values, the column types
+    are inferred from the file, unless given, and the items are written with the typed fast write path. In sync mode, only the rows
+    that are new or changed since the previous sync are written, in this process. The asyncio engine imports the file
+    in this process with many requests in flight instead.
+
+    Args:
+        table_name: name of the table in DynamoDB
+        csv_file_name: The name/path of the CSV file
+        column_names: This is the list of the headers in the csv
+        output_column_names: This is the list of the headers in the status csv
+        partition_key_col_name: This is the name of the primary key (hash key)
+        sort_key_col_name: This is the name of the sort key (range key)
+        validation: Whether the items are read back from DynamoDB to validate the import
+        time_bucket: The granularity of the time bucket index of the table, hour or day
+        process_count: The number of processes importing the file
+        resume: Whether the interrupted import recorded in the journal is resumed
+        typed: Whether numbers and booleans are stored as typed attributes instead of strings
+        sync: Whether only the new and changed rows are written
+        delete: Whether the sync deletes the items whose rows are no longer in the file
+        use_asyncio: Whether the file is imported with the asyncio engine
+        timestamp_columns: The names of the columns converted to ISO formatted timestamps
+        column_types: A dictionary mapping the columns whose type is not inferred to S, N or BOOL
+        worker_count: The number of threads writing to DynamoDB in every process, the asyncio engine has none
+    """
+    metrics.registry.reset()
+    schema = None
+    if typed:
+        # The key columns keep the types the table was created with
+        table_description = aws_clients.describe_table(table_name)
+        schema = item_schema.infer_schema(csv_file_name, column_names, item_schema.key_types_from_table(table_description),
+                                          timestamp_columns, column_types)
+    if sync:
+        summary = sync_import.sync_file(table_name, csv_file_name, column_names, output_column_names, partition_key_col_name,
+                                        sort_key_col_name, worker_count, validation=validation, time_bucket=time_bucket,
+                                        timestamp_columns=timestamp_columns, delete=delete, schema=schema)
+    elif use_asyncio:
+        summary = async_engine.run(async_engine.import_file(table_name, csv_file_name, column_names, output_column_names,
+                                                            partition_key_col_name, sort_key_col_name, validation,
+                                                            time_bucket, timestamp_columns, resume=resume, schema=schema))
+    else:
+        summary = sharded_import.import_sharded(table_name, csv_file_name, column_names, output_column_names,
+                                                partition_key_col_name, sort_key_col_name, process_count, worker_count,
+                                                validation=validation, time_bucket=time_bucket,
+                                                timestamp_columns=timestamp_columns, resume=resume, schema=schema)
+    report_metrics()
+    return summary
+
+def report_metrics():
+    """
+    Writes the metrics of the run to the JSON and Prometheus report files and shows the time spent in every stage
+    """
+    snapshot = metrics.write_reports()
+    io.console_output(metrics.describe(snapshot))
+    io.console_output("Run metrics written to " + metrics.JSON_REPORT_FILE_NAME + " and " + metrics.PROMETHEUS_FILE_NAME)
+
+def write(dynamodb_resource, worker_count=None):
     """
     This function is responsible for calling the read from csv and write to dynamoDB functions defined in export_csv file.
+    The number of writer threads is asked for when it is not given on the command line.
 
     Args:
+        worker_count: The number of threads writing to DynamoDB, given with --workers
         table: This is the boto3 DynamoDB resource which refers to the table
         table_name: name of the table in DynamoDB
         item_collection: This is the dictionary of all the rows read from the CSV file
@@ -24,32 +98,82 @@ def write(dynamodb_resource):
     """
     try:
         table_name = io.user_input("Please enter the table name: ")
-        table = dynamodb_resource.Table(table_name)
         csv_file_name = io.user_input("Please enter the name/path of the csv file: ")
         return_values = export_csv.read_csv(csv_file_name)
         column_names = return_values[0]
-        item_collection = return_values[1]
         output_column_names = return_values[2]
         io.console_output(column_names)
         io.console_output('From the above column names, please select: \n 1) Partition Key (A unique value that helps in identifying a record) \n 2) Sort Key (A value to help sort the records)')
         partition_key_col_name = io.user_input("Partition Key: ")
         sort_key_col_name = io.user_input ("Sort Key: ")
+        timestamp_columns = timestamps.parse_timestamp_columns(
+            io.user_input("Columns holding timestamps, converted to ISO format (comma separated, blank for Time, none for no column): "),
+            column_names)
+        validation = io.user_input("Validate the import by reading the items back? (y/n): ").lower() == "y"
+        typed = io.user_input("Store numbers and booleans as typed attributes? (y/n): ").lower() == "y"
+        column_types = None
+        if typed:
+            column_types = item_schema.parse_column_types(
+                io.user_input("Types of the columns not to infer, eg: Count:N,Active:BOOL (blank to infer them all): "),
+                column_names)
+        sync = io.user_input("Only write the rows that are new or changed since the last sync? (y/n): ").lower() == "y"
+        delete = False
+        use_asyncio = False
+        process_count = 1
+        if sync:
+            delete = io.user_input("Delete the items whose rows are no longer in the file? (y/n): ").lower() == "y"
+        else:
+            use_asyncio = io.user_input("Use the asyncio engine, for slow or distant connections? (y/n): ").lower() == "y"
+            if not use_asyncio:
+                process_count = io.user_input("Number of processes importing the file (1 for a single process): ")
+                process_count = int(process_count) if process_count.isdigit() else 1
+        if not use_asyncio and not worker_count:
+            worker_count = io.user_input("Number of threads writing to DynamoDB (blank for " + str(export_csv.DEFAULT_WORKER_COUNT) + "): ")
+            worker_count = int(worker_count) if worker_count.isdigit() and int(worker_count) > 0 else export_csv.DEFAULT_WORKER_COUNT
+        resume = False
+        if not sync and journal.read_journal(journal.journal_name(csv_file_name, table_name), csv_file_name) is not None:
+            io.console_output("An interrupted import of this file into " + table_name + " was found.")
+            resume = io.user_input("Resume it instead of starting over? (y/n): ").lower() == "y"
         io.console_output("Creating table: " + table_name)
-        create_response = create_table.create_dynamoDB_table(table_name,partition_key_col_name,sort_key_col_name)
+        time_bucket = None
+        # Only timestamps can be bucketed by hour or day
+        if sort_key_col_name in timestamp_columns:
+            io.console_output("Time range searches can use an index of hourly or daily buckets of the sort key instead of scanning the table.")
+            time_bucket = io.user_input("Time bucket index (none/hour/day): ").lower()
+            if time_bucket not in time_buckets.GRANULARITIES:
+                time_bucket = None
+        target_minutes = io.user_input("How many minutes should the import take? ")
+        try:
+            target_minutes = float(target_minutes)
+        except ValueError:
+            target_minutes = capacity_planner.DEFAULT_TARGET_MINUTES
+        plan = capacity_planner.plan_capacity(csv_file_name, target_minutes, validation, 1 if time_bucket else 0)
+        create_response = create_table.create_dynamoDB_table(table_name,partition_key_col_name,sort_key_col_name,time_bucket,
+                                                              plan['read_capacity'],plan['write_capacity'],plan['billing_mode'])
+        if create_response:
+            # An existing table keeps the time bucket index it was created with
+            time_bucket = time_buckets.granularity_from_table(aws_clients.describe_table(table_name))
+            if time_bucket:
+                time_buckets.check_sort_key(sort_key_col_name, timestamp_columns)
+            plan = capacity_planner.plan_capacity(csv_file_name, target_minutes, validation, 1 if time_bucket else 0)
+        io.console_output(capacity_planner.describe_plan(plan))
         if not create_response:
-            result = export_csv.prep_write(table, item_collection, partition_key_col_name, sort_key_col_name)
-            output = export_csv.validate(table, table_name, item_collection, partition_key_col_name, sort_key_col_name, result)
+            import_file(table_name, csv_file_name, column_names, output_column_names, partition_key_col_name, sort_key_col_name,
+                        validation, time_bucket, process_count, resume, typed, sync, delete, use_asyncio, timestamp_columns,
+                        column_types, worker_count or export_csv.DEFAULT_WORKER_COUNT)
             response = update_table.reduce_capacity(table_name)
             io.console_output("Database provisioned capacity update status: "+ response)
-            io.write_to_csv(output_column_names,output,"write_status.csv")
         elif create_response:
             io.console_output("The table name already exists. Do you want to:\n1) Continue writing to the table\n2) Quit Writing")
             user_choice = io.user_input("Your Selection (1/2): ")
             if user_choice == "1":
-                result = export_csv.prep_write(table, item_collection, partition_key_col_name,sort_key_col_name)
-                output = export_csv.validate(table, table_name, item_collection, partition_key_col_name, sort_key_col_name, result)
-                update_table.reduce_capacity(table_name)
-                io.write_to_csv(output_column_names,output,"write_status.csv")
+                response = update_table.scale_capacity(table_name, plan['read_capacity'], plan['write_capacity'], plan['billing_mode'])
+                io.console_output("Database provisioned capacity update status: "+ response)
+                import_file(table_name, csv_file_name, column_names, output_column_names, partition_key_col_name, sort_key_col_name,
+                            validation, time_bucket, process_count, resume, typed, sync, delete, use_asyncio,
+                            timestamp_columns, column_types, worker_count or export_csv.DEFAULT_WORKER_COUNT)
+                response = update_table.reduce_capacity(table_name)
+                io.console_output("Database provisioned capacity update status: "+ response)
             elif user_choice == "2":
                 io.console_output("Back to menu")
     except Exception as e:
@@ -68,13 +192,11 @@ def read(dynamodb_resource):
         sort_key_col_name: This is the name of the sort key (range key)
     """
     try:
-        client = boto3.client('dynamodb')
         table_name = io.user_input("Please enter the table name: ")
         table = dynamodb_resource.Table(table_name)
-        response = client.describe_table(
-        TableName=table_name
-        )
+        response = {'Table': aws_clients.describe_table(table_name)}
         key_schemas = response['Table']['KeySchema']
+        time_bucket = time_buckets.granularity_from_table(response['Table'])
         for each_key in key_schemas:
             if each_key['KeyType'] == 'HASH':
                 partition_key_col_name = each_key['AttributeName']
@@ -83,39 +205,82 @@ def read(dynamodb_resource):
         
         io.console_output("Please select one of the option: \n1) Search based on unique id\n2) Search based on a time range (eg: 16/4/19 2:22)\n3) quit program")
         user_choice = io.user_input("Your Selection (1/2/3): ")
+        metrics.registry.reset()
+        if user_choice in ("1", "2"):
+            compression = io.user_input("Compress the export (none/gzip/zstd): ").lower()
+            output_file_name = io.export_file_name(table_name, compression)
         if user_choice == "1":
             unique_id = io.user_input("Please enter the unique id: ")
-            import_csv.query_table(table_name,table,partition_key_col_name, unique_id)
+            page_size = io.user_input("Items read per request, smaller pages show the first rows sooner (blank for up to 1 MB): ")
+            page_size = int(page_size) if page_size.isdigit() and int(page_size) > 0 else None
+            import_csv.query_table(table_name,table,partition_key_col_name, unique_id, page_size, output_file_name=output_file_name)
         elif user_choice == "2":
             low_value = io.user_input("Please enter the low range value: ")
             high_value = io.user_input("Please enter the high range value: ")
             try:
                 low_time_value = datetime.strptime(low_value, "%d/%m/%y %H:%M").isoformat()
                 high_time_value = datetime.strptime(high_value, "%d/%m/%y %H:%M").isoformat()
-                import_csv.scan_table(table_name,table,sort_key_col_name,low_time_value,high_time_value)
             except Exception:
-                import_csv.scan_table(table_name,table,sort_key_col_name,low_value,high_value)
+                low_time_value = None
+            if low_time_value and time_bucket and io.user_input("Use the asyncio engine? (y/n): ").lower() == "y":
+                async_engine.run(async_engine.query_time_range(table_name, sort_key_col_name, low_time_value, high_time_value,
+                                                               time_bucket, output_file_name=output_file_name))
+            elif low_time_value and time_bucket:
+                import_csv.query_time_range(table_name,table,sort_key_col_name,low_time_value,high_time_value,time_bucket,
+                                            output_file_name=output_file_name)
+            elif low_time_value:
+                import_csv.scan_table(table_name,table,sort_key_col_name,low_time_value,high_time_value,
+                                      output_file_name=output_file_name)
+            else:
+                import_csv.scan_table(table_name,table,sort_key_col_name,low_value,high_value,output_file_name=output_file_name)
+        if user_choice in ("1", "2"):
+            report_metrics()
     except Exception as e:
         io.console_output("The program had to terminate because of the following error in read function: "+str(e))
         exit(1)
 
 
-def main():
+def run_batch(arguments):
+    """
+    Imports the files listed in the manifest without asking any question, and exits with 1 when an import failed
+
+    Args:
+        arguments: The command line arguments parsed by main
+    """
+    try:
+        summary_rows = batch_import.run_batch(arguments.manifest, arguments.jobs, arguments.workers,
+                                              arguments.write_capacity, arguments.resume, arguments.summary)
+        report_metrics()
+    except Exception as e:
+        io.console_output("The program had to terminate because of the following error in run_batch: "+str(e))
+        exit(1)
+    exit(1 if any(summary_row['Success/Failure'] != "Success" for summary_row in summary_rows) else 0)
+
+def main(argv=None):
     """
     This is the entry point into the program. It initialises the required variables and passes them to the functions as required. Depending
-    on the user input, the appropriate functions are invoked.
+    on the user input, the appropriate functions are invoked. Given a manifest, the files it lists are imported in batch
+    mode instead.
     """
+    parser = argparse.ArgumentParser(description="Imports CSV files into DynamoDB and exports DynamoDB tables to CSV")
+    parser.add_argument('--manifest', help="CSV file listing the files to import, see batch_import.py")
+    parser.add_argument('--jobs', type=int, default=batch_import.DEFAULT_JOB_COUNT, help="number of files imported at the same time")
+    parser.add_argument('--workers', type=int, help="number of writer threads, shared by the imports running at the same time with a manifest")
+    parser.add_argument('--write-capacity', type=float, help="write capacity units per second shared by the tables")
+    parser.add_argument('--resume', action='store_true', help="resume the interrupted imports")
+    parser.add_argument('--summary', default=batch_import.SUMMARY_FILE_NAME, help="file receiving the outcome of every import")
+    arguments = parser.parse_args(argv)
+    if arguments.manifest:
+        run_batch(arguments)
     try:
-        session = boto3.Session()
-        region = session.region_name
-        dynamodb_resource = boto3.resource('dynamodb', region_name=region)
+        dynamodb_resource = aws_clients.resource(import_csv.DEFAULT_SEGMENTS)
         
         while(1):
             io.console_output("Please select one of the options:\n1) Write to DyanamoDB Table\n2) Read from DynamoDB Table\n3) quit")
             user_choice = io.user_input("Selection an option (1/2/3): ")
             if user_choice == "1":
 
-                write(dynamodb_resource)
+                write(dynamodb_resource, arguments.workers)
             elif user_choice == "2":
                 io.console_output(read(dynamodb_resource))
             elif user_choice == "3":
@@ -0,0 +1,261 @@
+"""
+This module collects the measurements of an import or export, so a slow run can be traced to the stage holding it back:
+reading and parsing the CSV file, serializing the requests, waiting for the rate limiter, the DynamoDB calls themselves
+or throttling. Every stage records its time and rows, the DynamoDB calls record their latency in histograms, and the
+retries, throttles and consumed capacity are counted. The measurements are written to a JSON run report and to a file
+in the Prometheus text format, which can be picked up by the node exporter's textfile collector.
+Setting the CSVTODYNAMODB_PROFILE environment variable to a file name also profiles the import loop and its worker
+threads with cProfile.
+"""
+
+import cProfile
+import json
+import os
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+JSON_REPORT_FILE_NAME = 'run_metrics.json'
+PROMETHEUS_FILE_NAME = 'run_metrics.prom'
+METRIC_PREFIX = 'csvtodynamodb_'
+PROFILE_VARIABLE = 'CSVTODYNAMODB_PROFILE'
+# The profilers of the worker threads while profiled is active, None otherwise
+_thread_profilers = None
+_profilers_lock = threading.Lock()
+
+class Metrics:
+    """
+    Thread safe collection of the stage timings, counters and latency histograms of a run
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started = time.time()
+            self._start_time = time.perf_counter()
+            self.stages = {}
+            self.counters = {}
+            self.histograms = {}
+
+    def add_stage(self, name, seconds, rows=0):
+        """
+        Adds time spent in a stage and the rows it processed. Stages run by several threads add up the time of every
+        thread.
+
+        Args:
+            name: The name of the stage, eg: read
+            seconds: The time spent in the stage
+            rows: The number of rows processed in that time
+        """
+        with self._lock:
+            stage = self.stages.setdefault(name, {'seconds': 0.0, 'rows': 0, 'calls': 0})
+            stage['seconds'] += seconds
+            stage['rows'] += rows
+            stage['calls'] += 1
+
+    @contextmanager
+    def stage(self, name, rows=0):
+        """
+        Times the body of a with statement as a stage. The rows can also be set on the yielded dictionary once known.
+
+        Args:
+            name: The name of the stage
+            rows: The number of rows processed
+        """
+        counts = {'rows': rows}
+        start_time = time.perf_counter()
+        try:
+            yield counts
+        finally:
+            self.add_stage(name, time.perf_counter() - start_time, counts['rows'])
+
+    def increment(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, seconds):
+        """
+        Records a latency in a histogram
+
+        Args:
+            name: The name of the histogram, eg: batch_write_seconds
+            seconds: The latency
+        """
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = {'buckets': [0] * len(LATENCY_BUCKETS), 'count': 0, 'sum': 0.0}
+            for number, upper_bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= upper_bound:
+                    histogram['buckets'][number] += 1
+                    break
+            histogram['count'] += 1
+            histogram['sum'] += seconds
+
+    def snapshot(self):
+        """
+        Returns the measurements as a dictionary that can be written as JSON or merged into another Metrics
+        """
+        with self._lock:
+            stages = {}
+            for name, stage in self.stages.items():
+                stages[name] = dict(stage, rows_per_second=round(stage['rows'] / stage['seconds'], 1) if stage['seconds'] else 0)
+            return {
+                'started': self.started,
+                'seconds': time.perf_counter() - self._start_time,
+                'stages': stages,
+                'counters': dict(self.counters),
+                'histograms': {name: {'buckets': list(histogram['buckets']), 'count': histogram['count'], 'sum': histogram['sum']}
+                               for name, histogram in self.histograms.items()},
+            }
+
+    def merge(self, snapshot):
+        """
+        Adds the measurements of another process, eg: a shard imported by a pool process
+
+        Args:
+            snapshot: The dictionary returned by snapshot
+        """
+        with self._lock:
+            for name, other in snapshot['stages'].items():
+                stage = self.stages.setdefault(name, {'seconds': 0.0, 'rows': 0, 'calls': 0})
+                for field in ('seconds', 'rows', 'calls'):
+                    stage[field] += other[field]
+            for name, value in snapshot['counters'].items():
+                self.counters[name] = self.counters.get(name, 0) + value
+            for name, other in snapshot['histograms'].items():
+                histogram = self.histograms.setdefault(name, {'buckets': [0] * len(LATENCY_BUCKETS), 'count': 0, 'sum': 0.0})
+                histogram['buckets'] = [mine + theirs for mine, theirs in zip(histogram['buckets'], other['buckets'])]
+                histogram['count'] += other['count']
+                histogram['sum'] += other['sum']
+
+registry = Metrics()
+
+def prometheus_text(snapshot):
+    """
+    Returns the measurements in the Prometheus text exposition format
+
+    Args:
+        snapshot: The dictionary returned by Metrics.snapshot
+    """
+    lines = [
+        '# TYPE ' + METRIC_PREFIX + 'run_seconds gauge',
+        METRIC_PREFIX + 'run_seconds ' + repr(snapshot['seconds']),
+    ]
+    for field, metric_type in (('seconds', 'counter'), ('rows', 'counter'), ('rows_per_second', 'gauge')):
+        metric_name = METRIC_PREFIX + 'stage_' + field + ('_total' if metric_type == 'counter' else '')
+        lines.append('# TYPE ' + metric_name + ' ' + metric_type)
+        for name, stage in sorted(snapshot['stages'].items()):
+            lines.append(metric_name + '{stage="' + name + '"} ' + repr(stage[field]))
+    for name, value in sorted(snapshot['counters'].items()):
+        lines.append('# TYPE ' + METRIC_PREFIX + name + '_total counter')
+        lines.append(METRIC_PREFIX + name + '_total ' + repr(value))
+    for name, histogram in sorted(snapshot['histograms'].items()):
+        metric_name = METRIC_PREFIX + name
+        lines.append('# TYPE ' + metric_name + ' histogram')
+        cumulative = 0
+        for upper_bound, count in zip(LATENCY_BUCKETS, histogram['buckets']):
+            cumulative += count
+            lines.append(metric_name + '_bucket{le="' + str(upper_bound) + '"} ' + str(cumulative))
+        lines.append(metric_name + '_bucket{le="+Inf"} ' + str(histogram['count']))
+        lines.append(metric_name + '_sum ' + repr(histogram['sum']))
+        lines.append(metric_name + '_count ' + str(histogram['count']))
+    return "\n".join(lines) + "\n"
+
+def describe(snapshot):
+    """
+    Returns a short description of the time spent in every stage to show to the user
+
+    Args:
+        snapshot: The dictionary returned by Metrics.snapshot
+    """
+    lines = []
+    for name, stage in snapshot['stages'].items():
+        lines.append(name + ": " + str(stage['rows']) + " rows in " + str(round(stage['seconds'], 2)) + "s ("
+                     + str(stage['rows_per_second']) + " rows/s)")
+    counters = snapshot['counters']
+    lines.append("retries: " + str(counters.get('write_retries', 0) + counters.get('read_retries', 0)) + ", throttles: "
+                 + str(counters.get('write_throttles', 0) + counters.get('read_throttles', 0)) + ", consumed capacity: "
+                 + str(round(counters.get('consumed_write_capacity', 0), 1)) + " write / "
+                 + str(round(counters.get('consumed_read_capacity', 0), 1)) + " read units")
+    return "\n".join(lines)
+
+def write_reports(json_file_name=JSON_REPORT_FILE_NAME, prometheus_file_name=PROMETHEUS_FILE_NAME):
+    """
+    Writes the measurements of the run to the JSON report and the Prometheus text file and returns the snapshot
+
+    Args:
+        json_file_name: The name of the JSON run report
+        prometheus_file_name: The name of the Prometheus text file
+    """
+    snapshot = registry.snapshot()
+    with open(json_file_name, 'w') as json_file:
+        json.dump(snapshot, json_file, indent=2)
+    # The file is renamed into place so a collector never reads it half written
+    with open(prometheus_file_name + '.tmp', 'w') as prometheus_file:
+        prometheus_file.write(prometheus_text(snapshot))
+    os.replace(prometheus_file_name + '.tmp', prometheus_file_name)
+    return snapshot
+
+@contextmanager
+def profiled():
+    """
+    Profiles the body of a with statement with cProfile when the CSVTODYNAMODB_PROFILE environment variable is set.
+    cProfile only follows the thread enabling it, so the worker threads started meanwhile profile themselves through
+    thread_profiled and their statistics are merged in. The statistics are written to the file the variable names
+    followed by the process id, so every process of a sharded import writes its own file. They can be read with
+    python -m pstats.
+    """
+    global _thread_profilers
+    profile_file_name = os.environ.get(PROFILE_VARIABLE)
+    with _profilers_lock:
+        nested = _thread_profilers is not None
+        if profile_file_name and not nested:
+            _thread_profilers = []
+    if not profile_file_name or nested:
+        # A loop run inside a profiled one, like the jobs of a batch import, is merged into the outer profile
+        with thread_profiled():
+            yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        with _profilers_lock:
+            thread_profilers, _thread_profilers = _thread_profilers, None
+        stats = pstats.Stats(profiler)
+        for thread_profiler in thread_profilers:
+            stats.add(thread_profiler)
+        stats.dump_stats(profile_file_name + "." + str(os.getpid()))
+
+@contextmanager
+def thread_profiled():
+    """
+    Profiles the body of a with statement run by a worker thread while profiled is active, adding the statistics to
+    those written by profiled
+    """
+    with _profilers_lock:
+        thread_profilers = _thread_profilers
+    if thread_profilers is None:
+        yield
+        return
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # From Python 3.12 cProfile already follows every thread and a second profiler cannot be enabled
+        yield
+        return
+    try:
+        yield
+    finally:
+        profiler.disable()
+        with _profilers_lock:
+            thread_profilers.append(profiler)
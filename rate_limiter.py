@@ -0,0 +1,174 @@
+"""
+This module keeps the writer threads within the provisioned write capacity of the table. All the threads share one
+token bucket that is refilled at the provisioned write units per second. The bucket learns the real cost of an item
+from the consumed capacity reported by DynamoDB, slows down when requests are throttled and makes every thread wait
+out the same jittered exponential backoff, so the threads do not retry in a storm.
+"""
+
+import asyncio
+import random
+import threading
+import time
+import aws_clients
+
+BURST_SECONDS = 1
+MIN_RATE_FRACTION = 0.1
+DECREASE_FACTOR = 0.7
+INCREASE_FRACTION = 0.05
+BASE_BACKOFF = 0.05
+MAX_BACKOFF = 10
+THROTTLE_ERRORS = ('ProvisionedThroughputExceededException', 'ThrottlingException', 'RequestLimitExceeded')
+
+class RateLimiter:
+    """
+    Token bucket shared by the writer threads
+
+    Args:
+        units_per_second: The provisioned write capacity of the table, None when the table has no provisioned capacity
+    """
+    def __init__(self, units_per_second):
+        self.max_rate = units_per_second
+        self.rate = units_per_second
+        self.tokens = units_per_second * BURST_SECONDS if units_per_second else 0
+        self.units_per_item = 1.0
+        self.paused_until = 0
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, item_count):
+        """
+        Blocks until there is enough capacity to write item_count items and returns the number of units taken,
+        which has to be passed back to record once the response arrives
+
+        Args:
+            item_count: The number of items about to be written
+        """
+        while True:
+            units, wait = self.try_acquire(item_count)
+            if wait is None:
+                return units
+            time.sleep(wait)
+
+    async def acquire_async(self, item_count):
+        """
+        The same as acquire for the coroutines of async_engine, waiting without blocking the event loop
+
+        Args:
+            item_count: The number of items about to be written
+        """
+        while True:
+            units, wait = self.try_acquire(item_count)
+            if wait is None:
+                return units
+            await asyncio.sleep(wait)
+
+    def try_acquire(self, item_count):
+        """
+        Takes the capacity to write item_count items if it is available. It returns the units taken and None, or the
+        number of seconds to wait before trying again.
+
+        Args:
+            item_count: The number of items about to be written
+        """
+        with self._lock:
+            units = item_count * self.units_per_item
+            now = time.monotonic()
+            if now < self.paused_until:
+                return units, self.paused_until - now
+            if not self.rate:
+                return units, None
+            self._refill(now)
+            needed = min(units, self.rate * BURST_SECONDS)
+            if self.tokens >= needed:
+                self.tokens -= units
+                return units, None
+            return units, (needed - self.tokens) / self.rate
+
+    def record(self, units_taken, consumed_units, item_count):
+        """
+        Reconciles the units taken by acquire with the capacity DynamoDB reports as consumed, and lets the rate
+        creep back up towards the provisioned capacity after a successful request
+
+        Args:
+            units_taken: The value returned by acquire
+            consumed_units: The consumed capacity reported by DynamoDB, None if it was not returned
+            item_count: The number of items that were written
+        """
+        with self._lock:
+            if consumed_units is not None and item_count:
+                self.tokens -= consumed_units - units_taken
+                self.units_per_item = max(1.0, 0.8 * self.units_per_item + 0.2 * consumed_units / item_count)
+            if self.rate:
+                self.rate = min(self.max_rate, self.rate + self.max_rate * INCREASE_FRACTION)
+
+    def throttled(self, attempt):
+        """
+        Called when DynamoDB throttles a request or leaves items unprocessed. The rate is cut and all the threads
+        pause for a jittered exponential backoff before sending their next request.
+
+        Args:
+            attempt: The number of retries already made for the batch
+        """
+        delay = random.uniform(0, min(MAX_BACKOFF, BASE_BACKOFF * (2 ** attempt)))
+        with self._lock:
+            if self.rate:
+                self.rate = max(self.max_rate * MIN_RATE_FRACTION, self.rate * DECREASE_FACTOR)
+                self.tokens = min(self.tokens, 0)
+            self.paused_until = max(self.paused_until, time.monotonic() + delay)
+
+    def set_capacity(self, units_per_second):
+        """
+        Changes the write capacity the limiter keeps to, eg: when a capacity budget shared between tables is
+        rebalanced. The rate never jumps up, it creeps up to the new capacity as requests succeed.
+
+        Args:
+            units_per_second: The new write capacity, None to only coordinate the backoff
+        """
+        with self._lock:
+            if self.rate and units_per_second:
+                self.rate = min(self.rate, units_per_second)
+            else:
+                self.rate = units_per_second
+                self.tokens = 0
+                self._updated = time.monotonic()
+            self.max_rate = units_per_second
+            if units_per_second:
+                self.tokens = min(self.tokens, units_per_second * BURST_SECONDS)
+
+    def _refill(self, now):
+        self.tokens = min(self.rate * BURST_SECONDS, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+def from_table(table, fraction=1):
+    """
+    Creates a rate limiter sized from the provisioned write capacity of the table. Tables using on-demand billing get
+    a limiter that only coordinates the backoff.
+
+    Args:
+        table: This is the boto3 DynamoDB resource which refers to the table
+        fraction: The share of the write capacity given to this limiter, when several processes write to the same table
+    """
+    table_description = aws_clients.describe_table(table.name, region_name=table.meta.client.meta.region_name)
+    billing_mode = table_description.get('BillingModeSummary', {}).get('BillingMode')
+    write_capacity = table_description.get('ProvisionedThroughput', {}).get('WriteCapacityUnits')
+    if billing_mode == 'PAY_PER_REQUEST' or not write_capacity:
+        return RateLimiter(None)
+    return RateLimiter(write_capacity * fraction)
+
+def consumed_units(response):
+    """
+    Adds up the capacity units reported by a response that was requested with ReturnConsumedCapacity. With INDEXES,
+    only the units consumed by the tables themselves are counted, since every global secondary index has its own
+    capacity and a limiter sized from the table's capacity would otherwise let through a fraction of it.
+
+    Args:
+        response: The response of a DynamoDB request
+    """
+    if 'ConsumedCapacity' not in response:
+        return None
+    consumed_capacity = response['ConsumedCapacity']
+    # Batch requests report a list with one entry per table, single table requests a single entry
+    if isinstance(consumed_capacity, dict):
+        consumed_capacity = [consumed_capacity]
+    return sum(each['Table']['CapacityUnits'] if 'Table' in each else each.get('CapacityUnits', 0)
+               for each in consumed_capacity)
@@ -0,0 +1,271 @@
+"""
+This module imports a very large CSV file using several processes, so that parsing the rows and serializing the requests
+is not limited to the one core a single Python process can use. The file is split into byte ranges aligned to the
+beginning of a line, and every process reads its own range, writes it to DynamoDB with its own boto3 session and records
+the status of its rows in a part file. The part files are merged into write_status.csv once every process is done.
+The progress of every shard is recorded in the import journal, so an interrupted import can be resumed.
+Please note that a quoted value spanning several lines can not be split correctly, such files should be imported
+with a single process.
+"""
+
+import aws_clients
+import csv
+import multiprocessing
+import os
+import shutil
+import sys
+import export_csv
+import item_schema
+import journal
+import metrics
+import rate_limiter
+import time_buckets
+import timestamps
+import input_output as io
+
+
+def plan_shards(csv_file_name, shard_count):
+    """
+    Splits the rows of the CSV file into shard_count byte ranges. Every range starts at the beginning of a line, so no
+    row is cut in two. Compressed files and rotated exports can not be split, they are read in a single range.
+
+    Args:
+        csv_file_name: The name of the CSV file
+        shard_count: The number of ranges to split the file into
+    """
+    if io.compression_of(csv_file_name) or len(io.part_file_names(csv_file_name)) > 1:
+        with io.open_binary(csv_file_name) as csv_file:
+            # The size of the decompressed content is not known, the range ends wherever the file does
+            return [(len(csv_file.readline()), sys.maxsize)]
+    file_size = os.path.getsize(csv_file_name)
+    with open(csv_file_name, 'rb') as csv_file:
+        csv_file.readline()
+        data_start = csv_file.tell()
+        boundaries = [data_start]
+        for shard in range(1, shard_count):
+            csv_file.seek(data_start + (file_size - data_start) * shard // shard_count - 1)
+            csv_file.readline()
+            boundaries.append(max(csv_file.tell(), boundaries[-1]))
+    boundaries.append(file_size)
+    return [(boundaries[shard], boundaries[shard + 1]) for shard in range(shard_count) if boundaries[shard] < boundaries[shard + 1]]
+
+def import_shard(job, limiter=None):
+    """
+    Imports one byte range of the CSV file, committing its progress to the import journal. This function runs in a pool
+    process, so it creates its own boto3 clients and rate limiter, the limiter getting an equal share of the write
+    capacity of the table. With a schema, the items are written with the typed fast write path of item_schema.
+    It returns the summary returned by export_csv.import_items, with the metrics of the shard.
+
+    Args:
+        job: The dictionary describing the shard, built by import_sharded
+        limiter: The rate_limiter.RateLimiter to use instead of a new one, when the shard is imported in this process
+    """
+    if job['process_count'] > 1:
+        # A pool process can import several shards, the metrics of each are sent back separately
+        metrics.registry.reset()
+    # The writes and the validation retry the throttled requests with the rate limiter, not within botocore
+    table = aws_clients.table(job['table_name'], job['worker_count'], job['region'], retries=False)
+    if limiter is None:
+        limiter = rate_limiter.from_table(table, 1 / job['process_count'])
+    serializer = None
+    client = None
+    if job['schema']:
+        serializer = item_schema.ItemSerializer(job['schema'])
+        client = aws_clients.client(job['worker_count'], job['region'], retries=False)
+    item_chunks = export_csv.read_item_chunks(job['csv_file_name'], job['column_names'], export_csv.CHUNK_SIZE,
+                                              job['timestamp_columns'], job['start'], job['end'])
+    if job['time_bucket']:
+        item_chunks = time_buckets.add_time_bucket(item_chunks, job['sort_key_col_name'], job['time_bucket'])
+    with journal.ImportJournal(job['journal_file_name']) as import_journal:
+        summary = export_csv.import_items(table, job['table_name'], item_chunks, job['output_column_names'],
+                                          job['partition_key_col_name'], job['sort_key_col_name'], job['worker_count'],
+                                          job['validation'], job['status_file_name'], limiter, import_journal,
+                                          job['shard_start'], serializer, client)
+    summary['metrics'] = metrics.registry.snapshot()
+    return summary
+
+def run_shard(job):
+    """
+    Runs import_shard in a pool process. The import functions call exit on fatal errors, which would end the pool
+    process without a result and leave pool.map waiting for it forever, so every error is returned as the shard's error
+    instead.
+
+    Args:
+        job: The dictionary describing the shard, built by import_sharded
+    """
+    try:
+        return import_shard(job)
+    except BaseException as e:
+        if isinstance(e, Exception):
+            error = str(e)
+        else:
+            error = "The import of the shard was stopped, see the console output"
+        return {'error': "shard starting at byte " + str(job['shard_start']) + ": " + error}
+
+def import_sharded(table_name, csv_file_name, column_names, output_column_names, partition_key_col_name, sort_key_col_name,
+                   process_count=None, worker_count=export_csv.DEFAULT_WORKER_COUNT, validation=True, time_bucket=None,
+                   timestamp_columns=timestamps.DEFAULT_TIMESTAMP_COLUMNS, status_file_name="write_status.csv", resume=False,
+                   schema=None, limiter=None):
+    """
+    Imports the CSV file with a pool of process_count processes, each running worker_count writer threads, and merges
+    the status of every shard into one status file in the order of the rows. A file imported by a single process is
+    imported in this process.
+    With resume, the shards and offsets recorded in the journal of an interrupted import are used, so only the rows
+    that were not committed are written. The journal is deleted once the import has finished.
+    It returns the number of rows processed and the number of rows that failed.
+
+    Args:
+        table_name: name of the table in DynamoDB
+        csv_file_name: The name of the CSV file
+        column_names: This is the list of the headers in the csv
+        output_column_names: This is the list of the headers in the status csv
+        partition_key_col_name: This is the name of the primary key (hash key)
+        sort_key_col_name: This is the name of the sort key (range key)
+        process_count: The number of processes, one per core when not given
+        worker_count: The number of threads writing to DynamoDB in every process
+        validation: Whether the items are read back from DynamoDB to validate the import
+        time_bucket: The granularity of the time bucket index of the table, hour or day
+        timestamp_columns: The names of the columns converted to ISO formatted timestamps
+        status_file_name: The name of the csv file receiving the status of every row
+        resume: Whether an interrupted import recorded in the journal is resumed
+        schema: The column types returned by item_schema.infer_schema, the values are stored as strings when not given
+        limiter: The rate_limiter.RateLimiter shared with other imports, only used when the file is imported in this process
+    """
+    journal_file_name, plan, part_file_names = prepare_journal(table_name, csv_file_name, status_file_name, resume,
+                                                               process_count or os.cpu_count())
+    region = aws_clients.session().region_name
+    jobs = []
+    for shard, part_file_name in zip(plan, part_file_names):
+        if shard['offset'] >= shard['end']:
+            continue
+        jobs.append({
+            'region': region,
+            'table_name': table_name,
+            'csv_file_name': csv_file_name,
+            'column_names': column_names,
+            'output_column_names': output_column_names,
+            'partition_key_col_name': partition_key_col_name,
+            'sort_key_col_name': sort_key_col_name,
+            'timestamp_columns': timestamp_columns,
+            'time_bucket': time_bucket,
+            'worker_count': worker_count,
+            'validation': validation,
+            'schema': schema,
+            'shard_start': shard['start'],
+            'start': shard['offset'],
+            'end': shard['end'],
+            'journal_file_name': journal_file_name,
+            'status_file_name': part_file_name,
+        })
+    for job in jobs:
+        job['process_count'] = len(jobs)
+    if len(jobs) > 1:
+        io.console_output("Importing " + csv_file_name + " with " + str(len(jobs)) + " processes")
+        # Processes are spawned rather than forked, so they do not inherit the threads and connections of this process
+        with multiprocessing.get_context('spawn').Pool(len(jobs)) as pool:
+            results = pool.map(run_shard, jobs)
+        errors = [result['error'] for result in results if 'error' in result]
+        for result in results:
+            if 'metrics' in result:
+                metrics.registry.merge(result['metrics'])
+        if errors:
+            # The journal and the status part files are kept, so the import can be resumed
+            raise Exception("The import of " + csv_file_name + " failed in " + str(len(errors)) + " processes: " + ",".join(errors))
+    else:
+        results = [import_shard(job, limiter) for job in jobs]
+    if len(plan) > 1:
+        merge_status_files(part_file_names, status_file_name)
+    journal.remove_journal(journal_file_name)
+    summary = {'rows': sum(result['rows'] for result in results), 'failed': sum(result['failed'] for result in results),
+               'status_file': status_file_name}
+    if len(jobs) > 1:
+        # A single shard was reported by export_csv.import_items already
+        io.console_output('Finished import, ' + str(summary['rows']) + ' rows written to ' + status_file_name)
+    return summary
+
+def prepare_journal(table_name, csv_file_name, status_file_name, resume, shard_count):
+    """
+    Reads the journal of the interrupted import when it is resumed, and cuts the status files of its shards back to
+    their last commit. Otherwise a new journal is started with the file split into shard_count shards, and the status
+    files of an earlier import are removed, as the status rows are appended to them.
+    It returns the name of the journal, the shards of the plan and the names of their status files.
+
+    Args:
+        table_name: name of the table in DynamoDB
+        csv_file_name: The name of the CSV file
+        status_file_name: The name of the csv file receiving the status of every row
+        resume: Whether an interrupted import recorded in the journal is resumed
+        shard_count: The number of shards of a new plan
+    """
+    journal_file_name = journal.journal_name(csv_file_name, table_name)
+    plan = journal.read_journal(journal_file_name, csv_file_name) if resume else None
+    resumed = plan is not None
+    if not resumed:
+        plan = journal.start_journal(journal_file_name, csv_file_name, plan_shards(csv_file_name, shard_count))
+    part_file_names = status_part_names(status_file_name, len(plan))
+    if resumed:
+        for shard, part_file_name in zip(plan, part_file_names):
+            journal.restore_status(shard, part_file_name)
+    else:
+        for file_name in set(part_file_names + [status_file_name]):
+            if os.path.exists(file_name):
+                os.remove(file_name)
+    return journal_file_name, plan, part_file_names
+
+def status_part_names(status_file_name, shard_count):
+    """
+    Returns the names of the status files the shards of a plan write to, the status file itself for a single shard
+
+    Args:
+        status_file_name: The name of the csv file receiving the status of every row
+        shard_count: The number of shards in the plan
+    """
+    if shard_count > 1:
+        return [status_file_name + ".part-" + str(number) for number in range(shard_count)]
+    return [status_file_name]
+
+def merge_status_files(part_file_names, status_file_name):
+    """
+    Concatenates the status part files written by the processes into one file with a single header, deleting the parts
+
+    Args:
+        part_file_names: The names of the part files in the order of the rows
+        status_file_name: The name of the merged status file
+    """
+    if io.compression_of(status_file_name):
+        merge_compressed_status_files(part_file_names, status_file_name)
+        return
+    with open(status_file_name, 'wb') as status_file:
+        header_written = False
+        for part_file_name in part_file_names:
+            if not os.path.exists(part_file_name):
+                continue
+            with open(part_file_name, 'rb') as part_file:
+                header = part_file.readline()
+                if not header_written:
+                    status_file.write(header)
+                    header_written = True
+                shutil.copyfileobj(part_file, status_file)
+            os.remove(part_file_name)
+
+def merge_compressed_status_files(part_file_names, status_file_name):
+    """
+    Merges compressed status part files like merge_status_files, decompressing the rows of every part into the
+    compressed status file
+
+    Args:
+        part_file_names: The names of the part files in the order of the rows
+        status_file_name: The name of the merged status file
+    """
+    status_writer = None
+    for part_file_name in part_file_names:
+        if not os.path.exists(part_file_name):
+            continue
+        with io.open_text(part_file_name) as part_file:
+            reader = csv.DictReader(part_file)
+            if status_writer is None:
+                status_writer = io.StreamingCsvWriter(reader.fieldnames, status_file_name)
+            status_writer.writerows(reader)
+        os.remove(part_file_name)
+    if status_writer is not None:
+        status_writer.close()
@@ -0,0 +1,331 @@
+"""
+This module imports a CSV snapshot incrementally, writing only the rows that are new or have changed since the previous
+import instead of paying for every row again. A local index, kept in a SQLite file next to the program, maps the key of
+every item in the table to a hash of its content. The hash is also stored on the item in the RowHash attribute, so the
+index can be rebuilt with a parallel scan that only reads back the keys and hashes.
+Rows of the file that repeat the key of an earlier row are reported in duplicate_keys.csv and not written, and the items
+whose rows are no longer in the file can optionally be deleted. The index is only updated for rows that were written
+successfully, so an interrupted sync is simply run again.
+"""
+
+import aws_clients
+import csv
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import export_csv
+import item_schema
+import rate_limiter
+import time_buckets
+import timestamps
+import input_output as io
+from worker_pool import run_workers, iter_queue
+
+HASH_ATTRIBUTE = 'RowHash'
+DUPLICATES_FILE_NAME = 'duplicate_keys.csv'
+DEFAULT_SEGMENTS = 4
+
+def index_name(table_name):
+    """
+    Returns the name of the key index file of the table
+
+    Args:
+        table_name: name of the table in DynamoDB
+    """
+    return table_name + ".sync-index.sqlite"
+
+def row_hash(item):
+    """
+    Returns a hash of the content of an item, the same for two rows with the same values whatever the column order
+
+    Args:
+        item: The item read from the CSV file
+    """
+    content = {name: value for name, value in item.items() if name != HASH_ATTRIBUTE}
+    return hashlib.blake2b(json.dumps(content, sort_keys=True, separators=(',', ':')).encode(export_csv.ENCODING),
+                           digest_size=16).hexdigest()
+
+class KeyIndex:
+    """
+    The on-disk index mapping the key of every item in the table to the hash of its content. During a sync, the new hash
+    of a changed row is kept as pending until the row has been written, and every key found in the file is marked with
+    the run, which finds the duplicate keys and the items that are no longer in the file.
+
+    Args:
+        index_file_name: The name of the SQLite file holding the index
+    """
+    def __init__(self, index_file_name):
+        self.index_file_name = index_file_name
+        self.run = time.time_ns()
+        # The rows are classified on the prefetch thread and committed on the main thread, never at the same time
+        self._connection = sqlite3.connect(index_file_name, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS keys (pk TEXT, sk TEXT, hash TEXT, pending TEXT, "
+                                 "seen INTEGER, PRIMARY KEY (pk, sk)) WITHOUT ROWID")
+        self._connection.commit()
+
+    def classify(self, key, content_hash):
+        """
+        Records that the key was found in the file with the given hash and returns whether the row is new or changed,
+        unchanged, or a duplicate of an earlier row of the file
+
+        Args:
+            key: The (partition key, sort key) of the row
+            content_hash: The hash of the row returned by row_hash
+        """
+        with self._lock:
+            found = self._connection.execute("SELECT hash, seen FROM keys WHERE pk = ? AND sk = ?", key).fetchone()
+            if found is not None and found[1] == self.run:
+                return 'duplicate'
+            if found is not None and found[0] == content_hash:
+                self._connection.execute("UPDATE keys SET seen = ? WHERE pk = ? AND sk = ?", (self.run,) + key)
+                return 'unchanged'
+            self._connection.execute("INSERT INTO keys (pk, sk, hash, pending, seen) VALUES (?, ?, NULL, ?, ?) "
+                                     "ON CONFLICT (pk, sk) DO UPDATE SET pending = excluded.pending, seen = excluded.seen",
+                                     key + (content_hash, self.run))
+            return 'changed'
+
+    def commit_pending(self, failed_keys):
+        """
+        Makes the pending hashes of the rows written in this run the current ones, except for the rows that failed, which
+        are then written again by the next sync
+
+        Args:
+            failed_keys: The keys of the rows that failed to be written
+        """
+        with self._lock:
+            self._connection.executemany("UPDATE keys SET pending = NULL WHERE pk = ? AND sk = ?", failed_keys)
+            self._connection.execute("UPDATE keys SET hash = pending, pending = NULL WHERE pending IS NOT NULL")
+            self._connection.commit()
+
+    def missing_keys(self):
+        """
+        Returns the keys of the items whose rows were not found in the file during this run
+        """
+        with self._lock:
+            return self._connection.execute("SELECT pk, sk FROM keys WHERE seen IS NOT ?", (self.run,)).fetchall()
+
+    def remove(self, keys):
+        with self._lock:
+            self._connection.executemany("DELETE FROM keys WHERE pk = ? AND sk = ?", keys)
+            self._connection.commit()
+
+    def load(self, entries):
+        """
+        Adds the keys and hashes read from the table to the index
+
+        Args:
+            entries: A list of (partition key, sort key, hash) tuples
+        """
+        with self._lock:
+            self._connection.executemany("INSERT OR REPLACE INTO keys (pk, sk, hash, pending, seen) VALUES (?, ?, ?, NULL, NULL)",
+                                         entries)
+
+    def clear(self):
+        with self._lock:
+            self._connection.execute("DELETE FROM keys")
+            self._connection.commit()
+
+    def close(self):
+        with self._lock:
+            self._connection.commit()
+            self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def rebuild_index(index, table, partition_key_col_name, sort_key_col_name, total_segments=DEFAULT_SEGMENTS, worker_count=None):
+    """
+    Replaces the content of the index with the keys and hashes of the items in the table, read with a parallel scan
+    that only returns the key attributes and the RowHash. Items written without a hash are indexed with an empty hash,
+    so they are written once more by the sync.
+    It returns the number of items indexed.
+
+    Args:
+        index: The KeyIndex to rebuild
+        table: This is the boto3 DynamoDB resource which refers to the table
+        partition_key_col_name: This is the name of the primary key (hash key)
+        sort_key_col_name: This is the name of the sort key (range key)
+        total_segments: The number of segments the scan is split into
+        worker_count: The number of threads scanning the segments, one per segment when not given
+    """
+    io.console_output("Rebuilding the key index of " + table.name + " from the table")
+    index.clear()
+    scan_kwargs = {
+        'ProjectionExpression': '#pk, #sk, #hash',
+        'ExpressionAttributeNames': {'#pk': partition_key_col_name, '#sk': sort_key_col_name, '#hash': HASH_ATTRIBUTE},
+    }
+    stats = run_workers(scan_keys, range(total_segments), worker_count or total_segments,
+                        args=(table, scan_kwargs, total_segments, index, partition_key_col_name, sort_key_col_name))
+    errors = [error for worker_stats in stats for error in worker_stats['errors']]
+    if errors:
+        raise Exception(",".join(errors))
+    index.commit_pending([])
+    return sum(worker_stats['items'] for worker_stats in stats)
+
+def scan_keys(table, scan_kwargs, total_segments, index, partition_key_col_name, sort_key_col_name, work_queue, thread_name):
+    """
+    Scans every segment taken off the work queue page by page and loads the keys and hashes of each page into the index
+
+    Args:
+        table: This is the boto3 DynamoDB resource which refers to the table
+        scan_kwargs: The projection of the scan
+        total_segments: The number of segments the scan is split into
+        index: The KeyIndex receiving the keys
+        partition_key_col_name: This is the name of the primary key (hash key)
+        sort_key_col_name: This is the name of the sort key (range key)
+        work_queue: The queue of segment numbers shared by the worker threads
+        thread_name: The name of the worker thread
+    """
+    stats = {'worker': thread_name, 'segments': 0, 'pages': 0, 'items': 0, 'errors': []}
+    for segment in iter_queue(work_queue):
+        request = dict(scan_kwargs, Segment=segment, TotalSegments=total_segments)
+        try:
+            while True:
+                response = table.scan(**request)
+                index.load([(str(item[partition_key_col_name]), str(item[sort_key_col_name]), item.get(HASH_ATTRIBUTE))
+                            for item in response['Items']])
+                stats['pages'] += 1
+                stats['items'] += len(response['Items'])
+                if 'LastEvaluatedKey' not in response:
+                    break
+                request['ExclusiveStartKey'] = response['LastEvaluatedKey']
+        except Exception as e:
+            stats['errors'].append("segment " + str(segment) + ": " + str(e))
+        stats['segments'] += 1
+    return stats
+
+def changed_chunks(item_chunks, index, partition_key_col_name, sort_key_col_name, duplicate_writer, counts):
+    """
+    Generator that keeps only the new and changed rows of every chunk, adding their hash to the item. The rows
+    repeating the key of an earlier row of the file are written to the duplicate writer instead.
+
+    Args:
+        item_chunks: The generator of CSV row chunks
+        index: The KeyIndex of the table
+        partition_key_col_name: This is the name of the primary key (hash key)
+        sort_key_col_name: This is the name of the sort key (range key)
+        duplicate_writer: The input_output.StreamingCsvWriter receiving the duplicate rows
+        counts: The dictionary counting the changed, unchanged and duplicate rows
+    """
+    for item_collection in item_chunks:
+        changed = export_csv.ItemChunk()
+        changed.end_offset = item_collection.end_offset
+        for item in item_collection:
+            content_hash = row_hash(item)
+            status = index.classify((item[partition_key_col_name], item[sort_key_col_name]), content_hash)
+            counts[status] += 1
+            if status == 'changed':
+                item[HASH_ATTRIBUTE] = content_hash
+                changed.append(item)
+            elif status == 'duplicate':
+                duplicate_writer.writerows([dict(item, **{
+                    'Success/Failure': "Failure",
+                    'Error Code': "1",
+                    'Error Description': "Duplicate key, an earlier row of the file has the same key and was kept",
+                })])
+        if changed:
+            yield changed
+
+def failed_keys_from_status(status_file_name, partition_key_col_name, sort_key_col_name):
+    """
+    Returns the keys of the rows reported as failures in the status file
+
+    Args:
+        status_file_name: The name of the status csv written by export_csv.import_items
+        partition_key_col_name: This is the name of the primary key (hash key)
+        sort_key_col_name: This is the name of the sort key (range key)
+    """
+    if not os.path.exists(status_file_name):
+        return []
+    with io.open_text(status_file_name) as status_file:
+        return [(row[partition_key_col_name], row[sort_key_col_name]) for row in csv.DictReader(status_file)
+                if row['Error Code'] != "0"]
+
+def delete_missing(table, index, limiter):
+    """
+    Deletes the items whose rows are no longer in the file and removes them from the index. The deletes wait for
+    capacity from the rate limiter like the writes.
+    It returns the number of items deleted.
+
+    Args:
+        table: This is the boto3 DynamoDB resource which refers to the table
+        index: The KeyIndex of the table, after the rows of the file have been classified
+        limiter: The rate_limiter.RateLimiter of the import
+    """
+    missing_keys = index.missing_keys()
+    key_names = [each['AttributeName'] for each in sorted(table.key_schema, key=lambda each: each['KeyType'])]
+    with table.batch_writer() as writer:
+        for batch_keys in export_csv.iter_batches(missing_keys):
+            limiter.acquire(len(batch_keys))
+            for key in batch_keys:
+                writer.delete_item(Key=dict(zip(key_names, key)))
+    index.remove(missing_keys)
+    return len(missing_keys)
+
+def sync_file(table_name, csv_file_name, column_names, output_column_names, partition_key_col_name, sort_key_col_name,
+              worker_count=export_csv.DEFAULT_WORKER_COUNT, validation=True, time_bucket=None,
+              timestamp_columns=timestamps.DEFAULT_TIMESTAMP_COLUMNS, status_file_name="write_status.csv",
+              delete=False, rebuild=False, schema=None):
+    """
+    Writes the rows of the CSV file that are new or have changed since the previous sync of the table, and with delete
+    removes the items whose rows are no longer in the file. The index is rebuilt from the table when it does not exist
+    yet or when asked to. The status file only lists the rows that were written.
+    The sync runs in a single process, since all the rows go through the one index.
+    It returns the summary returned by export_csv.import_items, with the counts of the sync.
+
+    Args:
+        table_name: name of the table in DynamoDB
+        csv_file_name: The name of the CSV file
+        column_names: This is the list of the headers in the csv
+        output_column_names: This is the list of the headers in the status csv
+        partition_key_col_name: This is the name of the primary key (hash key)
+        sort_key_col_name: This is the name of the sort key (range key)
+        worker_count: The number of threads writing to DynamoDB
+        validation: Whether the items are read back from DynamoDB to validate the import
+        time_bucket: The granularity of the time bucket index of the table, hour or day
+        timestamp_columns: The names of the columns converted to ISO formatted timestamps
+        status_file_name: The name of the csv file receiving the status of every row written
+        delete: Whether the items whose rows are no longer in the file are deleted
+        rebuild: Whether the index is rebuilt from the table even if it exists
+        schema: The column types returned by item_schema.infer_schema, the values are stored as strings when not given
+    """
+    table = aws_clients.table(table_name, worker_count)
+    limiter = rate_limiter.from_table(table)
+    serializer = None
+    client = None
+    if schema:
+        serializer = item_schema.ItemSerializer(dict(schema, **{HASH_ATTRIBUTE: 'S'}))
+        client = aws_clients.client(worker_count, retries=False)
+    index_file_name = index_name(table_name)
+    rebuild = rebuild or not os.path.exists(index_file_name)
+    with KeyIndex(index_file_name) as index:
+        if rebuild:
+            io.console_output("Indexed " + str(rebuild_index(index, table, partition_key_col_name, sort_key_col_name)) + " items")
+        item_chunks = export_csv.read_item_chunks(csv_file_name, column_names, export_csv.CHUNK_SIZE, timestamp_columns)
+        if time_bucket:
+            item_chunks = time_buckets.add_time_bucket(item_chunks, sort_key_col_name, time_bucket)
+        counts = {'changed': 0, 'unchanged': 0, 'duplicate': 0}
+        with io.StreamingCsvWriter(output_column_names, DUPLICATES_FILE_NAME) as duplicate_writer:
+            # The writes and the validation retry the throttled requests with the rate limiter, not within botocore
+            summary = export_csv.import_items(aws_clients.table(table_name, worker_count, retries=False), table_name,
+                                              changed_chunks(item_chunks, index, partition_key_col_name, sort_key_col_name,
+                                                             duplicate_writer, counts),
+                                              output_column_names, partition_key_col_name, sort_key_col_name, worker_count,
+                                              validation, status_file_name, limiter, serializer=serializer, client=client)
+        index.commit_pending(failed_keys_from_status(status_file_name, partition_key_col_name, sort_key_col_name))
+        summary.update(counts)
+        summary['deleted'] = delete_missing(table, index, limiter) if delete else 0
+    io.console_output("Sync finished: " + str(counts['changed']) + " rows new or changed, " + str(counts['unchanged'])
+                      + " unchanged, " + str(summary['deleted']) + " items deleted")
+    if counts['duplicate']:
+        io.console_output(str(counts['duplicate']) + " rows repeat the key of an earlier row, see " + DUPLICATES_FILE_NAME)
+    return summary
@@ -0,0 +1,28 @@
+import os
+import sys
+import pytest
+
+# The modules of the program are at the top of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import aws_clients
+import local_dynamodb
+
+@pytest.fixture
+def install_local(tmp_path, monkeypatch):
+    """
+    Returns a function installing a local_dynamodb.LocalDynamoDB with the given options, run in a temporary directory
+    """
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'test')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'test')
+    # Every test gets its own clients, so they all send their requests to the stand-in of the test
+    for cache_name in ('_sessions', '_clients', '_resources', '_descriptions'):
+        monkeypatch.setattr(aws_clients, cache_name, {})
+    monkeypatch.setattr(aws_clients, '_handlers', [])
+    monkeypatch.chdir(tmp_path)
+    def install(**options):
+        local = local_dynamodb.LocalDynamoDB(**options)
+        local.install()
+        return local
+    return install
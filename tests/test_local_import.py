@@ -0,0 +1,143 @@
+"""
+Imports generated CSV files with the sharded and asyncio engines against the in-memory stand-in of local_dynamodb,
+including imports interrupted part way and resumed from their journal.
+"""
+
+import csv
+import os
+import threading
+import pytest
+import async_engine
+import benchmark
+import create_table
+import export_csv
+import journal
+import local_dynamodb
+import metrics
+import sharded_import
+import input_output as io
+
+ROWS = 1200
+TABLE_NAME = 'devices'
+
+class Crash(BaseException):
+    """
+    Stops an import the way a killed process would, without being caught by the import
+    """
+
+@pytest.fixture
+def local(install_local, monkeypatch):
+    monkeypatch.setattr(export_csv, 'CHUNK_SIZE', 100)
+    local = install_local(throttle_rate=0.05, unprocessed_rate=0.05, seed=1)
+    create_table.create_dynamoDB_table(TABLE_NAME, benchmark.PARTITION_KEY, benchmark.SORT_KEY, billing_mode='PAY_PER_REQUEST')
+    metrics.registry.reset()
+    return local
+
+@pytest.fixture
+def csv_file(local):
+    benchmark.generate_csv('devices.csv', ROWS)
+    column_names, item_chunks, output_column_names = export_csv.read_csv('devices.csv')
+    item_chunks.close()
+    return 'devices.csv', column_names, output_column_names
+
+def read_status(status_file_name):
+    with io.open_text(status_file_name) as status_file:
+        return list(csv.DictReader(status_file))
+
+def import_sharded(csv_file, status_file_name="write_status.csv", resume=False):
+    csv_file_name, column_names, output_column_names = csv_file
+    return sharded_import.import_sharded(TABLE_NAME, csv_file_name, column_names, output_column_names,
+                                         benchmark.PARTITION_KEY, benchmark.SORT_KEY, 1, validation=False,
+                                         status_file_name=status_file_name, resume=resume)
+
+def crash_on_write(monkeypatch, call_number):
+    """
+    Makes the import stop when it writes its call_number-th chunk, and returns the function writing the chunks
+    """
+    prep_write = export_csv.prep_write
+    calls = []
+    def crashing_prep_write(*args, **kwargs):
+        calls.append(1)
+        if len(calls) == call_number:
+            raise Crash()
+        return prep_write(*args, **kwargs)
+    monkeypatch.setattr(export_csv, 'prep_write', crashing_prep_write)
+    return prep_write
+
+def assert_imported(local, status_rows):
+    assert len(status_rows) == ROWS
+    assert len({(row[benchmark.PARTITION_KEY], row[benchmark.SORT_KEY]) for row in status_rows}) == ROWS
+    assert all(row['Success/Failure'] == "Success" for row in status_rows)
+    assert local.tables[TABLE_NAME].item_count == ROWS
+
+def assert_throttles_counted(local):
+    counters = metrics.registry.snapshot()['counters']
+    # Every throttled request was retried by the engine, none within botocore
+    assert local.throttled_counts['BatchWriteItem'] > 0
+    assert counters['write_throttles'] == local.throttled_counts['BatchWriteItem']
+    assert counters['write_retries'] >= counters['write_throttles']
+    assert counters.get('read_throttles', 0) == local.throttled_counts.get('BatchGetItem', 0)
+
+def test_import_sharded(local, csv_file):
+    summary = import_sharded(csv_file)
+    assert summary == {'rows': ROWS, 'failed': 0, 'status_file': "write_status.csv"}
+    assert_imported(local, read_status("write_status.csv"))
+    assert_throttles_counted(local)
+    assert not os.path.exists(journal.journal_name('devices.csv', TABLE_NAME))
+
+def test_writer_threads_are_kept_across_chunks(local, csv_file, monkeypatch):
+    batch_write = export_csv.batch_write
+    threads = set()
+    def recording_batch_write(*args):
+        threads.add(threading.get_ident())
+        return batch_write(*args)
+    monkeypatch.setattr(export_csv, 'batch_write', recording_batch_write)
+    import_sharded(csv_file)
+    # Twelve chunks written by the same threads
+    assert len(threads) == export_csv.DEFAULT_WORKER_COUNT
+    assert_imported(local, read_status("write_status.csv"))
+
+@pytest.mark.parametrize('status_file_name', ["write_status.csv", "write_status.csv.gz"])
+def test_import_sharded_resumes_from_the_journal(local, csv_file, monkeypatch, status_file_name):
+    prep_write = crash_on_write(monkeypatch, 5)
+    with pytest.raises(Crash):
+        import_sharded(csv_file, status_file_name)
+    monkeypatch.setattr(export_csv, 'prep_write', prep_write)
+    # Rows written after the last commit, cut short by the crash, are dropped from the status file on resume
+    with open(status_file_name, 'ab') as status_file:
+        status_file.write(b'\x1f\x8b\x08\x00 unfinished row')
+    summary = import_sharded(csv_file, status_file_name, resume=True)
+    assert summary['rows'] < ROWS
+    assert_imported(local, read_status(status_file_name))
+
+def test_async_import_file(local, csv_file):
+    csv_file_name, column_names, output_column_names = csv_file
+    summary = async_engine.run(async_engine.import_file(TABLE_NAME, csv_file_name, column_names, output_column_names,
+                                                        benchmark.PARTITION_KEY, benchmark.SORT_KEY,
+                                                        client=local_dynamodb.LocalAsyncClient(local)))
+    assert summary == {'rows': ROWS, 'failed': 0, 'status_file': "write_status.csv"}
+    assert_imported(local, read_status("write_status.csv"))
+    assert_throttles_counted(local)
+
+def test_async_import_file_resumes_a_sharded_journal(local, csv_file):
+    csv_file_name, column_names, output_column_names = csv_file
+    journal.start_journal(journal.journal_name(csv_file_name, TABLE_NAME), csv_file_name,
+                          sharded_import.plan_shards(csv_file_name, 3))
+    summary = async_engine.run(async_engine.import_file(TABLE_NAME, csv_file_name, column_names, output_column_names,
+                                                        benchmark.PARTITION_KEY, benchmark.SORT_KEY, validation=False,
+                                                        resume=True, client=local_dynamodb.LocalAsyncClient(local)))
+    assert summary == {'rows': ROWS, 'failed': 0, 'status_file': "write_status.csv"}
+    assert_imported(local, read_status("write_status.csv"))
+    assert sorted(os.listdir('.')) == ['devices.csv', 'write_status.csv']
+
+def test_conditions_grouped_in_parentheses_are_parsed():
+    request = {'ExpressionAttributeNames': {'#n0': 'Time Bucket', '#n1': 'Time'},
+               'ExpressionAttributeValues': {':v0': {'S': '2019-04-16T00'}, ':v1': {'S': '2019-04-16T00:00:00'},
+                                             ':v2': {'S': '2019-04-16T00:24:00'}}}
+    # The way boto3 writes Key('Time Bucket').eq(...) & Key('Time').between(...)
+    assert local_dynamodb.parse_conditions('(#n0 = :v0 AND #n1 BETWEEN :v1 AND :v2)', request) == {
+        'Time Bucket': ('=', [{'S': '2019-04-16T00'}]),
+        'Time': ('between', [{'S': '2019-04-16T00:00:00'}, {'S': '2019-04-16T00:24:00'}]),
+    }
+    with pytest.raises(local_dynamodb.LocalError):
+        local_dynamodb.parse_conditions('(#n0 = :v0 AND #n1 BETWEEN :v1 AND :v2', request)
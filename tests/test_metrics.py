@@ -0,0 +1,37 @@
+"""
+Profiles an import into the throttling local stand-in, checking that the profile covers the worker threads and that
+the throttles and retries are counted.
+"""
+
+import os
+import pstats
+import benchmark
+import create_table
+import export_csv
+import metrics
+import sharded_import
+
+ROWS = 1000
+TABLE_NAME = 'devices'
+
+def test_profile_covers_the_worker_threads(install_local, monkeypatch, tmp_path):
+    local = install_local(throttle_rate=0.1, seed=1)
+    create_table.create_dynamoDB_table(TABLE_NAME, benchmark.PARTITION_KEY, benchmark.SORT_KEY, None, 5, 1000,
+                                       'PROVISIONED')
+    benchmark.generate_csv('devices.csv', ROWS)
+    profile_file_name = str(tmp_path / 'import.prof')
+    monkeypatch.setenv(metrics.PROFILE_VARIABLE, profile_file_name)
+    column_names, item_chunks, output_column_names = export_csv.read_csv('devices.csv')
+    item_chunks.close()
+    metrics.registry.reset()
+    sharded_import.import_sharded(TABLE_NAME, 'devices.csv', column_names, output_column_names,
+                                  benchmark.PARTITION_KEY, benchmark.SORT_KEY, 1, validation=False)
+    stats = pstats.Stats(profile_file_name + '.' + str(os.getpid()))
+    profiled_functions = {function_name for file_name, line, function_name in stats.stats}
+    # The writes and the parsing of the CSV file only run on the worker and reader threads
+    assert 'batch_write' in profiled_functions
+    assert 'parse_row' in profiled_functions
+    counters = metrics.registry.snapshot()['counters']
+    assert local.throttled_counts['BatchWriteItem'] > 0
+    assert counters['write_throttles'] == local.throttled_counts['BatchWriteItem']
+    assert counters['write_retries'] >= counters['write_throttles']
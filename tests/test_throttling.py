@@ -0,0 +1,65 @@
+"""
+Imports into a provisioned table of the local stand-in that throttles a share of the requests, checking that the
+throttled requests reach the shared rate limiter instead of being retried within botocore.
+"""
+
+import pytest
+import aws_clients
+import benchmark
+import create_table
+import export_csv
+import metrics
+import rate_limiter
+import sharded_import
+
+ROWS = 2000
+TABLE_NAME = 'devices'
+WRITE_CAPACITY = 2000
+
+@pytest.fixture
+def local(install_local):
+    local = install_local(throttle_rate=0.2, seed=1)
+    create_table.create_dynamoDB_table(TABLE_NAME, benchmark.PARTITION_KEY, benchmark.SORT_KEY, None, 5, WRITE_CAPACITY,
+                                       'PROVISIONED')
+    benchmark.generate_csv('devices.csv', ROWS)
+    return local
+
+def test_throttled_writes_slow_the_rate_limiter(local):
+    limiter = rate_limiter.from_table(aws_clients.table(TABLE_NAME))
+    rates = []
+    throttled = limiter.throttled
+    def record_rate(attempt):
+        throttled(attempt)
+        rates.append(limiter.rate)
+    limiter.throttled = record_rate
+    column_names, item_chunks, output_column_names = export_csv.read_csv('devices.csv')
+    item_chunks.close()
+    metrics.registry.reset()
+    summary = sharded_import.import_sharded(TABLE_NAME, 'devices.csv', column_names, output_column_names,
+                                            benchmark.PARTITION_KEY, benchmark.SORT_KEY, 1, validation=False,
+                                            limiter=limiter)
+    assert summary['failed'] == 0
+    assert local.tables[TABLE_NAME].item_count == ROWS
+    throttles = local.throttled_counts['BatchWriteItem']
+    assert throttles > 0
+    # Every throttled request was retried by the import, none within botocore
+    counters = metrics.registry.snapshot()['counters']
+    assert counters['write_throttles'] == throttles
+    assert counters['write_retries'] >= throttles
+    assert len(rates) >= throttles
+    assert min(rates) < WRITE_CAPACITY
+
+def test_index_capacity_is_not_charged_to_the_table(install_local):
+    install_local(seed=1)
+    create_table.create_dynamoDB_table(TABLE_NAME, benchmark.PARTITION_KEY, benchmark.SORT_KEY, 'hour', 5, WRITE_CAPACITY,
+                                       'PROVISIONED')
+    benchmark.generate_csv('devices.csv', ROWS)
+    limiter = rate_limiter.from_table(aws_clients.table(TABLE_NAME))
+    column_names, item_chunks, output_column_names = export_csv.read_csv('devices.csv')
+    item_chunks.close()
+    metrics.registry.reset()
+    sharded_import.import_sharded(TABLE_NAME, 'devices.csv', column_names, output_column_names, benchmark.PARTITION_KEY,
+                                  benchmark.SORT_KEY, 1, validation=False, time_bucket='hour', limiter=limiter)
+    # Every item also costs a unit of the time bucket index, which has its own capacity
+    assert limiter.units_per_item == 1
+    assert metrics.registry.snapshot()['counters']['consumed_write_capacity'] == ROWS
@@ -0,0 +1,94 @@
+"""
+This module handles the time bucket secondary index. Every item gets a TimeBucket attribute holding the hour or day
+of its sort key, and a global secondary index keyed on TimeBucket and the sort key lets a time range search query only
+the buckets that overlap the range instead of scanning the whole table.
+"""
+
+from datetime import datetime, timedelta
+
+TIME_BUCKET_ATTRIBUTE = 'TimeBucket'
+INDEX_PREFIX = 'TimeBucketIndex-'
+# Length of the ISO timestamp prefix that forms the bucket, and the distance between two buckets
+GRANULARITIES = {
+    'hour': (13, timedelta(hours=1)),
+    'day': (10, timedelta(days=1)),
+}
+
+def index_name(granularity):
+    """
+    Returns the name of the time bucket index for the given granularity
+
+    Args:
+        granularity: Either hour or day
+    """
+    return INDEX_PREFIX + granularity
+
+def granularity_from_table(table_description):
+    """
+    Returns the granularity of the time bucket index of a table, or None if the table has no such index
+
+    Args:
+        table_description: The Table element of the describe_table response
+    """
+    for index in table_description.get('GlobalSecondaryIndexes', []):
+        if index['IndexName'].startswith(INDEX_PREFIX):
+            granularity = index['IndexName'][len(INDEX_PREFIX):]
+            if granularity in GRANULARITIES:
+                return granularity
+    return None
+
+def check_sort_key(sort_key_col_name, timestamp_columns):
+    """
+    Raises a ValueError when the sort key is not a timestamp column, whose values could not be bucketed
+
+    Args:
+        sort_key_col_name: This is the name of the sort key (range key)
+        timestamp_columns: The names of the columns converted to ISO formatted timestamps
+    """
+    if sort_key_col_name not in timestamp_columns:
+        raise ValueError("The time bucket index needs a timestamp sort key, " + sort_key_col_name + " is not a timestamp column")
+
+def bucket_of(time_value, granularity):
+    """
+    Returns the bucket of an ISO formatted time value, eg: 2019-04-16T02 for hourly buckets
+
+    Args:
+        time_value: The ISO formatted time
+        granularity: Either hour or day
+    """
+    return time_value[:GRANULARITIES[granularity][0]]
+
+def buckets_between(low_value, high_value, granularity):
+    """
+    Returns every bucket overlapping the range between two ISO formatted time values
+
+    Args:
+        low_value: The low range value
+        high_value: The high range value
+        granularity: Either hour or day
+    """
+    length, step = GRANULARITIES[granularity]
+    bucket_format = "%Y-%m-%dT%H" if granularity == 'hour' else "%Y-%m-%d"
+    current = datetime.strptime(bucket_of(low_value, granularity), bucket_format)
+    last = bucket_of(high_value, granularity)
+    buckets = []
+    while current.isoformat()[:length] <= last:
+        buckets.append(current.isoformat()[:length])
+        current += step
+    return buckets
+
+def add_time_bucket(item_chunks, time_col_name, granularity):
+    """
+    Generator that adds the TimeBucket attribute to the items of every chunk as it is read. Items with an empty time
+    value are left out of the index.
+
+    Args:
+        item_chunks: The generator of CSV row chunks returned by read_csv
+        time_col_name: The name of the column the bucket is derived from, the sort key of the table
+        granularity: Either hour or day
+    """
+    for item_collection in item_chunks:
+        for item in item_collection:
+            if item.get(time_col_name):
+                item[TIME_BUCKET_ATTRIBUTE] = bucket_of(item[time_col_name], granularity)
+        yield item_collection
@@ -0,0 +1,121 @@
+"""
+This module converts the timestamps read from the CSV file to ISO format. The layout of a column is detected once from
+its first value instead of trying every format on every row, the values are split with a fixed-layout parser instead of
+strptime, and converted values are cached because device logs repeat the same minute many times.
+"""
+
+from datetime import datetime
+
+DEFAULT_TIMESTAMP_COLUMNS = ('Time', 'time')
+CACHE_SIZE = 65536
+
+class TimestampNormaliser:
+    """
+    Converts the values of one timestamp column to ISO format. A new normaliser should be used for every file, since the
+    layout is detected from the first value it sees.
+    """
+    def __init__(self):
+        self.parser = None
+        self._cache = {}
+
+    def normalise(self, value):
+        """
+        Returns the ISO formatted value, raising ValueError if the value is not a timestamp in a supported layout
+
+        Args:
+            value: The timestamp read from the CSV file
+        """
+        try:
+            return self._cache[value]
+        except KeyError:
+            pass
+        if self.parser is None:
+            self.parser = detect_format(value)
+        try:
+            iso_value = self.parser(value)
+        except (ValueError, TypeError):
+            # A row in another supported layout, eg: a file mixing 16-4-19 and 16/4/19
+            iso_value = detect_format(value)(value)
+        if len(self._cache) >= CACHE_SIZE:
+            self._cache.clear()
+        self._cache[value] = iso_value
+        return iso_value
+
+def detect_format(value):
+    """
+    Returns the parser for the layout of a timestamp, eg: 16/4/19 2:22, 16-4-19 2:22 or 2019-04-16T02:22:00
+
+    Args:
+        value: The timestamp read from the CSV file
+    """
+    date_part = value.strip().split(' ')[0]
+    for separator in ('/', '-'):
+        parts = date_part.split(separator)
+        if len(parts) == 3 and len(parts[0]) <= 2 and len(parts[2]) <= 2:
+            return day_month_year_parser(separator)
+    try:
+        datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError("time data '" + value + "' does not match any of the supported formats")
+    return parse_iso
+
+def day_month_year_parser(separator):
+    """
+    Returns a parser for timestamps laid out as day, month and two digit year followed by hours and minutes, the same
+    values strptime accepts for %d/%m/%y %H:%M
+
+    Args:
+        separator: The character between the day, month and year
+    """
+    def parse(value):
+        try:
+            date_part, time_part = value.split()
+            day, month, year = date_part.split(separator)
+            hour, minute = time_part.split(':')
+        except ValueError:
+            raise ValueError("time data '" + value + "' does not match format")
+        if len(year) > 2 or len(hour) > 2 or len(minute) > 2:
+            raise ValueError("time data '" + value + "' does not match format")
+        year = int(year)
+        year += 2000 if year < 69 else 1900
+        return datetime(year, int(month), int(day), int(hour), int(minute)).isoformat()
+    return parse
+
+def parse_iso(value):
+    """
+    Parser for timestamps that are already in ISO format, eg: a file exported from DynamoDB
+
+    Args:
+        value: The timestamp read from the CSV file
+    """
+    return datetime.fromisoformat(value).isoformat()
+
+def parse_timestamp_columns(text, column_names=None):
+    """
+    Returns the timestamp columns listed in a comma separated text, such as an answer or a manifest cell. A blank text
+    gives the default columns and none gives no timestamp column. It raises a ValueError naming the columns that are not
+    in the file.
+
+    Args:
+        text: The comma separated names of the timestamp columns
+        column_names: This is the list of the headers in the csv, the names are not checked when not given
+    """
+    if not text.strip():
+        return DEFAULT_TIMESTAMP_COLUMNS
+    if text.strip().lower() == 'none':
+        return ()
+    timestamp_columns = tuple(column_name.strip() for column_name in text.split(',') if column_name.strip())
+    unknown = [column_name for column_name in timestamp_columns if column_names is not None and column_name not in column_names]
+    if unknown:
+        raise ValueError("The file has no column " + ", ".join(unknown))
+    return timestamp_columns
+
+def normalisers_for(column_names, timestamp_columns=DEFAULT_TIMESTAMP_COLUMNS):
+    """
+    Returns a dictionary mapping the position of every timestamp column to a new normaliser
+
+    Args:
+        column_names: This is the list of the headers in the csv
+        timestamp_columns: The names of the columns holding timestamps
+    """
+    return {position: TimestampNormaliser() for position, column_name in enumerate(column_names) if column_name in timestamp_columns}
@@ -1,39 +1,270 @@
 """
-This module updates the provisioned read/write units after the data has been inserted. We provisioned 100 read and 300 write units
-initially to speed up the export process. As we get billed based on the provisioned units, it is better to bring the capacity down after 
-writing data.
+This module updates the provisioned read/write units of the table around an import. The capacity is raised to the plan made
+by capacity_planner before the data is written and, as we get billed based on the provisioned units, brought back down
+after writing data. DynamoDB only allows a few decreases per day, so a decrease that would go over the limit is skipped.
+The tables created for an import are brought down to the idle capacity, while an existing table gets back the capacity
+it had before, or is switched back to its provisioned capacity if it was switched to on-demand billing for the import.
 """
 
-import boto3
+import aws_clients
+from botocore.exceptions import ClientError
+from datetime import datetime, timedelta, timezone
 
+IDLE_READ_CAPACITY = 5
+IDLE_WRITE_CAPACITY = 5
+# DynamoDB allows 4 decreases at any time of the day, and one more whenever there was no decrease in the last hour
+FREE_DECREASES_PER_DAY = 4
+DECREASE_INTERVAL = timedelta(hours=1)
+# The tables switched to on-demand billing by scale_capacity, with the update_table arguments restoring their capacity
+switched_tables = {}
+# The tables whose provisioned capacity was raised by scale_capacity, with the update_table arguments restoring it
+scaled_tables = {}
 
-def reduce_capacity(table_name):
+
+def scale_capacity(table_name, read_capacity, write_capacity, billing_mode='PROVISIONED'):
     """
-    This function reduces the provisioned capacity units of the table
+    This function raises the provisioned capacity units of the table and its indexes before an import. Capacity that is
+    already higher is left as it is. With on-demand billing the table is switched to on-demand instead. Either way
+    reduce_capacity gives the table back its current provisioned capacity after the import. When DynamoDB does not
+    allow another switch of the billing mode yet, the provisioned capacity is raised instead.
 
     Args:
         table_name: The name of the table
+        read_capacity: The read capacity units needed by the import
+        write_capacity: The write capacity units needed by the import
+        billing_mode: PROVISIONED, or PAY_PER_REQUEST to switch the table to on-demand billing
     """
     try:
+        client = aws_clients.client()
+        response = {'Table': aws_clients.describe_table(table_name, refresh=True)}
+        if is_on_demand(response['Table']):
+            return "The table uses on-demand billing, no capacity to scale"
+        limit_message = ""
+        if billing_mode == 'PAY_PER_REQUEST':
+            try:
+                client.update_table(TableName=table_name, BillingMode='PAY_PER_REQUEST')
+            except ClientError as e:
+                if not is_billing_mode_limit(e):
+                    raise
+                limit_message = "DynamoDB does not allow another switch of the billing mode of the table yet: " + str(e) + ". "
+            else:
+                switched_tables[table_name] = provisioned_capacity(response['Table'])
+                client.get_waiter('table_exists').wait(TableName=table_name)
+                aws_clients.forget_table(table_name)
+                return "Successfully switched to on-demand billing, the provisioned capacity is restored after the import"
+        scaled_tables[table_name] = provisioned_capacity(response['Table'])
+        update_args = capacity_updates(response['Table'], read_capacity, write_capacity, decrease=False)
+        if not update_args:
+            return limit_message + "Provisioned Capacity already at " + str(read_capacity) + " read and " + str(write_capacity) + " write units"
+        client.update_table(TableName=table_name, **update_args)
+        client.get_waiter('table_exists').wait(TableName=table_name)
+        aws_clients.forget_table(table_name)
+        return limit_message + "Successfully increased capacity to at least " + str(read_capacity) + " read and " + str(write_capacity) + " write units"
+    except Exception as e:
+        return str(e)
 
-        client = boto3.client('dynamodb')
-        response = client.describe_table(
-                TableName=table_name
-                )
-        provisioned_read_capacity = response['Table']['ProvisionedThroughput']['ReadCapacityUnits']
-        provisioned_write_capacity = response['Table']['ProvisionedThroughput']['WriteCapacityUnits']
-        if provisioned_read_capacity != 5 and provisioned_write_capacity != 5:
+def reduce_capacity(table_name, read_capacity=IDLE_READ_CAPACITY, write_capacity=IDLE_WRITE_CAPACITY):
+    """
+    This function reduces the provisioned capacity units of the table and its indexes, as long as the daily limit of
+    decreases allows it. A table scaled by scale_capacity gets back the provisioned capacity it had before instead,
+    so only the tables created for the import are brought down to the given capacity.
+
+    Args:
+        table_name: The name of the table
+        read_capacity: The read capacity units to reduce to
+        write_capacity: The write capacity units to reduce to
+    """
+    try:
+
+        client = aws_clients.client()
+        if table_name in switched_tables:
+            return restore_provisioned(table_name)
+        if table_name in scaled_tables:
+            return restore_capacity(table_name)
+        response = {'Table': aws_clients.describe_table(table_name, refresh=True)}
+        if is_on_demand(response['Table']):
+            return "The table uses on-demand billing, no capacity to reduce"
+        update_args = capacity_updates(response['Table'], read_capacity, write_capacity, decrease=True)
+        if update_args:
             response = client.update_table(
-                ProvisionedThroughput={
-                    'ReadCapacityUnits': 5,
-                    'WriteCapacityUnits': 5,
-                },
                 TableName=table_name,
+                **update_args
             )
-            return "Successfully reduced capacity to 5 units"
+            aws_clients.forget_table(table_name)
+            return "Successfully reduced capacity to " + str(write_capacity) + " units"
+        elif capacity_updates(response['Table'], read_capacity, write_capacity, decrease=True, check_limit=False):
+            return "The daily limit of capacity decreases has been reached, the capacity was not reduced"
         else:
-            return "Provisioned Capacity already at 5 units"
+            return "Provisioned Capacity already at " + str(write_capacity) + " units"
     except Exception as e:
         return str(e)
 
+def restore_provisioned(table_name):
+    """
+    Switches a table that scale_capacity switched to on-demand billing back to its provisioned capacity. When DynamoDB
+    does not allow another switch of the billing mode yet, the table stays on-demand and the capacity to restore later
+    is reported.
+
+    Args:
+        table_name: The name of the table
+    """
+    update_args = switched_tables[table_name]
+    throughput = update_args['ProvisionedThroughput']
+    capacity = str(throughput['ReadCapacityUnits']) + " read and " + str(throughput['WriteCapacityUnits']) + " write units"
+    try:
+        aws_clients.client().update_table(TableName=table_name, BillingMode='PROVISIONED', **update_args)
+    except ClientError as e:
+        if not is_billing_mode_limit(e):
+            raise
+        return ("DynamoDB does not allow another switch of the billing mode of the table yet: " + str(e) + ". The table "
+                "stays on-demand, switch it back to provisioned billing with " + capacity + " once the limit allows it")
+    del switched_tables[table_name]
+    aws_clients.forget_table(table_name)
+    return "Successfully switched back to provisioned billing with " + capacity
+
+def restore_capacity(table_name):
+    """
+    Brings a table whose capacity was raised by scale_capacity, and its indexes, back to the provisioned capacity they
+    had before, as long as the daily limit of decreases allows it
 
+    Args:
+        table_name: The name of the table
+    """
+    original = scaled_tables.pop(table_name)
+    throughput = original['ProvisionedThroughput']
+    capacity = str(throughput['ReadCapacityUnits']) + " read and " + str(throughput['WriteCapacityUnits']) + " write units"
+    table_description = aws_clients.describe_table(table_name, refresh=True)
+    update_args = {}
+    limited = False
+    throughput = new_throughput(table_description['ProvisionedThroughput'], throughput['ReadCapacityUnits'],
+                                throughput['WriteCapacityUnits'], decrease=True, check_limit=False)
+    if throughput and decrease_allowed(table_description['ProvisionedThroughput']):
+        update_args['ProvisionedThroughput'] = throughput
+    elif throughput:
+        limited = True
+    original_indexes = {each['Update']['IndexName']: each['Update']['ProvisionedThroughput']
+                        for each in original.get('GlobalSecondaryIndexUpdates', [])}
+    index_updates = []
+    for index in table_description.get('GlobalSecondaryIndexes', []):
+        if index['IndexName'] not in original_indexes:
+            continue
+        throughput = new_throughput(index['ProvisionedThroughput'], original_indexes[index['IndexName']]['ReadCapacityUnits'],
+                                    original_indexes[index['IndexName']]['WriteCapacityUnits'], decrease=True, check_limit=False)
+        if throughput and decrease_allowed(index['ProvisionedThroughput']):
+            index_updates.append({'Update': {'IndexName': index['IndexName'], 'ProvisionedThroughput': throughput}})
+        elif throughput:
+            limited = True
+    if index_updates:
+        update_args['GlobalSecondaryIndexUpdates'] = index_updates
+    if update_args:
+        aws_clients.client().update_table(TableName=table_name, **update_args)
+        aws_clients.forget_table(table_name)
+    if limited:
+        return "The daily limit of capacity decreases has been reached, the capacity was not fully restored to " + capacity
+    if not update_args:
+        return "Provisioned Capacity already at " + capacity
+    return "Successfully restored the capacity of " + capacity + " the table had before the import"
+
+def provisioned_capacity(table_description):
+    """
+    Returns the update_table arguments giving the table and its global secondary indexes their current provisioned
+    capacity again after a switch to on-demand billing
+
+    Args:
+        table_description: The Table element of the describe_table response
+    """
+    def throughput(current):
+        return {'ReadCapacityUnits': current['ReadCapacityUnits'], 'WriteCapacityUnits': current['WriteCapacityUnits']}
+    update_args = {'ProvisionedThroughput': throughput(table_description['ProvisionedThroughput'])}
+    index_updates = [{'Update': {'IndexName': index['IndexName'], 'ProvisionedThroughput': throughput(index['ProvisionedThroughput'])}}
+                     for index in table_description.get('GlobalSecondaryIndexes', [])]
+    if index_updates:
+        update_args['GlobalSecondaryIndexUpdates'] = index_updates
+    return update_args
+
+def is_billing_mode_limit(error):
+    """
+    Checks whether update_table failed because the billing mode of the table was switched too recently. DynamoDB only
+    allows a few switches of the billing mode in 24 hours.
+
+    Args:
+        error: The ClientError raised by update_table
+    """
+    return (error.response['Error']['Code'] in ('LimitExceededException', 'ValidationException')
+            and 'billing mode' in str(error).lower())
+
+def capacity_updates(table_description, read_capacity, write_capacity, decrease, check_limit=True):
+    """
+    Returns the arguments of update_table that bring the table and its global secondary indexes to the given capacity,
+    or an empty dictionary if nothing needs to change. When raising the capacity, units that are already higher are
+    kept. When decreasing it, the table and indexes that have used up their decreases for the day are left out.
+
+    Args:
+        table_description: The Table element of the describe_table response
+        read_capacity: The target read capacity units
+        write_capacity: The target write capacity units
+        decrease: Whether the capacity is being reduced
+        check_limit: Whether the daily limit of decreases is checked
+    """
+    update_args = {}
+    throughput = new_throughput(table_description['ProvisionedThroughput'], read_capacity, write_capacity, decrease, check_limit)
+    if throughput:
+        update_args['ProvisionedThroughput'] = throughput
+    # The time bucket index has its own provisioned capacity which has to be changed as well
+    index_updates = []
+    for index in table_description.get('GlobalSecondaryIndexes', []):
+        throughput = new_throughput(index['ProvisionedThroughput'], read_capacity, write_capacity, decrease, check_limit)
+        if throughput:
+            index_updates.append({
+                'Update': {
+                    'IndexName': index['IndexName'],
+                    'ProvisionedThroughput': throughput,
+                }
+            })
+    if index_updates:
+        update_args['GlobalSecondaryIndexUpdates'] = index_updates
+    return update_args
+
+def new_throughput(current, read_capacity, write_capacity, decrease, check_limit=True):
+    """
+    Returns the ProvisionedThroughput to set on a table or index, or None if it should not change
+
+    Args:
+        current: The ProvisionedThroughput element of the describe_table response
+        read_capacity: The target read capacity units
+        write_capacity: The target write capacity units
+        decrease: Whether the capacity is being reduced
+        check_limit: Whether the daily limit of decreases is checked
+    """
+    if not decrease:
+        read_capacity = max(read_capacity, current['ReadCapacityUnits'])
+        write_capacity = max(write_capacity, current['WriteCapacityUnits'])
+    if read_capacity == current['ReadCapacityUnits'] and write_capacity == current['WriteCapacityUnits']:
+        return None
+    if decrease and check_limit and not decrease_allowed(current):
+        return None
+    return {
+        'ReadCapacityUnits': read_capacity,
+        'WriteCapacityUnits': write_capacity,
+    }
+
+def decrease_allowed(current):
+    """
+    Checks whether DynamoDB still allows a decrease of the capacity of a table or index today
+
+    Args:
+        current: The ProvisionedThroughput element of the describe_table response
+    """
+    if current.get('NumberOfDecreasesToday', 0) < FREE_DECREASES_PER_DAY:
+        return True
+    last_decrease = current.get('LastDecreaseDateTime')
+    return last_decrease is None or datetime.now(timezone.utc) - last_decrease >= DECREASE_INTERVAL
+
+def is_on_demand(table_description):
+    """
+    Checks whether the table uses on-demand billing
+
+    Args:
+        table_description: The Table element of the describe_table response
+    """
+    return table_description.get('BillingModeSummary', {}).get('BillingMode') == 'PAY_PER_REQUEST'
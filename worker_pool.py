@@ -0,0 +1,160 @@
+"""
+This module provides the thread pool used to spread DynamoDB requests over several worker threads. Work is handed out
+through a bounded queue, so every worker pulls the next piece of work as soon as it is free instead of being given a
+fixed share up front. A WorkerPool keeps its threads alive across several runs of work, eg: the chunks of an import.
+"""
+
+from threading import Thread, Barrier
+import queue
+import metrics
+
+QUEUE_DEPTH = 2
+PUT_TIMEOUT = 1
+
+class ThreadWithReturnValue(Thread):
+    def __init__(self, group=None, target=None, name=None,
+                 args=(), kwargs={}, Verbose=None):
+        Thread.__init__(self, group, target, name, args, kwargs)
+        self._return = None
+    def run(self):
+        if self._target is not None:
+            with metrics.thread_profiled():
+                self._return = self._target(*self._args,
+                                                    **self._kwargs)
+    def join(self, *args):
+        Thread.join(self, *args)
+        return self._return
+
+def run_workers(target, work_items, worker_count, args=()):
+    """
+    Starts worker_count threads and feeds work_items to them through a bounded queue. Each thread calls
+    target(*args, work_queue, thread_name) and should consume the queue with iter_queue. The calling thread blocks
+    while the queue is full, so at most worker_count * QUEUE_DEPTH items are waiting at any time.
+
+    Args:
+        target: The function run by every worker thread
+        work_items: An iterable of the units of work
+        worker_count: The number of worker threads
+        args: Extra positional arguments passed to target before the queue
+    """
+    worker_count = max(1, int(worker_count))
+    work_queue = queue.Queue(maxsize=worker_count * QUEUE_DEPTH)
+    workers = []
+    for number in range(1, worker_count + 1):
+        worker = ThreadWithReturnValue(target=target, args=tuple(args) + (work_queue, "thread-" + str(number)))
+        worker.daemon = True
+        worker.start()
+        workers.append(worker)
+    for work_item in work_items:
+        put_work(work_queue, work_item, workers)
+    for worker in workers:
+        put_work(work_queue, None, workers)
+    return [worker.join() for worker in workers]
+
+class WorkerPool:
+    """
+    Worker threads kept alive across several runs of work, so a long import does not start and join its threads for
+    every chunk. Every run hands its work items to the threads through a bounded queue like run_workers, and each
+    thread calls target(*args, work_queue, thread_name) once per run. The threads are stopped when the pool is closed,
+    or at the end of the with statement using it.
+
+    Args:
+        target: The function run by every worker thread
+        worker_count: The number of worker threads
+        args: Extra positional arguments passed to target before the queue
+    """
+    def __init__(self, target, worker_count, args=()):
+        self.worker_count = max(1, int(worker_count))
+        self._target = target
+        self._args = tuple(args)
+        self._work_queue = queue.Queue(maxsize=self.worker_count * QUEUE_DEPTH)
+        self._results = queue.Queue()
+        # The threads and the caller meet before every run, so each thread takes exactly one stop marker per run
+        self._start = Barrier(self.worker_count + 1)
+        self._closed = False
+        self._workers = []
+        for number in range(1, self.worker_count + 1):
+            worker = Thread(target=self._serve, args=("thread-" + str(number),), daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _serve(self, thread_name):
+        with metrics.thread_profiled():
+            while True:
+                self._start.wait()
+                if self._closed:
+                    return
+                try:
+                    result = self._target(*self._args + (self._work_queue, thread_name))
+                except Exception as e:
+                    result = e
+                self._results.put((thread_name, result))
+
+    def run(self, work_items):
+        """
+        Feeds work_items to the threads and waits for all of them to finish the run. It returns the values returned
+        by target in every thread, in the order of the threads, and raises the error of a thread that failed.
+
+        Args:
+            work_items: An iterable of the units of work
+        """
+        self._start.wait()
+        try:
+            for work_item in work_items:
+                put_work(self._work_queue, work_item, self._workers)
+        finally:
+            # The threads are always stopped, so the next run or close does not wait for them forever
+            for worker in self._workers:
+                put_work(self._work_queue, None, self._workers)
+            results = dict(self._results.get() for worker in self._workers)
+        for result in results.values():
+            if isinstance(result, Exception):
+                raise result
+        return [results["thread-" + str(number)] for number in range(1, self.worker_count + 1)]
+
+    def close(self):
+        """
+        Stops the worker threads once they have finished the current run
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._start.wait()
+        for worker in self._workers:
+            worker.join()
+
+def put_work(work_queue, work_item, workers):
+    """
+    Puts an item on the work queue, giving up if every worker thread has died so the caller never blocks forever
+
+    Args:
+        work_queue: The queue shared by the workers
+        work_item: The unit of work, None tells a worker to stop
+        workers: The list of worker threads consuming the queue
+    """
+    while True:
+        try:
+            work_queue.put(work_item, timeout=PUT_TIMEOUT)
+            return
+        except queue.Full:
+            if not any(worker.is_alive() for worker in workers):
+                raise RuntimeError("All worker threads stopped before the work queue was drained")
+
+def iter_queue(work_queue):
+    """
+    Generator used by the worker threads to take items off the queue until the stop marker is reached
+
+    Args:
+        work_queue: The queue shared by the workers
+    """
+    while True:
+        work_item = work_queue.get()
+        if work_item is None:
+            return
+        yield work_item